@@ -1,4 +1,7 @@
+import os
+from contextlib import contextmanager
 import mysql.connector as mysql
+from mysql.connector import pooling
 
 
 class DbConnector:
@@ -7,6 +10,13 @@ class DbConnector:
     Connector needs HOST, DATABASE, USER and PASSWORD to connect,
     while PORT is optional and should be 3306.
 
+    Settings that are not passed in are read from the environment variables
+    MYSQL_HOST, MYSQL_PORT, MYSQL_DATABASE, MYSQL_USER, MYSQL_PASSWORD and
+    MYSQL_POOL_SIZE, falling back to the defaults below.
+
+    With a POOL_SIZE the connector keeps a MySQLConnectionPool, and borrow()
+    hands out extra connections from it, e.g. for parallel writers.
+
     Example:
     HOST = "tdt4225-00.idi.ntnu.no" // Your server IP address/domain name
     DATABASE = "testdb" // Database name, if you just want to connect to MySQL server, leave it empty
@@ -15,30 +25,72 @@ class DbConnector:
     """
 
     def __init__(self,
-                 HOST="localhost",
-                 DATABASE="store_D",
-                 USER="cecilhu",
-                 PASSWORD="heihallo"):
+                 HOST=None,
+                 DATABASE=None,
+                 USER=None,
+                 PASSWORD=None,
+                 ALLOW_LOCAL_INFILE=False,
+                 POOL_SIZE=None):
+        self.config = {
+            "host": HOST or os.environ.get("MYSQL_HOST", "localhost"),
+            "port": int(os.environ.get("MYSQL_PORT", 3306)),
+            "database": DATABASE or os.environ.get("MYSQL_DATABASE", "store_D"),
+            "user": USER or os.environ.get("MYSQL_USER", "cecilhu"),
+            "password": PASSWORD or os.environ.get("MYSQL_PASSWORD", "heihallo"),
+            # Lets LOAD DATA LOCAL INFILE send files from this machine to the server
+            "allow_local_infile": ALLOW_LOCAL_INFILE,
+        }
+        if POOL_SIZE is None:
+            POOL_SIZE = int(os.environ.get("MYSQL_POOL_SIZE", 0))
+
         # Connect to the database
+        self.pool = None
         try:
-            self.db_connection = mysql.connect(host=HOST, database=DATABASE, user=USER, password=PASSWORD, port=3306)
+            if POOL_SIZE:
+                self.pool = pooling.MySQLConnectionPool(pool_name="store_D", pool_size=POOL_SIZE, **self.config)
+                self.db_connection = self.pool.get_connection()
+            else:
+                self.db_connection = mysql.connect(**self.config)
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
 
         # Get the db cursor
         self.cursor = self.db_connection.cursor()
 
-        print("Connected to:", self.db_connection.get_server_info())
+        self.server_info = self.db_connection.get_server_info()
+        print("Connected to:", self.server_info)
         # get database information
         self.cursor.execute("select database();")
         database_name = self.cursor.fetchone()
         print("You are connected to the database:", database_name)
         print("-----------------------------------------------\n")
 
+    @contextmanager
+    def borrow(self):
+        """
+        Borrows a connection from the pool and returns it when the block exits.
+
+        Without a pool, a new connection is opened and closed instead.
+
+        Yields:
+            (connection, cursor): The borrowed connection and a cursor on it.
+        """
+        if self.pool is not None:
+            connection = self.pool.get_connection()
+        else:
+            connection = mysql.connect(**self.config)
+        cursor = connection.cursor()
+        try:
+            yield connection, cursor
+        finally:
+            cursor.close()
+            # Closing a pooled connection returns it to the pool
+            connection.close()
+
     def close_connection(self):
         # close the cursor
         self.cursor.close()
         # close the DB connection
         self.db_connection.close()
         print("\n-----------------------------------------------")
-        print("Connection to %s is closed" % self.db_connection.get_server_info())
+        print("Connection to %s is closed" % self.server_info)
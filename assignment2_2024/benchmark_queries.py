@@ -0,0 +1,125 @@
+import argparse
+import time
+from tabulate import tabulate
+from DbConnector import DbConnector
+from insertions_faster import SCHEMAS
+from part2 import ALTITUDE_GAIN_QUERY, INVALID_ACTIVITIES_QUERY, TRACK_POINT_ORDER
+
+# The queries part2 used before the LAG() rewrite, pairing trackpoints by consecutive IDs.
+# Like the LAG() queries, {order} is filled in with the TRACK_POINT_ORDER column of the schema,
+# the compact schema numbers the trackpoints of each activity in seq instead of id
+ALTITUDE_GAIN_SELF_JOIN_QUERY = """
+    SELECT a.user_id,
+        SUM((tp2.altitude - tp1.altitude) * 0.3048) AS altitude_gain_meters
+    FROM TrackPoint tp1
+    JOIN TrackPoint tp2 ON tp1.activity_id = tp2.activity_id
+                        AND tp2.{order} = tp1.{order} + 1
+    JOIN Activity a ON tp1.activity_id = a.id
+    WHERE tp2.altitude != -777
+    AND tp1.altitude != -777
+    AND tp2.altitude > tp1.altitude
+    AND tp1.altitude >= -413
+    AND tp2.altitude >= -413
+    GROUP BY a.user_id
+    ORDER BY altitude_gain_meters DESC
+    LIMIT 20;
+"""
+
+INVALID_ACTIVITIES_SELF_JOIN_QUERY = """
+    SELECT a.user_id, COUNT(DISTINCT a.id) AS number_of_invalid_activities
+    FROM Activity a
+    JOIN TrackPoint tp1 ON a.id = tp1.activity_id
+    JOIN TrackPoint tp2 ON a.id = tp2.activity_id
+        AND tp2.{order} = tp1.{order} + 1
+    WHERE TIMESTAMPDIFF(MINUTE, tp1.date_time, tp2.date_time) >= 5
+    GROUP BY a.user_id;
+"""
+
+BENCHMARKS = [
+    ("altitude gain", ALTITUDE_GAIN_SELF_JOIN_QUERY, ALTITUDE_GAIN_QUERY),
+    ("invalid activities", INVALID_ACTIVITIES_SELF_JOIN_QUERY, INVALID_ACTIVITIES_QUERY),
+]
+
+
+def explain(cursor, query, analyze=False):
+    """
+    Returns the plan of a query in MySQL's tree format.
+
+    Args:
+        analyze (bool): Use EXPLAIN ANALYZE, which runs the query and adds actual row counts and times.
+    """
+    cursor.execute(f"EXPLAIN {'ANALYZE' if analyze else 'FORMAT=TREE'} {query.strip().rstrip(';')}")
+    return "\n".join(row[0] for row in cursor.fetchall())
+
+
+def time_query(cursor, query, repeat):
+    """
+    Runs a query repeat times.
+
+    Returns:
+        (seconds, rows): The fastest run time and the rows of the last run.
+    """
+    best = None
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def normalize(rows):
+    """
+    Sorts result rows and rounds their floats, since sums may differ in the last digits between plans.
+    """
+    return sorted(tuple(round(value, 3) if isinstance(value, float) else value for value in row) for row in rows)
+
+
+def benchmark_queries(connection, repeat=1, analyze=False, schema="standard"):
+    """
+    Prints the plans of the self-join and LAG() versions of the part2 queries and times them.
+
+    Args:
+        connection (DbConnector): Connection to a loaded database.
+        repeat (int): Number of timing runs per query, the fastest one is reported.
+        analyze (bool): Print EXPLAIN ANALYZE instead of EXPLAIN plans.
+        schema (str): The TrackPoint schema the database was loaded with, see insertions_faster.SCHEMAS.
+    """
+    cursor = connection.cursor
+    cursor.execute("SELECT COUNT(*) FROM TrackPoint")
+    print(f"TrackPoint rows: {cursor.fetchone()[0]}\n")
+
+    summary = []
+    for name, self_join_query, lag_query in BENCHMARKS:
+        self_join_query = self_join_query.format(order=TRACK_POINT_ORDER[schema])
+        lag_query = lag_query.format(order=TRACK_POINT_ORDER[schema])
+        for version, query in (("self-join", self_join_query), ("LAG()", lag_query)):
+            print(f"--- {name}, {version} ---")
+            print(explain(cursor, query, analyze))
+            print()
+
+        self_join_time, self_join_rows = time_query(cursor, self_join_query, repeat)
+        lag_time, lag_rows = time_query(cursor, lag_query, repeat)
+        # The self-join pairs trackpoints in ID order rather than time order, and misses pairs
+        # whose IDs are not contiguous, so the results may differ
+        same = normalize(self_join_rows) == normalize(lag_rows)
+        summary.append([name, f"{self_join_time:.2f}", f"{lag_time:.2f}", f"{self_join_time / lag_time:.1f}x", "yes" if same else "no"])
+
+    print(tabulate(summary, headers=["Query", "Self-join (s)", "LAG() (s)", "Speedup", "Same result"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the self-join and LAG() versions of the part2 queries.")
+    parser.add_argument("--repeat", type=int, default=1, help="timing runs per query (default: 1)")
+    parser.add_argument("--analyze", action="store_true", help="print EXPLAIN ANALYZE, which runs every query once more")
+    parser.add_argument("--schema", choices=SCHEMAS, default="standard",
+                        help="the TrackPoint schema the database was loaded with (default: standard)")
+    args = parser.parse_args()
+
+    connection = DbConnector()
+    try:
+        benchmark_queries(connection, args.repeat, args.analyze, args.schema)
+    finally:
+        connection.close_connection()
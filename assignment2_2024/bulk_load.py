@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+# Written in place of NULL by the spool files, as LOAD DATA expects
+NULL = "\\N"
+
+
+def format_value(value):
+    """
+    Formats a value the way LOAD DATA reads it from a tab-separated file.
+    """
+    if value is None:
+        return NULL
+    return str(value)
+
+
+class SpoolFile:
+    """
+    Tab-separated spool file of rows waiting to be loaded with LOAD DATA LOCAL INFILE.
+
+    Values must not contain tabs or newlines, which holds for the Geolife columns.
+    """
+
+    def __init__(self, table_name, columns, spool_dir=None):
+        self.table_name = table_name
+        self.columns = columns
+        fd, self.path = tempfile.mkstemp(prefix=f"{table_name}_", suffix=".tsv", dir=spool_dir)
+        self.file = os.fdopen(fd, 'w', newline='\n')
+        self.row_count = 0
+
+    def write_rows(self, rows):
+        """
+        Appends rows to the spool file.
+
+        Args:
+            rows (iterable): Tuples with one value per column.
+        """
+        write = self.file.write
+        for row in rows:
+            write('\t'.join(map(format_value, row)))
+            write('\n')
+            self.row_count += 1
+
+    def load(self, cursor):
+        """
+        Loads the spooled rows into the table and empties the spool file. Does not commit.
+
+        Args:
+            cursor: A cursor on a connection opened with allow_local_infile=True.
+
+        Returns:
+            row_count (int): The number of rows that were loaded.
+        """
+        self.file.flush()
+        row_count = self.row_count
+        if row_count:
+            query = f"""LOAD DATA LOCAL INFILE %s INTO TABLE {self.table_name}
+                        FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+                        ({', '.join(self.columns)})"""
+            cursor.execute(query, (self.path,))
+        self.file.seek(0)
+        self.file.truncate()
+        self.row_count = 0
+        return row_count
+
+    def close(self):
+        """
+        Closes and deletes the spool file.
+        """
+        self.file.close()
+        os.remove(self.path)
@@ -1,23 +1,101 @@
+import argparse
 import os
-from datetime import datetime
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from DbConnector import DbConnector
+import sys
+# The modules both assignments share live in the geolife package at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from geolife.grid_index import GridIndexBuilder
+from bulk_load import SpoolFile
+from geolife.label_index import LABEL_MATCHES, LabelIndex
 from tabulate import tabulate
-import itertools
+from geolife.parallel_ingest import IngestStats, iter_parsed_users
+from geolife.parse_cache import iter_cached_users
+from geolife.plt_reader import (COORDINATE_SCALE, SUMMARY_FIELDS, iter_plt_files, iter_user_activities, label_trajectory,
+                                list_user_folders, parse_user_folder, read_label_file, read_plt_with_hash)
+
+# Inserts the tuples of Trajectory.summary_row
+ACTIVITY_SUMMARY_INSERT = f"""INSERT INTO ActivitySummary (activity_id, {', '.join(SUMMARY_FIELDS)})
+                              VALUES ({', '.join(['%s'] * (len(SUMMARY_FIELDS) + 1))})"""
+
+# Recomputes the ActivityRollup rows of the users matched by the WHERE clause filled in with .format
+ACTIVITY_ROLLUP_REFRESH = """INSERT INTO ActivityRollup (user_id, year, transportation_mode, activity_count, hours,
+                                                         distance_km, trackpoint_count)
+                             SELECT a.user_id, YEAR(a.start_date_time), a.transportation_mode, COUNT(*),
+                                    SUM(TIMESTAMPDIFF(HOUR, a.start_date_time, a.end_date_time)),
+                                    COALESCE(SUM(s.distance_km), 0), COALESCE(SUM(s.trackpoint_count), 0)
+                             FROM Activity a
+                             LEFT JOIN ActivitySummary s ON s.activity_id = a.id
+                             {where}
+                             GROUP BY a.user_id, YEAR(a.start_date_time), a.transportation_mode"""
+
+# TrackPoint schemas, see create_track_point_table
+SCHEMAS = ("standard", "compact")
+# The TrackPoint columns the loaders write in each schema, in the order of Trajectory.rows and Trajectory.compact_rows
+TRACK_POINT_COLUMNS = {
+    "standard": ["activity_id", "lat", "lon", "altitude", "date_days", "date_time"],
+    "compact": ["activity_id", "seq", "lat_e7", "lon_e7", "altitude", "date_time"],
+}
+# Years with a TrackPoint partition of their own in the compact schema. Geolife has few points
+# before 2007, which share the first partition, and the last partition takes any later years
+PARTITION_YEARS = range(2007, 2013)
 
 
 class InsertGeolifeDataset:
     """
     Class for insertion of the Geolife dataset into the database.
     """
-    
 
-    def __init__(self):
+    # Secondary indexes built by create_indexes after the load, as (table, index name, columns, kind).
+    # They serve the filters in part2: user and mode lookups, date ranges on the start time,
+    # walking an activity's trackpoints in time order, and region queries on the location.
+    INDEX_PROFILE = [
+        ("Activity", "user_mode_start", "user_id, transportation_mode, start_date_time", "INDEX"),
+        ("Activity", "start_time", "start_date_time", "INDEX"),
+        ("TrackPoint", "activity_time", "activity_id, date_time", "INDEX"),
+        ("TrackPoint", "location", "location", "SPATIAL INDEX"),
+    ]
+    # The same for the compact schema. Its primary key already orders each activity's trackpoints,
+    # and partitioned tables have no spatial indexes, so regions are searched on the scaled coordinates
+    COMPACT_INDEX_PROFILE = [
+        ("Activity", "user_mode_start", "user_id, transportation_mode, start_date_time", "INDEX"),
+        ("Activity", "start_time", "start_date_time", "INDEX"),
+        ("TrackPoint", "location", "lat_e7, lon_e7", "INDEX"),
+    ]
+
+    def __init__(self, preallocate_ids=False, allow_local_infile=False, connection=None, pool_size=None, label_match="exact",
+                 schema="standard"):
         """
         Initializes the class and creates the connection to the database. 
+
+        Args:
+            preallocate_ids (bool): Assign activity IDs in the loader instead of reading
+                cursor.lastrowid, so activities can be inserted in batches with their trackpoints.
+            allow_local_infile (bool): Open the connection with LOAD DATA LOCAL INFILE enabled,
+                needed by traverse_folder_bulk.
+            connection (DbConnector): An existing connector to share, instead of opening a new one.
+            pool_size (int): Size of the connection pool, needed for more than one parallel writer.
+            label_match (str): How activities are matched to labels: "exact", "contains" or "overlap",
+                or "segment" to split activities at label boundaries into one activity per label.
+            schema (str): "standard" or "compact", the TrackPoint schema to create and load, see create_track_point_table.
         """
-        self.connection = DbConnector()
+        if schema not in SCHEMAS:
+            raise ValueError(f"Unknown TrackPoint schema {schema!r}, expected one of {SCHEMAS}")
+        self.connection = connection or DbConnector(ALLOW_LOCAL_INFILE=allow_local_infile, POOL_SIZE=pool_size)
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+        self.preallocate_ids = preallocate_ids
+        self.next_activity_id = None
+        self.label_match = label_match
+        self.schema = schema
+        self.track_point_columns = TRACK_POINT_COLUMNS[schema]
+        # Set to a GridIndexBuilder to collect the trackpoints for a local grid index during the load
+        self.grid_index_builder = None
+        # Set to a directory to read the parsed users from a parse cache instead of the .plt files, see parse_cache
+        self.parse_cache_dir = None
 
 #--------------------------CREATE TABLES-----------------------------
     def create_user_table(self):
@@ -61,7 +139,7 @@ class InsertGeolifeDataset:
 
     def create_track_point_table(self):
         """
-        Creates the TrackPoint table in the database.
+        Creates the TrackPoint table in the database, in the compact schema if the loader was created with it.
         
         Table schema:
             - id (INT): Primary key, unique for each trackpoint.
@@ -71,6 +149,8 @@ class InsertGeolifeDataset:
             - altitude (DOUBLE): The altitude of the trackpoint.
             - date_days (DOUBLE): The number of days since the start of the activity.
             - date_time (DATETIME): The date and time of the trackpoint.
+            - location (POINT): POINT(lon, lat) for the spatial index. Generated from lat and lon,
+              so every loader fills it, and invisible, so SELECT * leaves it out.
         """
         query = f"""CREATE TABLE IF NOT EXISTS TrackPoint (
             id INT PRIMARY KEY AUTO_INCREMENT,
@@ -80,11 +160,229 @@ class InsertGeolifeDataset:
             altitude DOUBLE,
             date_days DOUBLE,
             date_time DATETIME,
+            location POINT AS (POINT(lon, lat)) STORED NOT NULL SRID 0 INVISIBLE,
             FOREIGN KEY (activity_id) REFERENCES Activity(id))
                 """
+        if self.schema == "compact":
+            query = self.compact_track_point_table_query()
+        self.cursor.execute(query)
+        self.db_connection.commit()
+
+    def compact_track_point_table_query(self):
+        """
+        Returns the CREATE TABLE statement of the compact TrackPoint schema, which stores about
+        half the bytes per trackpoint and keeps each activity's trackpoints together on disk.
+
+        The primary key (activity_id, seq, date_time) clusters the rows by activity in file order,
+        so reading an activity is one range scan. date_time is in the key only because every unique
+        key of a partitioned table must contain the partitioning column. The table is partitioned
+        by the year of date_time, so queries with a date_time range only read the years they need.
+        Of the part2 queries only the distance query has one (see Part2.sum_trackpoint_distances),
+        the others ask about every year and read all partitions.
+        Partitioned tables support neither foreign keys nor spatial indexes, so it has neither.
+
+        Table schema:
+            - activity_id (INT): The activity, not enforced as a foreign key.
+            - seq (MEDIUMINT): Position of the trackpoint in its activity, from 0.
+            - lat, lon (DOUBLE): The coordinates, virtual columns computed from lat_e7 and lon_e7.
+            - altitude (FLOAT): The altitude in feet.
+            - date_days (DOUBLE): Days since 1899-12-30 as in the .plt files, a virtual column computed from date_time.
+            - date_time (DATETIME): The date and time of the trackpoint.
+            - lat_e7, lon_e7 (INT): The stored coordinates, scaled by COORDINATE_SCALE. Invisible, so
+              SELECT * returns the same coordinates as the standard schema.
+        """
+        partitions = [f"PARTITION p_before_{PARTITION_YEARS[0]} VALUES LESS THAN ({PARTITION_YEARS[0]})"]
+        partitions += [f"PARTITION p{year} VALUES LESS THAN ({year + 1})" for year in PARTITION_YEARS]
+        partitions.append("PARTITION p_later VALUES LESS THAN MAXVALUE")
+        # 693959 is TO_DAYS('1899-12-30'). The e0 literals are DOUBLE, so the divisions are not rounded to DECIMAL
+        return f"""CREATE TABLE IF NOT EXISTS TrackPoint (
+            activity_id INT NOT NULL,
+            seq MEDIUMINT UNSIGNED NOT NULL,
+            lat DOUBLE AS (lat_e7 / {COORDINATE_SCALE}e0) VIRTUAL,
+            lon DOUBLE AS (lon_e7 / {COORDINATE_SCALE}e0) VIRTUAL,
+            altitude FLOAT,
+            date_days DOUBLE AS (TO_DAYS(date_time) - 693959 + TIME_TO_SEC(date_time) / 86400e0) VIRTUAL,
+            date_time DATETIME NOT NULL,
+            lat_e7 INT NOT NULL INVISIBLE,
+            lon_e7 INT NOT NULL INVISIBLE,
+            PRIMARY KEY (activity_id, seq, date_time))
+            PARTITION BY RANGE (YEAR(date_time)) ({', '.join(partitions)})
+                """
+
+    def create_activity_summary_table(self):
+        """
+        Creates the ActivitySummary table, with per-activity aggregates computed by the loaders
+        while parsing, see Trajectory.summary.
+        
+        Table schema:
+            - activity_id (INT): Primary key, foreign key to the Activity table.
+            - trackpoint_count (INT): Number of trackpoints.
+            - distance_km (DOUBLE): Haversine distance along the trackpoints.
+            - altitude_gain_m (DOUBLE): Meters climbed between consecutive valid altitudes.
+            - max_gap_seconds (INT): Longest time between consecutive trackpoints.
+            - min_lat, min_lon, max_lat, max_lon (DOUBLE): Bounding box of the trackpoints.
+        """
+        query = """CREATE TABLE IF NOT EXISTS ActivitySummary (
+            activity_id INT PRIMARY KEY,
+            trackpoint_count INT,
+            distance_km DOUBLE,
+            altitude_gain_m DOUBLE,
+            max_gap_seconds INT,
+            min_lat DOUBLE,
+            min_lon DOUBLE,
+            max_lat DOUBLE,
+            max_lon DOUBLE,
+            FOREIGN KEY (activity_id) REFERENCES Activity(id))
+                """
+        self.cursor.execute(query)
+        self.db_connection.commit()
+
+    def create_activity_rollup_table(self):
+        """
+        Creates the ActivityRollup table, with activity totals per user, year and transportation mode.
+        The loaders refresh a user's rows after writing its activities, see refresh_rollups.
+        
+        Table schema:
+            - id (INT): Primary key, auto-incremented.
+            - user_id (INT): Foreign key to the User table.
+            - year (INT): Year the activities start in.
+            - transportation_mode (VARCHAR): The mode, NULL for unlabeled activities.
+            - activity_count (INT): Number of activities.
+            - hours (INT): Sum of the activities' whole hours, as TIMESTAMPDIFF(HOUR, start, end).
+            - distance_km (DOUBLE): Sum of the activities' distances.
+            - trackpoint_count (INT): Sum of the activities' trackpoints.
+        """
+        query = """CREATE TABLE IF NOT EXISTS ActivityRollup (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            year INT,
+            transportation_mode VARCHAR(255),
+            activity_count INT,
+            hours INT,
+            distance_km DOUBLE,
+            trackpoint_count INT,
+            UNIQUE KEY user_year_mode (user_id, year, transportation_mode),
+            FOREIGN KEY (user_id) REFERENCES User(id))
+                """
         self.cursor.execute(query)
         self.db_connection.commit()
 
+    def create_manifest_table(self):
+        """
+        Creates the IngestManifest table, which records every .plt file loaded by
+        traverse_folder_incremental.
+        
+        Table schema:
+            - path (VARCHAR): Primary key, path of the .plt file relative to Data/.
+            - user_id (INT): The user the file belongs to.
+            - size (BIGINT): File size in bytes when it was loaded.
+            - mtime (DOUBLE): File modification time when it was loaded.
+            - content_hash (CHAR): SHA-1 of the file contents.
+            - activity_count (INT): Number of activities loaded from the file.
+            - trackpoint_count (INT): Number of trackpoints loaded from the file.
+            - first_activity_id (INT): First of the file's activity IDs, which are consecutive.
+            - last_activity_id (INT): Last of the file's activity IDs.
+            - ingested_at (DATETIME): When the file was loaded.
+        """
+        query = """CREATE TABLE IF NOT EXISTS IngestManifest (
+            path VARCHAR(255) NOT NULL PRIMARY KEY,
+            user_id INT,
+            size BIGINT,
+            mtime DOUBLE,
+            content_hash CHAR(40),
+            activity_count INT,
+            trackpoint_count INT,
+            first_activity_id INT,
+            last_activity_id INT,
+            ingested_at DATETIME)
+                """
+        self.cursor.execute(query)
+        self.db_connection.commit()
+
+    def create_generation_table(self):
+        """
+        Creates the DatasetGeneration table, a single-row counter that every load bumps, so
+        cached query results (see query_cache) are not reused after the data changed. It is
+        not dropped with the other tables, so the counter never goes back to a used value.
+        The counter does start over in a new database, so every bump also draws a random
+        load_id, which tells the loads of different databases apart.
+        
+        Table schema:
+            - id (INT): Primary key, always 1.
+            - generation (BIGINT): Incremented before and after every load.
+            - load_id (CHAR(32)): Random hex ID of the latest bump, NULL before the first one.
+        """
+        query = """CREATE TABLE IF NOT EXISTS DatasetGeneration (
+            id INT PRIMARY KEY,
+            generation BIGINT NOT NULL,
+            load_id CHAR(32))
+                """
+        self.cursor.execute(query)
+        # Tables created before load_id existed get the column added
+        self.cursor.execute("""SELECT COUNT(*) FROM information_schema.COLUMNS
+                               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'DatasetGeneration'
+                               AND COLUMN_NAME = 'load_id'""")
+        if not self.cursor.fetchone()[0]:
+            self.cursor.execute("ALTER TABLE DatasetGeneration ADD COLUMN load_id CHAR(32)")
+        self.cursor.execute("INSERT IGNORE INTO DatasetGeneration (id, generation) VALUES (1, 0)")
+        self.db_connection.commit()
+
+    def bump_generation(self):
+        """
+        Increments the dataset generation and draws a new load_id, invalidating cached query results.
+        """
+        self.cursor.execute("UPDATE DatasetGeneration SET generation = generation + 1, load_id = %s WHERE id = 1",
+                            (uuid.uuid4().hex,))
+        self.db_connection.commit()
+
+    def create_indexes(self, profile=None):
+        """
+        Builds the secondary indexes of an index profile and reports how long each build takes.
+
+        Meant to run after the load, since maintaining the indexes row by row slows the
+        inserts down. Indexes that already exist are skipped.
+
+        Args:
+            profile (list): (table, index name, columns, kind) tuples, defaults to INDEX_PROFILE,
+                or COMPACT_INDEX_PROFILE for the compact schema.
+        """
+        if profile is None:
+            profile = self.COMPACT_INDEX_PROFILE if self.schema == "compact" else self.INDEX_PROFILE
+        timings = []
+        for table_name, index_name, columns, kind in profile:
+            self.cursor.execute("""SELECT COUNT(*) FROM information_schema.STATISTICS
+                                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s""",
+                                (table_name, index_name))
+            if self.cursor.fetchone()[0]:
+                timings.append([table_name, index_name, columns, "exists"])
+                continue
+            start = time.perf_counter()
+            self.cursor.execute(f"CREATE {kind} {index_name} ON {table_name} ({columns})")
+            self.db_connection.commit()
+            timings.append([table_name, index_name, columns, f"{time.perf_counter() - start:.2f}"])
+        print(tabulate(timings, headers=["Table", "Index", "Columns", "Build time (s)"]))
+
+    def print_table_sizes(self, table_names=("Activity", "TrackPoint")):
+        """
+        Prints the row count, data and index size of tables, to compare the TrackPoint schemas.
+
+        Returns:
+            rows (list): (table, rows, data MB, index MB) lists.
+        """
+        rows = []
+        for table_name in table_names:
+            # Refreshes the estimates in information_schema, which InnoDB otherwise updates lazily
+            self.cursor.execute(f"ANALYZE TABLE {table_name}")
+            self.cursor.fetchall()
+            self.cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+            row_count = self.cursor.fetchone()[0]
+            self.cursor.execute("""SELECT DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES
+                                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s""", (table_name,))
+            data_length, index_length = self.cursor.fetchone()
+            rows.append([table_name, row_count, round(data_length / 2**20, 1), round(index_length / 2**20, 1)])
+        print(tabulate(rows, headers=["Table", "Rows", "Data (MB)", "Indexes (MB)"]))
+        return rows
+
 #--------------------------INSERT DATA-----------------------------
     # Insert a user
     def insert_user(self, user_id, has_labels):
@@ -143,14 +441,110 @@ class InsertGeolifeDataset:
             track_points (list): A list of tuples containing trackpoint data.
         """
         try:
-            query = f"""INSERT IGNORE INTO TrackPoint (activity_id, lat, lon, altitude, date_days, date_time) 
-                        VALUES (%s, %s, %s, %s, %s, %s)"""
-            self.cursor.executemany(query, list(track_points))
+            self.cursor.executemany(self.track_point_insert(), list(track_points))
             self.db_connection.commit()
             # print(f"Inserted {len(track_points)} trackpoints into the database.")
         except Exception as e:
             print(f"Failed to insert trackpoints: {e}")
 
+    def track_point_insert(self, ignore=True):
+        """
+        Returns the INSERT statement for rows from track_point_rows, as INSERT IGNORE unless ignore is False.
+        """
+        return f"""INSERT {'IGNORE ' if ignore else ''}INTO TrackPoint ({', '.join(self.track_point_columns)})
+                   VALUES ({', '.join(['%s'] * len(self.track_point_columns))})"""
+
+    def track_point_rows(self, trajectory, activity_id):
+        """
+        Returns the trackpoints of an activity as tuples matching track_point_columns.
+        """
+        if self.schema == "compact":
+            return trajectory.compact_rows(activity_id)
+        return trajectory.rows(activity_id)
+
+    # Insert activity summaries in batch
+    def insert_activity_summaries_batch(self, summaries):
+        """
+        Inserts a batch of rows into the ActivitySummary table.
+        
+        Args:
+            summaries (list): Tuples from Trajectory.summary_row.
+        """
+        try:
+            self.cursor.executemany(ACTIVITY_SUMMARY_INSERT, summaries)
+            self.db_connection.commit()
+        except Exception as e:
+            print(f"Failed to insert activity summaries: {e}")
+
+    # Insert activities and their trackpoints in one transaction
+    def insert_activities_and_track_points_batch(self, activities, track_points, summaries, db_connection=None, cursor=None):
+        """
+        Inserts a batch of activities with preallocated IDs, their trackpoints and summaries, with a single commit.
+        
+        Args:
+            activities (list): (id, user_id, transportation_mode, start_date_time, end_date_time) tuples.
+            track_points (list): A list of tuples containing trackpoint data.
+            summaries (list): Tuples from Trajectory.summary_row.
+            db_connection: Connection to write on, defaults to this loader's connection.
+            cursor: Cursor on db_connection.
+        """
+        if db_connection is None:
+            db_connection, cursor = self.db_connection, self.cursor
+        try:
+            query = """INSERT INTO Activity (id, user_id, transportation_mode, start_date_time, end_date_time) 
+                       VALUES (%s, %s, %s, %s, %s)"""
+            cursor.executemany(query, activities)
+            cursor.executemany(self.track_point_insert(), track_points)
+            cursor.executemany(ACTIVITY_SUMMARY_INSERT, summaries)
+            db_connection.commit()
+        except Exception as e:
+            db_connection.rollback()
+            print(f"Failed to insert batch of {len(activities)} activities: {e}")
+
+    def refresh_rollups(self, user_ids=None, db_connection=None, cursor=None):
+        """
+        Recomputes the ActivityRollup rows of some users from Activity and ActivitySummary and commits.
+
+        Only the given users' activities are grouped, which is cheap with the user_id index,
+        so the loaders call this for every user they write instead of rebuilding the whole table.
+
+        Args:
+            user_ids (iterable): The users to refresh. None refreshes all users.
+            db_connection, cursor: The connection to use, defaults to this loader's connection.
+        """
+        db_connection = db_connection or self.db_connection
+        cursor = cursor or self.cursor
+        if user_ids is None:
+            cursor.execute("DELETE FROM ActivityRollup")
+            cursor.execute(ACTIVITY_ROLLUP_REFRESH.format(where=""))
+        else:
+            user_ids = list(user_ids)
+            if not user_ids:
+                return
+            placeholders = ", ".join(["%s"] * len(user_ids))
+            cursor.execute(f"DELETE FROM ActivityRollup WHERE user_id IN ({placeholders})", user_ids)
+            cursor.execute(ACTIVITY_ROLLUP_REFRESH.format(where=f"WHERE a.user_id IN ({placeholders})"), user_ids)
+        db_connection.commit()
+
+    def reserve_activity_ids(self):
+        """
+        Continues activity IDs after the highest ID already in the Activity table.
+        
+        Only valid while this loader is the only one writing activities.
+        """
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM Activity")
+        self.next_activity_id = self.cursor.fetchone()[0] + 1
+
+    def allocate_activity_id(self):
+        """
+        Returns the next free activity ID.
+        """
+        if self.next_activity_id is None:
+            self.reserve_activity_ids()
+        activity_id = self.next_activity_id
+        self.next_activity_id += 1
+        return activity_id
+
 #--------------------------LABELS DATASTRUCTURES-----------------------------
     def read_labels(self, labels_file_path):
         """
@@ -169,22 +563,9 @@ class InsertGeolifeDataset:
             labels_file_path (str): The path to the labels.txt file.
         
         Returns:
-            labels (dict): A hashmap of labels with start and end times as keys.
+            labels (dict): A hashmap of transportation modes with start and end times as keys.
         """
-        labels = {}
-
-        with open(labels_file_path, 'r') as file:
-            next(file)  #Skip header line
-            for line in file:
-                start_time_str, end_time_str, transportation_mode = line.strip().split('\t')
-                start_time = datetime.strptime(start_time_str, "%Y/%m/%d %H:%M:%S")
-                end_time = datetime.strptime(end_time_str, "%Y/%m/%d %H:%M:%S")
-                # Hashmap keyed by start_time and end_time, value is transport mode and activity status
-                labels[(start_time, end_time)] = {
-                    'transportation_mode': transportation_mode,
-                    'activity_id': None  # Will be filled in once activity is inserted
-                }
-        return labels
+        return read_label_file(labels_file_path)
 
 #----------------------------TRAVERSE THE FOLDER STRUCTURE and INSERT DATA-----------------------------
     def traverse_folder(self, folder_path):
@@ -224,83 +605,387 @@ class InsertGeolifeDataset:
                 #Insert activities and trackpoints
                 self.insert_activities_and_trackpoints(labels_hashmap,trajectory_folder_path, user_id, has_labels)
 
+    def traverse_folder_parallel(self, folder_path, workers, writers=1):
+        """
+        Like traverse_folder, but parses the users' .plt files in a pool of worker processes.
+
+        Users are handed to the writers in ID order, so activity IDs come out the same
+        as with traverse_folder. Prints rows/second per stage at the end. With a parse
+        cache, the parse stage is the time spent reading it.
+
+        Args:
+            folder_path (str): The path to the Geolife dataset folder.
+            workers (int): Number of parse processes.
+            writers (int): Number of writer threads. More than one needs preallocated
+                activity IDs and a connection pool with at least that many connections.
+        """
+        stats = IngestStats(workers, writers)
+        parsed_users = self.iter_users(folder_path, workers, stats)
+
+        if writers == 1:
+            for user_id, has_labels, activities in parsed_users:
+                start = time.perf_counter()
+                self.insert_user(user_id, int(has_labels))
+                self.insert_parsed_activities(user_id, activities)
+                stats.write_seconds += time.perf_counter() - start
+            stats.print_summary()
+            return
+
+        if not self.preallocate_ids or self.connection.pool is None:
+            raise ValueError("More than one writer needs preallocate_ids=True and a connection pool")
+
+        with ThreadPoolExecutor(max_workers=writers) as write_executor:
+            pending = deque()
+            for user_id, has_labels, activities in parsed_users:
+                # IDs are allocated here, in user order, so they do not depend on which writer runs first
+                batches = list(self.iter_activity_batches(user_id, self.track_activities(user_id, activities)))
+                pending.append(write_executor.submit(self.write_user_batches, user_id, int(has_labels), batches))
+                while len(pending) > 2 * writers:
+                    stats.write_seconds += pending.popleft().result()
+            for future in pending:
+                stats.write_seconds += future.result()
+
+        stats.print_summary()
+
+    def iter_users(self, folder_path, workers=None, stats=None):
+        """
+        Parses every user of the dataset, from the parse cache if parse_cache_dir is set.
+
+        Args:
+            folder_path (str): The path to the Geolife dataset folder.
+            workers (int): Number of parse processes, or None to parse in this process.
+            stats (IngestStats): Collects parse counts and timings.
+
+        Returns:
+            iterator: (user_id, has_labels, activities) tuples in user ID order.
+        """
+        if self.parse_cache_dir:
+            return iter_cached_users(folder_path, self.parse_cache_dir, self.label_match, workers=workers, stats=stats)
+        labeled_users = self.read_labels(os.path.join(folder_path, "labeled_ids.txt"))
+        user_folders = list_user_folders(folder_path)
+        if workers:
+            return iter_parsed_users(user_folders, labeled_users, workers, stats or IngestStats(workers), self.label_match)
+        return (
+            (user_id, user_id in labeled_users, parse_user_folder(user_folder_path, user_id in labeled_users, self.label_match))
+            for user_id, user_folder_path in user_folders
+        )
+
+    def write_user_batches(self, user_id, has_labels, batches):
+        """
+        Writes one user and its activity batches on a connection borrowed from the pool.
+
+        Returns:
+            seconds (float): Time spent writing.
+        """
+        start = time.perf_counter()
+        with self.connection.borrow() as (db_connection, cursor):
+            cursor.execute("INSERT INTO User (id, has_labels) VALUES (%s, %s)", (user_id, has_labels))
+            db_connection.commit()
+            for activities, track_points, summaries in batches:
+                self.insert_activities_and_track_points_batch(activities, track_points, summaries, db_connection, cursor)
+            self.refresh_rollups([user_id], db_connection, cursor)
+        return time.perf_counter() - start
+
+    def traverse_folder_bulk(self, folder_path, workers=None, spool_dir=None, defer_indexes=True):
+        """
+        Loads the dataset by spooling activities and trackpoints to TSV files and loading
+        them with LOAD DATA LOCAL INFILE, which is much faster than batched INSERTs.
+
+        Activity IDs are preallocated so trackpoints can reference them before they are loaded.
+
+        Args:
+            folder_path (str): The path to the Geolife dataset folder.
+            workers (int): Number of parse processes, or None to parse in this process.
+            spool_dir (str): Directory for the spool files, defaults to the system temp directory.
+            defer_indexes (bool): Drop the TrackPoint foreign key and turn off FK and unique
+                checks during the load, then rebuild the foreign key afterwards. The compact
+                schema has no foreign key to rebuild.
+        """
+        SPOOL_ROWS = 1000000  #Number of trackpoints spooled before each LOAD DATA
+        parsed_users = self.iter_users(folder_path, workers)
+
+        if defer_indexes:
+            self.drop_foreign_keys("TrackPoint")
+            self.cursor.execute("SET foreign_key_checks = 0")
+            self.cursor.execute("SET unique_checks = 0")
+
+        activity_spool = SpoolFile("Activity", ["id", "user_id", "transportation_mode", "start_date_time", "end_date_time"], spool_dir)
+        track_point_spool = SpoolFile("TrackPoint", self.track_point_columns, spool_dir)
+        summary_spool = SpoolFile("ActivitySummary", ["activity_id", *SUMMARY_FIELDS], spool_dir)
+        spool_seconds = 0.0
+        load_seconds = 0.0
+        try:
+            for user_id, has_labels, activities in parsed_users:
+                self.insert_user(user_id, int(has_labels))
+
+                start = time.perf_counter()
+                for transportation_mode, trajectory in self.track_activities(user_id, activities):
+                    activity_id = self.allocate_activity_id()
+                    activity_spool.write_rows([(activity_id, user_id, transportation_mode, trajectory.start_time, trajectory.end_time)])
+                    track_point_spool.write_rows(self.track_point_rows(trajectory, activity_id))
+                    summary_spool.write_rows([trajectory.summary_row(activity_id)])
+                spool_seconds += time.perf_counter() - start
+
+                if track_point_spool.row_count >= SPOOL_ROWS:
+                    load_seconds += self.load_spool_files(activity_spool, track_point_spool, summary_spool)
+
+            load_seconds += self.load_spool_files(activity_spool, track_point_spool, summary_spool)
+        finally:
+            activity_spool.close()
+            track_point_spool.close()
+            summary_spool.close()
+
+        print(f"Spooling took {spool_seconds:.2f} s, LOAD DATA took {load_seconds:.2f} s")
+        # The activities only reach the database in LOAD DATA chunks, so the rollups are built once at the end
+        self.refresh_rollups()
+
+        if defer_indexes:
+            start = time.perf_counter()
+            if self.schema != "compact":
+                self.cursor.execute("ALTER TABLE TrackPoint ADD FOREIGN KEY (activity_id) REFERENCES Activity(id)")
+            self.cursor.execute("SET unique_checks = 1")
+            self.cursor.execute("SET foreign_key_checks = 1")
+            self.db_connection.commit()
+            print(f"Rebuilding the TrackPoint foreign key took {time.perf_counter() - start:.2f} s")
+
+    def load_spool_files(self, activity_spool, track_point_spool, summary_spool):
+        """
+        Loads the spooled activities, then their trackpoints and summaries, and commits.
+
+        Returns:
+            seconds (float): Time spent loading.
+        """
+        start = time.perf_counter()
+        activities = activity_spool.load(self.cursor)
+        track_points = track_point_spool.load(self.cursor)
+        summary_spool.load(self.cursor)
+        self.db_connection.commit()
+        seconds = time.perf_counter() - start
+        print(f"Loaded {activities} activities and {track_points} trackpoints in {seconds:.2f} s")
+        return seconds
+
+    def traverse_folder_incremental(self, folder_path):
+        """
+        Loads only the .plt files that are new or changed since the last run, as recorded in IngestManifest.
+
+        A file is unchanged if its size and mtime match the manifest, or else if its
+        content hash does. Changed files have their old activities and trackpoints
+        replaced, and files that disappeared have them removed. Manifest rows are
+        committed in the same transaction as the file's data, so after a crash the
+        next run resumes from the last committed file.
+
+        Args:
+            folder_path (str): The path to the Geolife dataset folder.
+        """
+        BATCH_SIZE = 20000  #Number of trackpoints per commit
+        start = time.perf_counter()
+        labeled_users = self.read_labels(os.path.join(folder_path, "labeled_ids.txt"))
+        data_dir = os.path.join(folder_path, "Data")
+
+        self.cursor.execute("""SELECT path, user_id, size, mtime, content_hash, activity_count, trackpoint_count,
+                                      first_activity_id, last_activity_id FROM IngestManifest""")
+        manifest = {row[0]: row for row in self.cursor.fetchall()}
+        if not manifest:
+            self.cursor.execute("SELECT COUNT(*) FROM Activity")
+            if self.cursor.fetchone()[0]:
+                raise ValueError("Activity was loaded without a manifest, start incremental loads from empty tables")
+
+        batch = {"stale": [], "activities": [], "track_points": [], "summaries": [], "manifest": [], "removed": [],
+                 "users": set()}
+        seen = set()
+        unchanged = loaded = 0
+
+        for user_id, user_folder_path in list_user_folders(folder_path):
+            has_labels = user_id in labeled_users
+            label_index = None
+            user_written = False
+
+            for plt_file_path in iter_plt_files(os.path.join(user_folder_path, 'Trajectory')):
+                path = os.path.relpath(plt_file_path, data_dir)
+                seen.add(path)
+                stat = os.stat(plt_file_path)
+                entry = manifest.get(path)
+                if entry and entry[2] == stat.st_size and entry[3] == stat.st_mtime:
+                    unchanged += 1
+                    continue
+
+                trajectory, content_hash = read_plt_with_hash(plt_file_path)
+                if entry and entry[4] == content_hash:
+                    # Touched but not changed, only remember the new mtime
+                    batch["manifest"].append((path, user_id, stat.st_size, stat.st_mtime) + entry[4:])
+                    unchanged += 1
+                    continue
+
+                if not user_written:
+                    self.cursor.execute("""INSERT INTO User (id, has_labels) VALUES (%s, %s)
+                                           ON DUPLICATE KEY UPDATE has_labels = VALUES(has_labels)""",
+                                        (user_id, int(has_labels)))
+                    user_written = True
+                if entry and entry[7] is not None:
+                    batch["stale"].append((entry[7], entry[8]))
+                batch["users"].add(user_id)
+
+                activity_ids = []
+                trackpoint_count = 0
+                if trajectory is not None:
+                    if has_labels and label_index is None:
+                        label_index = LabelIndex(read_label_file(os.path.join(user_folder_path, 'labels.txt')))
+                    for transportation_mode, part in label_trajectory(label_index, trajectory, self.label_match):
+                        activity_id = self.allocate_activity_id()
+                        activity_ids.append(activity_id)
+                        batch["activities"].append((activity_id, user_id, transportation_mode, part.start_time, part.end_time))
+                        batch["track_points"].extend(self.track_point_rows(part, activity_id))
+                        batch["summaries"].append(part.summary_row(activity_id))
+                        trackpoint_count += len(part)
+                batch["manifest"].append((path, user_id, stat.st_size, stat.st_mtime, content_hash, len(activity_ids),
+                                          trackpoint_count, min(activity_ids, default=None), max(activity_ids, default=None)))
+                loaded += 1
+
+                if len(batch["track_points"]) >= BATCH_SIZE:
+                    self.commit_incremental_batch(batch)
+
+        removed = 0
+        for path, entry in manifest.items():
+            if path not in seen:
+                batch["removed"].append(path)
+                removed += 1
+                if entry[7] is not None:
+                    batch["stale"].append((entry[7], entry[8]))
+                    batch["users"].add(entry[1])
+        self.commit_incremental_batch(batch)
+
+        print(f"Incremental load: {loaded} files loaded, {unchanged} unchanged, {removed} removed "
+              f"in {time.perf_counter() - start:.2f} s")
+
+    def commit_incremental_batch(self, batch):
+        """
+        Writes one batch of traverse_folder_incremental in a single transaction and empties it.
+        """
+        try:
+            for first_activity_id, last_activity_id in batch["stale"]:
+                self.cursor.execute("DELETE FROM TrackPoint WHERE activity_id BETWEEN %s AND %s", (first_activity_id, last_activity_id))
+                self.cursor.execute("DELETE FROM ActivitySummary WHERE activity_id BETWEEN %s AND %s", (first_activity_id, last_activity_id))
+                self.cursor.execute("DELETE FROM Activity WHERE id BETWEEN %s AND %s", (first_activity_id, last_activity_id))
+            if batch["activities"]:
+                self.cursor.executemany("""INSERT INTO Activity (id, user_id, transportation_mode, start_date_time, end_date_time) 
+                                           VALUES (%s, %s, %s, %s, %s)""", batch["activities"])
+            if batch["track_points"]:
+                self.cursor.executemany(self.track_point_insert(ignore=False), batch["track_points"])
+            if batch["summaries"]:
+                self.cursor.executemany(ACTIVITY_SUMMARY_INSERT, batch["summaries"])
+            if batch["manifest"]:
+                self.cursor.executemany("""REPLACE INTO IngestManifest (path, user_id, size, mtime, content_hash, activity_count,
+                                               trackpoint_count, first_activity_id, last_activity_id, ingested_at)
+                                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())""", batch["manifest"])
+            for path in batch["removed"]:
+                self.cursor.execute("DELETE FROM IngestManifest WHERE path = %s", (path,))
+            # Commits the batch together with the rollups of the users it touched
+            self.refresh_rollups(batch["users"])
+            self.db_connection.commit()
+        except Exception:
+            self.db_connection.rollback()
+            raise
+        for rows in batch.values():
+            rows.clear()
+
     def insert_activities_and_trackpoints(self, labels_hashmap, trajectory_folder_path, user_id, label):
-        for root, dirs, files in os.walk(trajectory_folder_path):
-
-                        
-            trackpoints_to_insert = [] #List to store trackpoints for batch insert
-            BATCH_SIZE = 2000  #Batch size for inserting trackpoints
-
-            #Iterate through each .plt file inside the trajectory folder and add activity and trackpoints to database
-            for plt_file in files:
-                if plt_file.endswith('.plt'):
-                    plt_file_path = os.path.join(trajectory_folder_path, plt_file)
-                    
-                    # Limit file size to less than 2500 trackpoint lines
-                    with open(plt_file_path, 'r') as f:
-                        total_lines = sum(1 for _ in f)
-                    if total_lines - 6 > 2500:  # Skip files with more than 2500 trackpoints
-                        # print(f"Skipping large file {total_lines-6} trackpoints.")
-                        continue
-                    
-                    
-                    # get start and end date from plt file
-                    with open(plt_file_path, 'r') as file:
-                        lines = file.readlines()
-
-                    # Extract the 7th line and the last line
-                    seventh_line = lines[6].strip()  # 0-indexed, so 6 is the 7th line
-                    last_line = lines[-1].strip()     # Last line
-
-                    # Split the lines into elements
-                    start_date = seventh_line.split(',')
-                    end_date = last_line.split(',')
-
-                    # Get the 5th and 6th elements from each line
-                    start_datetime_str = f"{start_date[5]} {start_date[6]}"
-                    end_datetime_str = f"{end_date[5]} {end_date[6]}"
-
-                    # Format as datetime objects
-                    start_datetime = datetime.strptime(start_datetime_str, "%Y-%m-%d %H:%M:%S")
-                    end_datetime = datetime.strptime(end_datetime_str, "%Y-%m-%d %H:%M:%S")
-                    transportation_mode=None
-                    
-                    # Insert activity into the database 
-                    if not label:
-                        activity_id = self.insert_activity_data(user_id, transportation_mode, start_datetime, end_datetime)
-                    
-                    if label:
-                        # Loop through the labels hashmap
-                        for (start_time, end_time), data in labels_hashmap.items():
-                            
-                            # if the start and end time of the activity has exact match in the labels hashmap, insert the activity with the transportation mode.
-                            if start_time == start_datetime and end_time == end_datetime:
-                                transportation_mode = data['transportation_mode']
-                                activity_id = self.insert_activity_data(user_id, transportation_mode, start_datetime, end_datetime)
-                                break
-                        # if the start and end time of the activity does not have exact match in the labels hashmap, insert the activity without the transportation mode.
-                        if transportation_mode is None:
-                            activity_id = self.insert_activity_data(user_id, transportation_mode, start_datetime, end_datetime)
-                            
-                    # Insert all trackpoints in the plt file to the batch
-                    with open(plt_file_path, 'r') as f:
-                        for line in itertools.islice(f, 6, None):
-                            parts = line.strip().split(',')
-                            lat, lon, altitude, date_days = float(parts[0]), float(parts[1]), float(parts[3]), float(parts[4])
-                            timestamp = datetime.strptime(f"{parts[5]} {parts[6]}", "%Y-%m-%d %H:%M:%S")
-                            trackpoints_to_insert.append((activity_id, lat, lon, altitude, date_days, timestamp))
-                    
-                    
-                    
-                    #insert trackpoints in batch
-                    if len(trackpoints_to_insert) >= BATCH_SIZE:
-                        self.insert_track_points_batch(trackpoints_to_insert)
-                        trackpoints_to_insert = []  
-                        
-            #insert remaining trackpoints
-            if trackpoints_to_insert:   
+        """
+        Parses the user's .plt files and inserts them as activities with their trackpoints.
+        """
+        if not label:
+            labels_hashmap = None
+        self.insert_parsed_activities(user_id, iter_user_activities(labels_hashmap, trajectory_folder_path, label_match=self.label_match))
+
+    def track_activities(self, user_id, activities):
+        """
+        Passes parsed activities through the grid index builder, if one is set.
+        """
+        if self.grid_index_builder is None:
+            return activities
+        return self.grid_index_builder.track(user_id, activities)
+
+    def insert_parsed_activities(self, user_id, activities):
+        """
+        Inserts parsed activities and batches their trackpoints.
+
+        Args:
+            user_id (int): The user ID.
+            activities (iterable): (transportation_mode, trajectory) tuples.
+        """
+        activities = self.track_activities(user_id, activities)
+        if self.preallocate_ids:
+            self.insert_parsed_activities_batched(user_id, activities)
+            self.refresh_rollups([user_id])
+            return
+
+        trackpoints_to_insert = [] #List to store trackpoints for batch insert
+        summaries_to_insert = [] #List to store activity summaries, inserted with the trackpoints
+        BATCH_SIZE = 2000  #Batch size for inserting trackpoints
+
+        for transportation_mode, trajectory in activities:
+            # Activities without an exactly matching label are inserted without a transportation mode
+            activity_id = self.insert_activity_data(user_id, transportation_mode, trajectory.start_time, trajectory.end_time)
+
+            # Insert all trackpoints in the plt file to the batch
+            trackpoints_to_insert.extend(self.track_point_rows(trajectory, activity_id))
+            summaries_to_insert.append(trajectory.summary_row(activity_id))
+
+            #insert trackpoints in batch
+            if len(trackpoints_to_insert) >= BATCH_SIZE:
                 self.insert_track_points_batch(trackpoints_to_insert)
+                self.insert_activity_summaries_batch(summaries_to_insert)
                 trackpoints_to_insert = []  
+                summaries_to_insert = []
+
+        #insert remaining trackpoints
+        if trackpoints_to_insert:   
+            self.insert_track_points_batch(trackpoints_to_insert)
+        if summaries_to_insert:
+            self.insert_activity_summaries_batch(summaries_to_insert)
+        self.refresh_rollups([user_id])
+
+    def insert_parsed_activities_batched(self, user_id, activities):
+        """
+        Inserts parsed activities with preallocated IDs, committing activities and trackpoints together.
+
+        Args:
+            user_id (int): The user ID.
+            activities (iterable): (transportation_mode, trajectory) tuples.
+        """
+        for activities_to_insert, trackpoints_to_insert, summaries_to_insert in self.iter_activity_batches(user_id, activities):
+            self.insert_activities_and_track_points_batch(activities_to_insert, trackpoints_to_insert, summaries_to_insert)
+
+    def iter_activity_batches(self, user_id, activities):
+        """
+        Allocates activity IDs and groups activities with their trackpoints and summaries into insert batches.
+
+        Args:
+            user_id (int): The user ID.
+            activities (iterable): (transportation_mode, trajectory) tuples.
+
+        Yields:
+            (activities_to_insert, trackpoints_to_insert, summaries_to_insert) lists for
+            insert_activities_and_track_points_batch.
+        """
+        activities_to_insert = []
+        trackpoints_to_insert = []
+        summaries_to_insert = []
+        BATCH_SIZE = 20000  #Number of trackpoints per commit
+
+        for transportation_mode, trajectory in activities:
+            activity_id = self.allocate_activity_id()
+            activities_to_insert.append((activity_id, user_id, transportation_mode, trajectory.start_time, trajectory.end_time))
+            trackpoints_to_insert.extend(self.track_point_rows(trajectory, activity_id))
+            summaries_to_insert.append(trajectory.summary_row(activity_id))
+
+            if len(trackpoints_to_insert) >= BATCH_SIZE:
+                yield activities_to_insert, trackpoints_to_insert, summaries_to_insert
+                activities_to_insert = []
+                trackpoints_to_insert = []
+                summaries_to_insert = []
+
+        if activities_to_insert:
+            yield activities_to_insert, trackpoints_to_insert, summaries_to_insert
  
 
 #--------------------------OTHER FUNCTIONS-----------------------------
@@ -313,6 +998,23 @@ class InsertGeolifeDataset:
         print(tabulate(rows, headers=self.cursor.column_names))
         return rows
 
+    def drop_foreign_keys(self, table_name):
+        """
+        Drops all foreign keys of a table, together with the indexes InnoDB created for them.
+        """
+        self.cursor.execute("""SELECT CONSTRAINT_NAME, COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+                               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                               AND REFERENCED_TABLE_NAME IS NOT NULL""", (table_name,))
+        for constraint_name, column_name in self.cursor.fetchall():
+            self.cursor.execute(f"ALTER TABLE {table_name} DROP FOREIGN KEY {constraint_name}")
+            self.cursor.execute("""SELECT INDEX_NAME FROM information_schema.STATISTICS
+                                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                                   AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1 AND INDEX_NAME <> 'PRIMARY'""",
+                                (table_name, column_name))
+            for (index_name,) in self.cursor.fetchall():
+                self.cursor.execute(f"ALTER TABLE {table_name} DROP INDEX {index_name}")
+        self.db_connection.commit()
+
     def drop_table(self, table_name):
         self.cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
         self.db_connection.commit()
@@ -324,10 +1026,32 @@ class InsertGeolifeDataset:
         print(tabulate(rows, headers=self.cursor.column_names))
         return rows
     
-def main():
+def main(workers=None, preallocate_ids=False, loader="insert", writers=1, label_match="exact", incremental=False,
+         grid_index_path=None, schema="standard", parse_cache_dir=None):
+    """
+    Drops, recreates and loads the tables.
+
+    Args:
+        workers (int): Number of parse processes for a parallel load. None loads sequentially.
+        preallocate_ids (bool): Batch activity inserts using IDs assigned by the loader.
+        loader (str): "insert" for batched INSERT statements, "bulk" for LOAD DATA LOCAL INFILE.
+        writers (int): Number of writer connections for a parallel load, see traverse_folder_parallel.
+            More than one runs the parallel loader even without workers.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        incremental (bool): Keep the tables and only load new or changed files, see traverse_folder_incremental.
+        grid_index_path (str): Also build a local grid index of the trackpoints and save it here, see grid_index.
+        schema (str): The TrackPoint schema, "standard" or "compact", see create_track_point_table.
+            An incremental load must use the schema the table was created with.
+        parse_cache_dir (str): Read the parsed users from this parse cache, which is created or
+            refreshed from the .plt files first, see parse_cache.
+    """
     program = None
     try:
-        program = InsertGeolifeDataset()
+        program = InsertGeolifeDataset(preallocate_ids=preallocate_ids or writers > 1,
+                                       allow_local_infile=(loader == "bulk"),
+                                       pool_size=writers + 1 if writers > 1 else None,
+                                       label_match=label_match,
+                                       schema=schema)
         
         
 #--------------------------GET RELATIVE PATH FOR THE DATASET-----------------------------
@@ -341,13 +1065,21 @@ def main():
 
 
 #--------------------------DELETE TABLES-----------------------------
+        # Cached query results are invalid from the first write on, see query_cache
+        program.create_generation_table()
+        program.bump_generation()
+
         # Drop tables if they exist
-        program.drop_table("TrackPoint")
-        print("TrackPoint table dropped")
-        program.drop_table("Activity")
-        print("Activity table dropped")
-        program.drop_table("User")
-        print("User table dropped")
+        if not incremental:
+            program.drop_table("IngestManifest")
+            program.drop_table("ActivityRollup")
+            program.drop_table("ActivitySummary")
+            program.drop_table("TrackPoint")
+            print("TrackPoint table dropped")
+            program.drop_table("Activity")
+            print("Activity table dropped")
+            program.drop_table("User")
+            print("User table dropped")
 
 #------------------ CREATE TABLES & INSERT DATA---------------------
         
@@ -355,10 +1087,41 @@ def main():
         program.create_user_table()
         program.create_activity_table()
         program.create_track_point_table()
+        program.create_activity_summary_table()
+        program.create_activity_rollup_table()
+        program.create_manifest_table()
 
         # Insert data
         print(f"Accessing dataset from: {dataset_dir}\n...")
-        program.traverse_folder(dataset_dir)
+        start = time.perf_counter()
+        if grid_index_path:
+            if incremental:
+                raise ValueError("The grid index is built from a full load, not an incremental one")
+            program.grid_index_builder = GridIndexBuilder()
+        if parse_cache_dir:
+            if incremental:
+                raise ValueError("The incremental loader tracks the .plt files themselves, not the parse cache")
+            program.parse_cache_dir = parse_cache_dir
+        if writers > 1 and (incremental or loader == "bulk"):
+            raise ValueError("Several writers are only supported by the parallel insert loader")
+        if incremental:
+            program.traverse_folder_incremental(dataset_dir)
+        elif loader == "bulk":
+            program.traverse_folder_bulk(dataset_dir, workers)
+        elif workers or parse_cache_dir or writers > 1:
+            # Several writers also go through the parallel loader, which then parses in one process
+            program.traverse_folder_parallel(dataset_dir, workers or 1, writers)
+        else:
+            program.traverse_folder(dataset_dir)
+        print(f"\nLoaded the dataset with the {loader} loader in {time.perf_counter() - start:.2f} s")
+        program.create_indexes()
+        program.print_table_sizes()
+        if grid_index_path:
+            start = time.perf_counter()
+            program.grid_index_builder.build().save(grid_index_path)
+            print(f"Saved the grid index to {grid_index_path} in {time.perf_counter() - start:.2f} s")
+        # Also after the load, so results cached while it ran are not reused
+        program.bump_generation()
 
 #--------------------------SHOW DATA-----------------------------
         #Show first 10 rows of Users, Activity, and TrackPoint tables
@@ -389,4 +1152,30 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load the Geolife dataset into MySQL.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parse .plt files in this many processes (default: sequential load)")
+    parser.add_argument("--preallocate-ids", action="store_true",
+                        help="assign activity IDs in the loader and batch activity inserts")
+    parser.add_argument("--loader", choices=["insert", "bulk"], default="insert",
+                        help="load with batched INSERTs or with LOAD DATA LOCAL INFILE")
+    parser.add_argument("--writers", type=int, default=1,
+                        help="number of pooled writer connections for a parallel load, more than 1 "
+                             "implies --workers 1 if not given (default: 1)")
+    parser.add_argument("--label-match", choices=LABEL_MATCHES, default="exact",
+                        help="match activities to labels with the same, a containing or the most overlapping "
+                             "interval, or split them into one activity per label segment")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep the tables and only load .plt files that are new or changed since the last run")
+    parser.add_argument("--grid-index", metavar="PATH", default=None,
+                        help="also save a local geohash/time grid index of the trackpoints to this .npz file")
+    parser.add_argument("--schema", choices=SCHEMAS, default="standard",
+                        help="create TrackPoint with one row ID, DOUBLE columns and foreign key per trackpoint, or in the "
+                             "compact schema clustered by activity and partitioned by year (default: standard)")
+    parser.add_argument("--parse-cache", metavar="DIR", default=None,
+                        help="read the parsed .plt files from a binary cache in this directory, built or refreshed "
+                             "from the dataset first (see geolife/parse_cache.py)")
+    args = parser.parse_args()
+    main(workers=args.workers, preallocate_ids=args.preallocate_ids, loader=args.loader, writers=args.writers,
+         label_match=args.label_match, incremental=args.incremental, grid_index_path=args.grid_index,
+         schema=args.schema, parse_cache_dir=args.parse_cache)
\ No newline at end of file
@@ -1,18 +1,148 @@
+import argparse
+import os
 from DbConnector import DbConnector
+import datetime
 from tabulate import tabulate
+import sys
+# The modules both assignments share live in the geolife package at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from geolife.columnar import CHUNK_ROWS, ColumnBuffer
+from geolife.geo import activity_distances, region_ring
+from geolife.grid_index import GridIndex, points_in_polygon
 from haversine import haversine
-from insertions_faster import InsertGeolifeDataset
+from insertions_faster import SCHEMAS, InsertGeolifeDataset
+from geolife.plt_reader import COORDINATE_SCALE, INVALID_GAP_SECONDS
 import numpy as np
+from geolife.query_cache import QueryCache
+
+
+# Consecutive trackpoints are paired with LAG() in one ordered scan per activity,
+# which the (activity_id, date_time) index created by the loader serves, instead of
+# a self-join on tp2.id = tp1.id + 1 that assumes IDs are contiguous within an activity.
+# {order} is filled in with the TRACK_POINT_ORDER column of the schema. Both ask about every
+# year, so in the compact schema they read every partition, see sum_trackpoint_distances.
+ALTITUDE_GAIN_QUERY = """
+    SELECT a.user_id,
+        SUM((tp.altitude - tp.previous_altitude) * 0.3048) AS altitude_gain_meters
+    FROM (
+        SELECT activity_id, altitude,
+            LAG(altitude) OVER (PARTITION BY activity_id ORDER BY date_time, {order}) AS previous_altitude
+        FROM TrackPoint
+    ) tp
+    JOIN Activity a ON tp.activity_id = a.id
+    WHERE tp.altitude != -777
+    AND tp.previous_altitude != -777
+    AND tp.altitude > tp.previous_altitude
+    AND tp.previous_altitude >= -413
+    AND tp.altitude >= -413
+    GROUP BY a.user_id
+    ORDER BY altitude_gain_meters DESC
+    LIMIT 20;
+"""
+
+INVALID_ACTIVITIES_QUERY = """
+    SELECT a.user_id, COUNT(DISTINCT tp.activity_id) AS number_of_invalid_activities
+    FROM (
+        SELECT activity_id, date_time,
+            LAG(date_time) OVER (PARTITION BY activity_id ORDER BY date_time, {order}) AS previous_date_time
+        FROM TrackPoint
+    ) tp
+    JOIN Activity a ON tp.activity_id = a.id
+    WHERE TIMESTAMPDIFF(MINUTE, tp.previous_date_time, tp.date_time) >= 5
+    GROUP BY a.user_id;
+"""
+
+
+# The column that keeps the trackpoints of an activity in file order, per TrackPoint schema
+TRACK_POINT_ORDER = {"standard": "id", "compact": "seq"}
+
+
+def year_range(year):
+    """
+    Returns the bounds of a year, for sargable filters of the form start <= column < end.
+    """
+    return datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+
+# The same answers from the aggregates the loaders store in ActivitySummary
+ALTITUDE_GAIN_SUMMARY_QUERY = """
+    SELECT a.user_id, SUM(s.altitude_gain_m) AS altitude_gain_meters
+    FROM ActivitySummary s
+    JOIN Activity a ON s.activity_id = a.id
+    GROUP BY a.user_id
+    HAVING altitude_gain_meters > 0
+    ORDER BY altitude_gain_meters DESC
+    LIMIT 20;
+"""
+
+INVALID_ACTIVITIES_SUMMARY_QUERY = """
+    SELECT a.user_id, COUNT(*) AS number_of_invalid_activities
+    FROM ActivitySummary s
+    JOIN Activity a ON s.activity_id = a.id
+    WHERE s.max_gap_seconds >= %s
+    GROUP BY a.user_id;
+"""
+
+
+# The query methods whose results are cached by the command line run, see query_cache
+CACHED_METHODS = [
+    "find_number_of", "find_avg_activities_per_user", "find_most_active_20_users", "find_taxi_users",
+    "count_transportation_modes", "find_year_with_most_activities", "find_year_with_most_hours",
+    "find_distance_per_user_mode_year", "find_altitude_gain_top_20_users", "find_invalid_activities",
+    "find_users_in_region", "find_most_used_transportation_per_user",
+]
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".query_cache")
 
 
 class Part2:
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, connection=None, schema="standard"):
+        """
+        Args:
+            connection (DbConnector): An existing connector to share, instead of opening a new one.
+            schema (str): The TrackPoint schema the data was loaded with, see InsertGeolifeDataset.
+        """
+        self.connection = connection or DbConnector()
+        self.schema = schema
+        self.grid_index = None
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+
+    def dataset_generation(self):
+        """
+        Returns the generation the loaders bump on every load, as "<counter>-<load_id>", or None
+        if the data was loaded before the load_id existed, in which case nothing is cached.
+        The load_id keeps a new database, whose counter starts over, from hitting old results.
+        """
+        try:
+            self.cursor.execute("SELECT generation, load_id FROM DatasetGeneration WHERE id = 1")
+            row = self.cursor.fetchone()
+        except Exception:
+            return None
+        return f"{row[0]}-{row[1]}" if row and row[1] else None
+
+    def fetch_columns(self, query, params=None, dtypes=None, chunk_rows=CHUNK_ROWS):
+        """
+        Runs a query and streams its result into typed NumPy columns, chunk_rows rows at a time.
+
+        Args:
+            query (str): The query, selecting one column per entry in dtypes.
+            params (sequence): Query parameters.
+            dtypes (dict): NumPy dtype per column name, in the order they are selected.
+            chunk_rows (int): Rows per fetchmany.
+
+        Returns:
+            columns (dict): A NumPy array per column name.
+        """
+        self.cursor.execute(query, params)
+        buffer = ColumnBuffer(dtypes, chunk_rows)
+        rows = self.cursor.fetchmany(chunk_rows)
+        while rows:
+            buffer.append_rows(rows)
+            rows = self.cursor.fetchmany(chunk_rows)
+        return buffer.columns()
     
     #1. How many users, activities and trackpoints are there in the dataset
-    def find_number_of(self):
+    def find_number_of(self, from_summaries=True):
         # Counting users
         self.cursor.execute("SELECT COUNT(*) FROM User")
         users_count = self.cursor.fetchone()[0]
@@ -23,8 +153,11 @@ class Part2:
         activities_count = self.cursor.fetchone()[0]
         print(f"Total number of activities: {activities_count}")
 
-        # Count trackpoints
-        self.cursor.execute("SELECT COUNT(*) FROM TrackPoint")
+        # Count trackpoints, from the per-activity counts unless asked to count the rows
+        if from_summaries:
+            self.cursor.execute("SELECT COALESCE(SUM(trackpoint_count), 0) FROM ActivitySummary")
+        else:
+            self.cursor.execute("SELECT COUNT(*) FROM TrackPoint")
         trackpoints_count = self.cursor.fetchone()[0]
         print(f"Total number of trackpoints: {trackpoints_count}")
         
@@ -51,14 +184,23 @@ class Part2:
 
 
     #3. Find the top 20 users with the highest number of activities
-    def find_most_active_20_users(self):
-        query = """
-            SELECT user_id, COUNT(*) as number_of_activities 
-            FROM Activity 
-            GROUP BY user_id 
-            ORDER BY number_of_activities DESC 
-            LIMIT 20;
-        """
+    def find_most_active_20_users(self, from_rollups=True):
+        if from_rollups:
+            query = """
+                SELECT user_id, CAST(SUM(activity_count) AS SIGNED) as number_of_activities
+                FROM ActivityRollup
+                GROUP BY user_id
+                ORDER BY number_of_activities DESC
+                LIMIT 20;
+            """
+        else:
+            query = """
+                SELECT user_id, COUNT(*) as number_of_activities 
+                FROM Activity 
+                GROUP BY user_id 
+                ORDER BY number_of_activities DESC 
+                LIMIT 20;
+            """
         self.cursor.execute(query)
         top_users = self.cursor.fetchall()
         print(tabulate(top_users, headers=["User ID", "Activity count"]))
@@ -77,48 +219,92 @@ class Part2:
 
     #5. Find all types of transportation modes and count how many activities that are
     # tagged with these transportation mode labels. Do not count the rows where the mode is null
-    def count_transportation_modes(self):
-        query = """
-            SELECT transportation_mode, COUNT(*) 
-            FROM Activity 
-            WHERE transportation_mode IS NOT NULL 
-            GROUP BY transportation_mode;
-        """
+    def count_transportation_modes(self, from_rollups=True):
+        if from_rollups:
+            query = """
+                SELECT transportation_mode, CAST(SUM(activity_count) AS SIGNED)
+                FROM ActivityRollup
+                WHERE transportation_mode IS NOT NULL
+                GROUP BY transportation_mode;
+            """
+        else:
+            query = """
+                SELECT transportation_mode, COUNT(*) 
+                FROM Activity 
+                WHERE transportation_mode IS NOT NULL 
+                GROUP BY transportation_mode;
+            """
         self.cursor.execute(query)
         transportation_mode = self.cursor.fetchall()
         print(tabulate(transportation_mode, headers=["Transportation mode", "Count"]))
         return transportation_mode
 
-    #6. a) Find the year with the most activities.
-    def find_year_with_most_activities(self):
-        query = """
-            SELECT YEAR(start_date_time) as year, COUNT(*) as number_of_activities
-            FROM Activity
-            GROUP BY year
-            ORDER BY number_of_activities DESC
-            LIMIT 1;
+    def find_years(self):
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchone()
+        Returns the years from the first to the last activity start, read from the ends of the start_date_time index.
+        Empty if there are no activities.
+        """
+        self.cursor.execute("SELECT MIN(start_date_time), MAX(start_date_time) FROM Activity")
+        first, last = self.cursor.fetchone()
+        if first is None:
+            return []
+        return list(range(first.year, last.year + 1))
+
+    #6. a) Find the year with the most activities.
+    def find_year_with_most_activities(self, from_rollups=True):
+        if from_rollups:
+            self.cursor.execute("""
+                SELECT year, CAST(SUM(activity_count) AS SIGNED)
+                FROM ActivityRollup
+                GROUP BY year;
+            """)
+            counts = self.cursor.fetchall()
+        else:
+            # Counting each year with a date range instead of YEAR(), so the start_date_time index is used
+            counts = []
+            for year in self.find_years():
+                query = """
+                    SELECT COUNT(*)
+                    FROM Activity
+                    WHERE start_date_time >= %s AND start_date_time < %s;
+                """
+                self.cursor.execute(query, year_range(year))
+                counts.append((year, self.cursor.fetchone()[0]))
+        if not counts:
+            print("No activities found.")
+            return None
+        result = max(counts, key=lambda row: row[1])
         print(f"Year with most activities: {result[0]} with {result[1]} activities.")
         return result
     
     #6. b) Is this also the year with most recorded hours?
-    def find_year_with_most_hours(self):
-        query = """
-            SELECT YEAR(start_date_time) as year, 
-                SUM(TIMESTAMPDIFF(HOUR, start_date_time, end_date_time)) as total_hours
-            FROM Activity
-            GROUP BY year
-            ORDER BY total_hours DESC
-            LIMIT 1;
-        """
+    def find_year_with_most_hours(self, from_rollups=True):
+        if from_rollups:
+            query = """
+                SELECT year, CAST(SUM(hours) AS SIGNED) as total_hours
+                FROM ActivityRollup
+                GROUP BY year
+                ORDER BY total_hours DESC
+                LIMIT 1;
+            """
+        else:
+            query = """
+                SELECT YEAR(start_date_time) as year, 
+                    SUM(TIMESTAMPDIFF(HOUR, start_date_time, end_date_time)) as total_hours
+                FROM Activity
+                GROUP BY year
+                ORDER BY total_hours DESC
+                LIMIT 1;
+            """
         self.cursor.execute(query)
         result = self.cursor.fetchone()
+        if result is None:
+            print("No activities found.")
+            return None
         print(f"Year with most recorded hours: {result[0]} with {result[1]} hours.")
 
         #Comparing to the year with the most activities
-        most_activities_year = self.find_year_with_most_activities()
+        most_activities_year = self.find_year_with_most_activities(from_rollups)
         if most_activities_year[0] == result[0]:
             print(f"Yes, the year {most_activities_year[0]} has the most activities and also the most recorded hours.")
         else:
@@ -129,73 +315,110 @@ class Part2:
     def find_total_distance_walked_2008_user112(self):
         """
         Finds the total distance (in km) walked in 2008 by user with id=112 using the haversine formula.
-        
-        Source for haversine: https://stackoverflow.com/questions/29545704/fast-haversine-approximation-python-pandas/29546836#29546836
-        """
-        # Query to select latitude and longitude for walks in 2008
-        query = """
-            SELECT lat, lon
-            FROM TrackPoint tp
-            JOIN Activity a ON tp.activity_id = a.id
-            WHERE a.user_id = 112 AND a.transportation_mode = 'walk'
-            AND YEAR(a.start_date_time) = 2008
-            ORDER BY tp.id;
         """
-        self.cursor.execute(query)
-        trackpoints = self.cursor.fetchall()
-
-        total_distance = 0.0
+        result = self.find_distance_per_user_mode_year(user_id=112, transportation_mode='walk', year=2008, show=False)
+        total_distance = sum(distance for _, _, _, distance in result)
 
-        #Looping through trackpoints and calculating the total distance in kilometers
-        for i in range(1, len(trackpoints)):
-            previous_point = trackpoints[i-1]
-            current_point = trackpoints[i]
-
-            #Extract latitudes and longitudes for both points
-            lat1, lon1 = previous_point
-            lat2, lon2 = current_point
+        print(f"Total distance walked by user 112 in 2008: {round(total_distance, 2)} km")
+        return total_distance
 
-            #Converting degrees to radians
-            lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    def find_distance_per_user_mode_year(self, user_id=None, transportation_mode=None, year=None, show=True,
+                                         from_summaries=True):
+        """
+        Finds the distance (in km) travelled per user, transportation mode and year.
+
+        By default the per-activity distances are read from ActivitySummary. Otherwise the
+        trackpoints are streamed into NumPy columns ordered by activity (see fetch_columns)
+        and summed per activity with a vectorized haversine (see geo.activity_distances), so no distance is counted
+        between the end of one activity and the start of the next.
+
+        Args:
+            user_id (int): Only this user. None includes all users.
+            transportation_mode (str): Only this mode. None includes all activities, labeled or not.
+            year (int): Only activities starting in this year. None includes all years.
+            show (bool): Print the result as a table.
+            from_summaries (bool): Read the distances from ActivitySummary instead of the trackpoints.
+
+        Returns:
+            result (list): (user_id, transportation_mode, year, distance_km) tuples, sorted.
+        """
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append("a.user_id = %s")
+            params.append(user_id)
+        if transportation_mode is not None:
+            conditions.append("a.transportation_mode = %s")
+            params.append(transportation_mode)
+        if year is not None:
+            conditions.append("a.start_date_time >= %s AND a.start_date_time < %s")
+            params.extend(year_range(year))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if from_summaries:
+            self.cursor.execute(f"""
+                SELECT a.user_id, a.transportation_mode, YEAR(a.start_date_time), SUM(s.distance_km)
+                FROM Activity a
+                JOIN ActivitySummary s ON s.activity_id = a.id
+                {where}
+                GROUP BY a.user_id, a.transportation_mode, YEAR(a.start_date_time)
+            """, params)
+            distances = {tuple(row[:3]): float(row[3]) for row in self.cursor.fetchall()}
+        else:
+            distances = self.sum_trackpoint_distances(where, params)
 
-            #Haversine formula components
-            dlon = lon2 - lon1
-            dlat = lat2 - lat1
+        result = sorted(((user, mode, activity_year, distance) for (user, mode, activity_year), distance in distances.items()),
+                        key=lambda row: (row[0], row[1] or "", row[2]))
+        if show:
+            print(tabulate(result, headers=["User ID", "Transportation mode", "Year", "Distance (km)"], floatfmt=".2f"))
+        return result
 
-            a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
-            c = 2 * np.arcsin(np.sqrt(a))
+    def sum_trackpoint_distances(self, where, params):
+        """
+        Sums the haversine distances between the trackpoints of the activities matching a WHERE clause on Activity a.
 
-            #Radius of Earth = 6378.137 km
-            distance_km = 6378.137 * c
+        The trackpoints are also limited to the time span of those activities, which does
+        not change the result but lets the compact schema skip the partitions of other years.
+        This is the only part2 query with a time range to prune by, the others read all partitions.
 
-            #Accumulate the total distance
-            total_distance += distance_km
+        Returns:
+            distances (dict): Distance in km keyed by (user_id, transportation_mode, year).
+        """
+        # Activity details once per activity, instead of once per trackpoint
+        self.cursor.execute(f"""
+            SELECT a.id, a.user_id, a.transportation_mode, YEAR(a.start_date_time), a.start_date_time, a.end_date_time
+            FROM Activity a
+            {where}
+        """, params)
+        activities = self.cursor.fetchall()
+        if not activities:
+            return {}
+        activity_keys = {row[0]: row[1:4] for row in activities}
+        time_span = (min(row[4] for row in activities), max(row[5] for row in activities))
+
+        time_filter = "tp.date_time BETWEEN %s AND %s"
+        trackpoints = self.fetch_columns(f"""
+            SELECT tp.activity_id, tp.lat, tp.lon
+            FROM TrackPoint tp
+            JOIN Activity a ON tp.activity_id = a.id
+            {f"{where} AND {time_filter}" if where else f"WHERE {time_filter}"}
+            ORDER BY tp.activity_id, tp.{TRACK_POINT_ORDER[self.schema]}
+        """, list(params) + list(time_span), {"activity_id": np.int64, "lat": np.float64, "lon": np.float64})
 
-        print(f"Total distance walked by user 112 in 2008: {round(total_distance, 2)} km")
-        return total_distance
+        distances = {}
+        for activity_id, distance in zip(*activity_distances(trackpoints["lat"], trackpoints["lon"], trackpoints["activity_id"])):
+            key = activity_keys[int(activity_id)]
+            distances[key] = distances.get(key, 0.0) + float(distance)
+        return distances
 
 
     #8. Find the top 20 users who have gained the most altitude meters
-    def find_altitude_gain_top_20_users(self):
+    def find_altitude_gain_top_20_users(self, from_summaries=True):
         # Fetching altitude differences directly in meters, excluding invalid (-777) and negative altitude values below -413
-        query = """
-            SELECT a.user_id, 
-                SUM((tp2.altitude - tp1.altitude) * 0.3048) AS altitude_gain_meters
-            FROM TrackPoint tp1
-            JOIN TrackPoint tp2 ON tp1.activity_id = tp2.activity_id
-                                AND tp2.id = tp1.id + 1
-            JOIN Activity a ON tp1.activity_id = a.id
-            WHERE tp2.altitude != -777
-            AND tp1.altitude != -777
-            AND tp2.altitude > tp1.altitude
-            AND tp1.altitude >= -413
-            AND tp2.altitude >= -413
-            GROUP BY a.user_id
-            ORDER BY altitude_gain_meters DESC
-            LIMIT 20;
-        """
-
-        self.cursor.execute(query)
+        if from_summaries:
+            self.cursor.execute(ALTITUDE_GAIN_SUMMARY_QUERY)
+        else:
+            self.cursor.execute(ALTITUDE_GAIN_QUERY.format(order=TRACK_POINT_ORDER[self.schema]))
         top_users_meters = self.cursor.fetchall()
         print(tabulate(top_users_meters, headers=["User ID", "Total Altitude Gained (meters)"]))
         return top_users_meters
@@ -204,18 +427,11 @@ class Part2:
         # 9. Find all users who have invalid activities, and the number of invalid activities per user 
 
     
-    def find_invalid_activities(self):
-        query = """
-            SELECT a.user_id, COUNT(DISTINCT a.id) AS number_of_invalid_activities
-            FROM Activity a
-            JOIN TrackPoint tp1 ON a.id = tp1.activity_id
-            JOIN TrackPoint tp2 ON a.id = tp2.activity_id 
-                AND tp2.id = tp1.id + 1
-            WHERE TIMESTAMPDIFF(MINUTE, tp1.date_time, tp2.date_time) >= 5
-            GROUP BY a.user_id;
-        """
-
-        self.cursor.execute(query)
+    def find_invalid_activities(self, from_summaries=True):
+        if from_summaries:
+            self.cursor.execute(INVALID_ACTIVITIES_SUMMARY_QUERY, (INVALID_GAP_SECONDS,))
+        else:
+            self.cursor.execute(INVALID_ACTIVITIES_QUERY.format(order=TRACK_POINT_ORDER[self.schema]))
         rows = self.cursor.fetchall()
 
         # Format rows for 4 columns per row, with vertical lines between ID-Invalid pairs
@@ -240,28 +456,138 @@ class Part2:
 
     #10. Find the users who have tracked an activity in the Forbidden City of Beijing
     def find_users_in_forbidden_city(self):
+        rows = self.find_users_in_region(bbox=(39.9160000, 116.3970000, 39.9169999, 116.3979999))
+        print(tabulate(rows, headers=["User ID"]))
+        return rows
+
+    def find_users_in_region(self, bbox=None, polygon=None, use_grid_index=False):
+        """
+        Finds the users with a trackpoint inside a region, using the spatial index on TrackPoint.location.
+        The compact schema has no spatial index, see find_users_in_region_compact.
+
+        Args:
+            bbox (tuple): (min_lat, min_lon, max_lat, max_lon), bounds included.
+            polygon (list): (lat, lon) vertices of the region, boundary included.
+            use_grid_index (bool): Answer from the grid index loaded with load_grid_index instead.
+
+        Returns:
+            rows (list): (user_id,) tuples, sorted.
+        """
+        if use_grid_index:
+            return [(user_id,) for user_id in self.require_grid_index().users_in_region(bbox, polygon)]
+        ring = region_ring(bbox, polygon)
+        if self.schema == "compact":
+            return self.find_users_in_region_compact(ring, exact=polygon is None)
+        region = "POLYGON((" + ", ".join(f"{lon!r} {lat!r}" for lon, lat in ring) + "))"
         query = """
             SELECT DISTINCT a.user_id
             FROM TrackPoint tp
             JOIN Activity a ON tp.activity_id = a.id
-            WHERE tp.lat BETWEEN 39.9160000 AND 39.9169999
-            AND tp.lon BETWEEN 116.3970000 AND 116.3979999;
+            WHERE ST_Intersects(tp.location, ST_GeomFromText(%s, 0))
+            ORDER BY a.user_id;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print(tabulate(rows, headers=["User ID"]))
-        return rows
+        self.cursor.execute(query, (region,))
+        return self.cursor.fetchall()
 
 
-    #11. Find all users who have registered transportation_mode and their most used transportation_mode
-    def find_most_used_transportation_per_user(self):
-        query = """
-            SELECT user_id, transportation_mode, COUNT(*) as mode_count
-            FROM Activity
-            WHERE transportation_mode IS NOT NULL
-            GROUP BY user_id, transportation_mode
-            ORDER BY user_id, mode_count DESC;
+    def find_users_in_region_compact(self, ring, exact):
+        """
+        find_users_in_region for the compact schema. The trackpoints in the region's bounding box
+        are found with the index on the scaled coordinates, and tested against the ring unless
+        the region is that bounding box. The query has no time range, so it reads every year partition.
+
+        Args:
+            ring (list): Closed (lon, lat) ring, as from region_ring.
+            exact (bool): The ring is its own bounding box, so every trackpoint in the box is inside.
+        """
+        lons, lats = zip(*ring)
+        # The scaled range is widened by a unit for the index, the DOUBLE range makes the bounds exact
+        bounds = """tp.lat_e7 BETWEEN %s AND %s AND tp.lon_e7 BETWEEN %s AND %s
+                    AND tp.lat BETWEEN %s AND %s AND tp.lon BETWEEN %s AND %s"""
+        params = (int(np.floor(min(lats) * COORDINATE_SCALE)), int(np.ceil(max(lats) * COORDINATE_SCALE)),
+                  int(np.floor(min(lons) * COORDINATE_SCALE)), int(np.ceil(max(lons) * COORDINATE_SCALE)),
+                  min(lats), max(lats), min(lons), max(lons))
+        if exact:
+            self.cursor.execute(f"""
+                SELECT DISTINCT a.user_id
+                FROM TrackPoint tp
+                JOIN Activity a ON tp.activity_id = a.id
+                WHERE {bounds}
+                ORDER BY a.user_id;
+            """, params)
+            return self.cursor.fetchall()
+        trackpoints = self.fetch_columns(f"""
+            SELECT a.user_id, tp.lat, tp.lon
+            FROM TrackPoint tp
+            JOIN Activity a ON tp.activity_id = a.id
+            WHERE {bounds}
+        """, params, {"user_id": np.int64, "lat": np.float64, "lon": np.float64})
+        inside = points_in_polygon(trackpoints["lat"], trackpoints["lon"], ring)
+        return [(int(user_id),) for user_id in np.unique(trackpoints["user_id"][inside])]
+
+    def load_grid_index(self, path):
+        """
+        Loads a grid index saved by the loader (--grid-index), for the queries below that run without the database.
+        """
+        self.grid_index = GridIndex.load(path)
+        print(f"Loaded grid index with {len(self.grid_index)} trackpoints from {path}")
+
+    def require_grid_index(self):
+        """
+        Returns the grid index loaded with load_grid_index, for the queries that answer from it.
+        """
+        if self.grid_index is None:
+            raise ValueError("No grid index is loaded, call load_grid_index with a file saved by the loader's --grid-index")
+        return self.grid_index
+
+    def find_users_near(self, lat, lon, radius_m=50, start_time=None, end_time=None):
+        """
+        Finds the users that passed within radius_m of a point, from the grid index.
+
+        Args:
+            lat, lon (float): The point, in degrees.
+            radius_m (float): The distance in meters.
+            start_time, end_time (datetime): Only count trackpoints in this time window.
+
+        Returns:
+            user_ids (list): The user IDs, sorted.
+        """
+        return self.require_grid_index().users_near(lat, lon, radius_m, start_time, end_time)
+
+    def find_colocated_users(self, radius_m=50, max_seconds=None):
+        """
+        Finds the pairs of users that were within radius_m of each other at the same time, from the grid index.
+
+        Args:
+            radius_m (float): The distance in meters.
+            max_seconds (int): The largest time difference that counts as the same time,
+                at most the time bucket of the index.
+
+        Returns:
+            pairs (list): (user_a, user_b, first_time) tuples.
         """
+        pairs = self.require_grid_index().colocated_users(radius_m, max_seconds)
+        print(tabulate([(a, b, str(time)) for a, b, time in pairs], headers=["User ID", "User ID", "First met"]))
+        return pairs
+
+    #11. Find all users who have registered transportation_mode and their most used transportation_mode
+    def find_most_used_transportation_per_user(self, from_rollups=True):
+        if from_rollups:
+            query = """
+                SELECT user_id, transportation_mode, SUM(activity_count) as mode_count
+                FROM ActivityRollup
+                WHERE transportation_mode IS NOT NULL
+                GROUP BY user_id, transportation_mode
+                ORDER BY user_id, mode_count DESC;
+            """
+        else:
+            query = """
+                SELECT user_id, transportation_mode, COUNT(*) as mode_count
+                FROM Activity
+                WHERE transportation_mode IS NOT NULL
+                GROUP BY user_id, transportation_mode
+                ORDER BY user_id, mode_count DESC;
+            """
         self.cursor.execute(query)
         users_transportation_mode = self.cursor.fetchall()
         
@@ -281,9 +607,24 @@ class Part2:
         self.connection.close_connection()
 
 if __name__ == "__main__":
-
+    parser = argparse.ArgumentParser(description="Run the part2 queries.")
+    parser.add_argument("--schema", choices=SCHEMAS, default="standard",
+                        help="the TrackPoint schema the loader created (default: standard)")
+    parser.add_argument("--no-cache", action="store_true", help="run every query, without the result cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"directory of the on-disk result cache (default: {DEFAULT_CACHE_DIR})")
+    args = parser.parse_args()
+
+    part2 = None
+    cache = None
     try:
-        part2 = Part2()
+        part2 = Part2(schema=args.schema)
+        if not args.no_cache:
+            # Results are reused until the next load bumps the dataset generation
+            cache = QueryCache(path=args.cache_dir)
+            cache.prune(part2.dataset_generation())
+            # The schema changes which queries run, so results of one schema are not reused for another
+            cache.wrap(part2, CACHED_METHODS, part2.dataset_generation, scope=(part2.schema,))
 
         print("1. Count users, activities, and trackpoints:")
         part2.find_number_of()
@@ -321,6 +662,10 @@ if __name__ == "__main__":
         print("\n11. Users with registered transportation modes and their most used mode:")
         part2.find_most_used_transportation_per_user()
 
+        if cache:
+            print()
+            cache.print_stats()
+
     except Exception as e:
         print("ERROR: Failed to use database:", e)
     finally:
@@ -1,3 +1,4 @@
+import os
 from pymongo import MongoClient, version
 
 
@@ -6,6 +7,10 @@ class DbConnector:
     Connects to the MongoDB server on the Ubuntu virtual machine.
     Connector needs HOST, USER and PASSWORD to connect.
 
+    Settings that are not passed in are read from the environment variables
+    MONGO_HOST, MONGO_DATABASE, MONGO_USER, MONGO_PASSWORD, MONGO_MAX_POOL_SIZE
+    and MONGO_MIN_POOL_SIZE, falling back to the defaults below.
+
     Example:
     HOST = "tdt4225-00.idi.ntnu.no" // Your server IP address/domain name
     USER = "testuser" // This is the user you created and added privileges for
@@ -13,14 +18,25 @@ class DbConnector:
     """
 
     def __init__(self,
-                 DATABASE='store_D',
-                 HOST="localhost",  # Assuming you're accessing the MongoDB container locally
-                 USER="admin",      # MongoDB root username from the Docker Compose file
-                 PASSWORD="secret"):  # MongoDB root password from the Docker Compose file
+                 DATABASE=None,
+                 HOST=None,  # Assuming you're accessing the MongoDB container locally
+                 USER=None,      # MongoDB root username from the Docker Compose file
+                 PASSWORD=None,  # MongoDB root password from the Docker Compose file
+                 MAX_POOL_SIZE=None,
+                 MIN_POOL_SIZE=None):
+        DATABASE = DATABASE or os.environ.get("MONGO_DATABASE", "store_D")
+        HOST = HOST or os.environ.get("MONGO_HOST", "localhost")
+        USER = USER or os.environ.get("MONGO_USER", "admin")
+        PASSWORD = PASSWORD or os.environ.get("MONGO_PASSWORD", "secret")
+        if MAX_POOL_SIZE is None:
+            MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+        if MIN_POOL_SIZE is None:
+            MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+
         uri = f"mongodb://{USER}:{PASSWORD}@{HOST}/{DATABASE}?authSource=admin"
         # Connect to the databases
         try:
-            self.client = MongoClient(uri)
+            self.client = MongoClient(uri, maxPoolSize=MAX_POOL_SIZE, minPoolSize=MIN_POOL_SIZE)
             self.db = self.client[DATABASE]
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
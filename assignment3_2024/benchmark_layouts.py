@@ -0,0 +1,112 @@
+import argparse
+import os
+import time
+from tabulate import tabulate
+from DbConnector import DbConnector
+from insertion import LAYOUTS, TRACKPOINT_SERIES_OPTIONS, InsertGeolifeDatasetMongo
+from part2 import Part2
+import sys
+# The modules both assignments share live in the geolife package at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from geolife.plt_reader import MAX_TRACKPOINTS, list_user_folders, parse_user_folder
+import numpy as np
+
+# The bounding box of the Forbidden City, as queried by part2
+REGION = (39.916000, 116.397000, 39.916999, 116.397999)
+
+
+def load_layout(layout, dataset_dir, users, database, capped=True):
+    """
+    Loads the first users of the dataset into a database of their own with one trackpoint layout,
+    then times the trackpoint-level queries against it.
+
+    Args:
+        layout (str): One of LAYOUTS.
+        dataset_dir (str): The path to the Geolife dataset folder.
+        users (int): Number of users to load.
+        database (str): The database to load into. Its collections are dropped first.
+        capped (bool): Skip files over MAX_TRACKPOINTS in every layout, so all of them store the same trackpoints.
+
+    Returns:
+        row (list): The layout's line in the comparison table.
+    """
+    connection = DbConnector(DATABASE=database)
+    try:
+        program = InsertGeolifeDatasetMongo(connection=connection, layout=layout)
+        if capped:
+            program.max_points = MAX_TRACKPOINTS
+        for collection_name in ("User", "Activity", "ActivityRollup", "TrackPointBucket", "TrackPointSeries"):
+            program.drop_coll(collection_name)
+        if layout == "timeseries":
+            program.create_coll("TrackPointSeries", timeseries=TRACKPOINT_SERIES_OPTIONS)
+
+        with open(os.path.join(dataset_dir, "labeled_ids.txt")) as file:
+            labeled_users = {int(line) for line in file if line.strip()}
+
+        trackpoints = 0
+        write_seconds = 0.0
+        for user_id, user_folder_path in list_user_folders(dataset_dir)[:users]:
+            has_labels = user_id in labeled_users
+            activities = parse_user_folder(user_folder_path, has_labels, program.label_match, program.max_points)
+            trackpoints += sum(len(trajectory) for _, trajectory in activities)
+
+            start = time.perf_counter()
+            program.insert_user(user_id, has_labels)
+            program.insert_parsed_activities(user_id, activities)
+            write_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        program.flush()
+        program.create_indexes()
+        write_seconds += time.perf_counter() - start
+
+        storage = program.print_storage_stats()
+        data_mb, storage_mb, index_mb = (sum(row[column] for row in storage) for column in (2, 3, 4))
+
+        part2 = Part2(connection=connection, layout=layout)
+        start = time.perf_counter()
+        part2.sum_trackpoint_distances({})
+        distance_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        part2.fetch_trackpoint_columns({}, {"user_id": np.int64}, {"date_time": "datetime64[s]"})
+        scan_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        part2.find_users_in_region(bbox=REGION)
+        region_seconds = time.perf_counter() - start
+    finally:
+        connection.close_connection()
+
+    return [layout, trackpoints, f"{write_seconds:.2f}", round(trackpoints / write_seconds) if write_seconds else 0,
+            round(data_mb, 1), round(storage_mb, 1), round(index_mb, 1),
+            f"{distance_seconds:.2f}", f"{scan_seconds:.2f}", f"{region_seconds:.2f}"]
+
+
+def benchmark_layouts(dataset_dir, users=20, layouts=LAYOUTS, database_prefix="geolife_layout", capped=True):
+    """
+    Loads the same users with each trackpoint layout and prints load throughput, storage and query times side by side.
+
+    Args:
+        dataset_dir (str): The path to the Geolife dataset folder.
+        users (int): Number of users to load per layout.
+        layouts (iterable): The layouts to compare.
+        database_prefix (str): Each layout is loaded into the database <prefix>_<layout>.
+        capped (bool): Skip files over MAX_TRACKPOINTS in every layout, not only the embedded one.
+    """
+    rows = [load_layout(layout, dataset_dir, users, f"{database_prefix}_{layout}", capped) for layout in layouts]
+    print()
+    print(tabulate(rows, headers=["Layout", "Trackpoints", "Write (s)", "Trackpoints/s", "Data (MB)", "Storage (MB)",
+                                  "Indexes (MB)", "Distances (s)", "Time scan (s)", "Region (s)"]))
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Compare the Mongo trackpoint layouts on load throughput, storage and query time.")
+    parser.add_argument("--dataset", default=os.path.normpath(os.path.join(current_dir, '../../dataset')),
+                        help="path to the Geolife dataset folder")
+    parser.add_argument("--users", type=int, default=20, help="number of users to load per layout (default: 20)")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS), help="layouts to compare (default: all)")
+    parser.add_argument("--database-prefix", default="geolife_layout",
+                        help="each layout is loaded into the database <prefix>_<layout>, which is emptied first")
+    parser.add_argument("--uncapped", action="store_true",
+                        help="let the bucketed and timeseries layouts load files over the trackpoint cap")
+    args = parser.parse_args()
+    benchmark_layouts(args.dataset, args.users, args.layouts, args.database_prefix, not args.uncapped)
@@ -0,0 +1,65 @@
+from pymongo.errors import BulkWriteError
+
+
+class BufferedWriter:
+    """
+    Buffers documents for one collection and writes them with insert_many(ordered=False).
+
+    The buffer is flushed when it holds max_documents documents or roughly max_bytes of
+    BSON, whichever comes first, so a load costs one round trip per batch instead of one
+    per document. Progress is printed every progress_every documents, and on_flush, if
+    set, is called after every batch written, to write what depends on the batch.
+    """
+
+    def __init__(self, collection, max_documents=500, max_bytes=16 * 1024 * 1024, progress_every=1000, on_flush=None):
+        self.collection = collection
+        self.on_flush = on_flush
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.progress_every = progress_every
+        self.documents = []
+        self.buffered_bytes = 0
+        self.inserted = 0
+        self.failed = 0
+
+    def insert(self, document, size=0):
+        """
+        Adds a document to the buffer, flushing it if a threshold is reached.
+
+        Args:
+            document (dict): The document to insert.
+            size (int): Estimated BSON size of the document in bytes.
+        """
+        self.documents.append(document)
+        self.buffered_bytes += size
+        if len(self.documents) >= self.max_documents or self.buffered_bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered documents. Failed documents are counted and reported, not retried.
+        """
+        if not self.documents:
+            return
+        inserted_before = self.inserted
+        try:
+            result = self.collection.insert_many(self.documents, ordered=False)
+            self.inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # A write concern error alone means the documents were written but not acknowledged as requested
+            write_errors = e.details.get('writeErrors', [])
+            write_concern_errors = e.details.get('writeConcernErrors', [])
+            self.inserted += e.details.get('nInserted', 0)
+            self.failed += len(write_errors)
+            if write_errors:
+                print(f"Failed to insert {len(write_errors)} documents into {self.collection.name}: "
+                      f"{write_errors[0]['errmsg']}")
+            if write_concern_errors:
+                print(f"Write concern error inserting into {self.collection.name}: {write_concern_errors[0]['errmsg']}")
+        self.documents = []
+        self.buffered_bytes = 0
+        if self.on_flush is not None:
+            self.on_flush()
+
+        if self.inserted // self.progress_every > inserted_before // self.progress_every:
+            print(f"Inserted {self.inserted} documents into {self.collection.name}")
@@ -1,8 +1,57 @@
 from pprint import pprint
 from DbConnector import DbConnector
-from datetime import datetime
+from buffered_writer import BufferedWriter
+import argparse
+import datetime
 import os
-import itertools
+import time
+import uuid
+import sys
+# The modules both assignments share live in the geolife package at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from geolife.grid_index import GridIndexBuilder
+from geolife.label_index import LABEL_MATCHES, LabelIndex
+from geolife.parallel_ingest import IngestStats, iter_parsed_users
+from geolife.parse_cache import iter_cached_users
+from geolife.plt_reader import (MAX_TRACKPOINTS, iter_plt_files, iter_user_activities, label_trajectory, list_user_folders,
+                                read_label_file, read_plt_with_hash)
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from tabulate import tabulate
+from trackpoint_buckets import bucket_size, encode_buckets
+
+
+# Rough BSON size of one embedded trackpoint with its GeoJSON location, used to size the insert batches
+TRACKPOINT_BSON_BYTES = 180
+
+# How trackpoints are stored: "embedded" as an array of subdocuments in each activity,
+# "bucketed" as packed columns in TrackPointBucket documents (see trackpoint_buckets), or
+# "timeseries" as one document per trackpoint in the TrackPointSeries time-series collection
+LAYOUTS = ("embedded", "bucketed", "timeseries")
+
+# The time-series collection groups trackpoints by their meta document (user, activity and mode)
+# and compresses them by column. Needs MongoDB 5.0 or later
+TRACKPOINT_SERIES_OPTIONS = {"timeField": "date_time", "metaField": "meta", "granularity": "seconds"}
+# Trackpoint documents per insert_many into the time-series collection
+SERIES_BATCH_DOCUMENTS = 10000
+
+# Server-side versions of the trackpoint_count and max_gap_seconds fields of Trajectory.summary,
+# for activities stored without them. The gap is found in one $reduce pass over the
+# trackpoint times, carrying the previous time along, so no trackpoint array leaves the server.
+# Both read the embedded trackpoints array, so they only apply to the embedded layout.
+TRACKPOINT_COUNT_EXPRESSION = {"$size": {"$ifNull": ["$trackpoints", []]}}
+MAX_GAP_SECONDS_EXPRESSION = {"$let": {
+    "vars": {"scan": {"$reduce": {
+        "input": "$trackpoints.date_time",
+        "initialValue": {"previous": None, "gap": 0},
+        "in": {
+            "previous": "$$this",
+            "gap": {"$max": ["$$value.gap", {"$cond": [{"$eq": ["$$value.previous", None]}, 0,
+                                                        {"$subtract": ["$$this", "$$value.previous"]}]}]}
+        }
+    }}},
+    "in": {"$toInt": {"$divide": ["$$scan.gap", 1000]}}  # Subtracting dates gives milliseconds
+}}
 
 
 class InsertGeolifeDatasetMongo:
@@ -10,61 +59,288 @@ class InsertGeolifeDatasetMongo:
     Class for insertion of the Geolife dataset into MongoDB.
     """
 
-    def __init__(self):
+    def __init__(self, batch_documents=500, batch_bytes=16 * 1024 * 1024, connection=None, label_match="exact",
+                 layout="embedded"):
         """
         Initializes the MongoDB connection.
+
+        Documents are buffered and written with insert_many, see BufferedWriter.
+
+        Args:
+            batch_documents (int): Flush a collection's buffer after this many documents.
+            batch_bytes (int): Flush a collection's buffer after roughly this many bytes.
+            connection (DbConnector): An existing connector to share, instead of opening a new one.
+            label_match (str): How activities are matched to labels: "exact", "contains" or "overlap",
+                or "segment" to split activities at label boundaries into one activity per label.
+            layout (str): "embedded", "bucketed" or "timeseries", see LAYOUTS. Only embedded activities
+                have to stay below the document size limit, so the other layouts load files of any length.
         """
-        self.connection = DbConnector()
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout!r}, expected one of {LAYOUTS}")
+        self.connection = connection or DbConnector()
         self.client = self.connection.client
         self.db = self.connection.db
+        self.user_writer = BufferedWriter(self.db['User'], batch_documents, batch_bytes, progress_every=50)
+        # The rollups of the buffered activities are written with each batch, see add_to_rollups
+        self.activity_writer = BufferedWriter(self.db['Activity'], batch_documents, batch_bytes, on_flush=self.flush_rollups)
+        self.bucket_writer = BufferedWriter(self.db['TrackPointBucket'], batch_documents, batch_bytes)
+        self.series_writer = BufferedWriter(self.db['TrackPointSeries'], SERIES_BATCH_DOCUMENTS, batch_bytes, progress_every=100000)
+        self.label_match = label_match
+        self.layout = layout
+        self.max_points = MAX_TRACKPOINTS if layout == "embedded" else None
+        # Set to a GridIndexBuilder to collect the trackpoints for a local grid index during the load
+        self.grid_index_builder = None
+        # Set to a directory to read the parsed users from a parse cache instead of the .plt files, see parse_cache
+        self.parse_cache_dir = None
+        # Rollup totals of the buffered activities, see add_to_rollups
+        self.rollups = {}
         
         
 #--------------------------CREATE COLLECTIONS-----------------------------
 
-    def create_coll(self, collection_name):
+    def create_coll(self, collection_name, **options):
         """
         Creates a collection in the MongoDB database.
         Args:
             collection_name ( ): The name of the collection to create.
+            options: Passed on to create_collection, e.g. timeseries=TRACKPOINT_SERIES_OPTIONS.
         """
         try:
-            self.db.create_collection(collection_name)    
+            self.db.create_collection(collection_name, **options)    
             print(f'Created collection: {collection_name}')
         except Exception as e:
             print(f"Failed to create collection {collection_name}: {e}")
 
 
-#--------------------------INSERT DOCUMENTS-----------------------------
-    def insert_user(self, user_id, has_labels):
+    def create_indexes(self):
         """
-        Inserts a user into the MongoDB collection 'User'.
+        Builds the 2dsphere index on the trackpoint locations, after the load so the
+        inserts do not maintain it, and reports how long it takes.
+
+        In the bucketed layout the buckets are indexed by activity instead, in trackpoint order.
+        In the timeseries layout the trackpoints get both, on the meta activity and the location.
         """
+        start = time.perf_counter()
+        if self.layout == "timeseries":
+            try:
+                self.db['TrackPointSeries'].create_index([("meta.activity_id", 1), ("date_time", 1)])
+                self.db['TrackPointSeries'].create_index([("location", "2dsphere")])
+                print(f"Building the TrackPointSeries indexes took {time.perf_counter() - start:.2f} s")
+            except Exception as e:
+                print(f"Failed to create the TrackPointSeries indexes: {e}")
+            return
+        if self.layout == "bucketed":
+            try:
+                self.db['TrackPointBucket'].create_index([("activity_id", 1), ("seq", 1)])
+                print(f"Building the (activity_id, seq) index on TrackPointBucket took {time.perf_counter() - start:.2f} s")
+            except Exception as e:
+                print(f"Failed to create the TrackPointBucket index: {e}")
+            return
         try:
-            user_data = {
-                "_id": user_id,
-                "has_labels": has_labels
-            }
-            self.db['User'].insert_one(user_data)
-            print(f"Inserted user {user_id} | Labeled: {has_labels}")
+            self.db['Activity'].create_index([("trackpoints.location", "2dsphere")])
+            print(f"Building the 2dsphere index on trackpoints.location took {time.perf_counter() - start:.2f} s")
         except Exception as e:
-            print(f"Failed to insert user {user_id}: {e}")
+            print(f"Failed to create the 2dsphere index: {e}")
+
+
+    def print_storage_stats(self):
+        """
+        Prints the document count, data, storage and index size of the trackpoint collections,
+        to compare the layouts.
+
+        Returns:
+            rows (list): (collection, documents, data MB, storage MB, index MB) lists.
+        """
+        rows = []
+        existing = self.db.list_collection_names()
+        for collection_name in ("Activity", "TrackPointBucket", "TrackPointSeries"):
+            if collection_name not in existing:
+                continue
+            try:
+                stats = self.db.command("collStats", collection_name)
+            except Exception as e:
+                print(f"Failed to read the stats of {collection_name}: {e}")
+                continue
+            rows.append([collection_name, stats.get("count", 0), round(stats.get("size", 0) / 2**20, 1),
+                         round(stats.get("storageSize", 0) / 2**20, 1), round(stats.get("totalIndexSize", 0) / 2**20, 1)])
+        print(tabulate(rows, headers=["Collection", "Documents", "Data (MB)", "Storage (MB)", "Indexes (MB)"]))
+        return rows
 
-    def insert_activity_data(self, user_id, transportation_mode, start_date_time, end_date_time, trackpoints):
+
+#--------------------------INSERT DOCUMENTS-----------------------------
+    def insert_user(self, user_id, has_labels):
+        """
+        Inserts a user into the MongoDB collection 'User'.
+        """
+        user_data = {
+            "_id": user_id,
+            "has_labels": has_labels
+        }
+        self.user_writer.insert(user_data)
+
+    def insert_activity_data(self, user_id, transportation_mode, start_date_time, end_date_time, trackpoints, source_file=None,
+                             summary=None, activity_id=None):
         """
         Inserts an activity into the MongoDB collection 'Activity'.
+
+        source_file is only set by the incremental load, which uses it to replace a file's activities.
+        summary is the activity's Trajectory.summary(), stored next to the trackpoints so part2 can
+        aggregate over activities without unwinding them. Its bounding box is nested under "bbox".
+        trackpoints is None in the bucketed layout, where activity_id is the _id the buckets refer to.
         """
-        try:
-            activity_data = {
-                "user_id": user_id,
-                "transportation_mode": transportation_mode,
-                "start_time": start_date_time,
-                "end_time": end_date_time,
-                "trackpoints": trackpoints
-            }
-            self.db['Activity'].insert_one(activity_data)
-            print(f"Inserted activity for user {user_id} with transportation mode {transportation_mode}.")
-        except Exception as e:
-            print(f"Failed to insert activity for user {user_id}: {e}")
+        activity_data = {
+            "user_id": user_id,
+            "transportation_mode": transportation_mode,
+            "start_time": start_date_time,
+            "end_time": end_date_time,
+        }
+        if activity_id is not None:
+            activity_data["_id"] = activity_id
+        if trackpoints is not None:
+            activity_data["trackpoints"] = trackpoints
+        if source_file is not None:
+            activity_data["source_file"] = source_file
+        if summary is not None:
+            activity_data.update({
+                "trackpoint_count": summary["trackpoint_count"],
+                "distance_km": summary["distance_km"],
+                "altitude_gain_m": summary["altitude_gain_m"],
+                "max_gap_seconds": summary["max_gap_seconds"],
+                "bbox": {key: summary[key] for key in ("min_lat", "min_lon", "max_lat", "max_lon")},
+            })
+        self.activity_writer.insert(activity_data, len(trackpoints or ()) * TRACKPOINT_BSON_BYTES)
+
+    def insert_activity(self, user_id, transportation_mode, trajectory, source_file=None, summary=None):
+        """
+        Inserts a parsed activity and its trackpoints in the loader's layout.
+
+        summary is the activity's Trajectory.summary(), computed here if not passed in.
+
+        Returns:
+            summary (dict): The activity's Trajectory.summary().
+        """
+        if summary is None:
+            summary = trajectory.summary()
+        if self.layout == "bucketed":
+            activity_id = ObjectId()
+            self.insert_activity_data(user_id, transportation_mode, trajectory.start_time, trajectory.end_time, None,
+                                      source_file, summary, activity_id)
+            for bucket in encode_buckets(activity_id, user_id, trajectory):
+                self.bucket_writer.insert(bucket, bucket_size(bucket))
+        elif self.layout == "timeseries":
+            activity_id = ObjectId()
+            self.insert_activity_data(user_id, transportation_mode, trajectory.start_time, trajectory.end_time, None,
+                                      source_file, summary, activity_id)
+            meta = {"user_id": user_id, "activity_id": activity_id, "mode": transportation_mode}
+            for point in trajectory.documents():
+                point["meta"] = meta
+                self.series_writer.insert(point, TRACKPOINT_BSON_BYTES)
+        else:
+            self.insert_activity_data(user_id, transportation_mode, trajectory.start_time, trajectory.end_time,
+                                      trajectory.documents(), source_file, summary)
+        return summary
+
+    def delete_activities(self, query):
+        """
+        Deletes the activities matching a filter, and their buckets or time-series trackpoints.
+        """
+        if self.layout != "embedded":
+            activity_ids = self.db['Activity'].distinct("_id", query)
+            if activity_ids and self.layout == "bucketed":
+                self.db['TrackPointBucket'].delete_many({"activity_id": {"$in": activity_ids}})
+            elif activity_ids:
+                # Time-series collections only delete by the meta field
+                self.db['TrackPointSeries'].delete_many({"meta.activity_id": {"$in": activity_ids}})
+        self.db['Activity'].delete_many(query)
+
+    def add_to_rollups(self, user_id, transportation_mode, trajectory, summary):
+        """
+        Adds an activity to the pending totals of its (user, year, mode) in ActivityRollup,
+        which flush_rollups writes with $inc, so the rollups grow with the load instead of being rebuilt.
+
+        Call it before inserting the activity. The pending totals are written whenever the
+        activity writer flushes, so the rollups never lag the written activities by more than
+        the batch being written.
+        """
+        key = (user_id, trajectory.start_time.year, transportation_mode)
+        totals = self.rollups.setdefault(key, [0, 0.0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += (trajectory.end_time - trajectory.start_time).total_seconds() / 3600
+        totals[2] += summary["distance_km"]
+        totals[3] += summary["trackpoint_count"]
+
+    def flush(self):
+        """
+        Writes all buffered users, activities and buckets, and the rollup totals of the activities.
+        """
+        self.user_writer.flush()
+        self.activity_writer.flush()
+        self.bucket_writer.flush()
+        self.series_writer.flush()
+        self.flush_rollups()
+
+    def flush_rollups(self):
+        """
+        Writes the pending rollup totals to ActivityRollup, with one $inc upsert per (user, year, mode).
+        """
+        if self.rollups:
+            self.db['ActivityRollup'].bulk_write([
+                UpdateOne({"_id": {"user_id": user_id, "year": year, "transportation_mode": transportation_mode}},
+                          {"$inc": {"activity_count": count, "hours": hours, "distance_km": distance_km, "trackpoint_count": trackpoint_count}},
+                          upsert=True)
+                for (user_id, year, transportation_mode), (count, hours, distance_km, trackpoint_count) in self.rollups.items()
+            ], ordered=False)
+            self.rollups.clear()
+
+    def bump_generation(self):
+        """
+        Increments the dataset generation, a counter in the DatasetGeneration collection
+        that invalidates cached query results (see query_cache). The collection is not
+        dropped with the others, so the counter never goes back to a used value. It does
+        start over in a new database, so every bump also draws a random load_id, which
+        tells the loads of different databases apart.
+        """
+        self.db['DatasetGeneration'].update_one({"_id": "dataset"},
+                                                {"$inc": {"generation": 1}, "$set": {"load_id": uuid.uuid4().hex}},
+                                                upsert=True)
+
+    def backfill_summary_fields(self):
+        """
+        Sets trackpoint_count and max_gap_seconds on activities stored before the loaders computed them,
+        with a pipeline update that runs entirely on the server.
+
+        Only embedded activities can predate them, and only they carry the trackpoint array the
+        expressions read, so the other layouts are left alone.
+        """
+        if self.layout != "embedded":
+            return
+        result = self.db['Activity'].update_many(
+            {"trackpoint_count": {"$exists": False}},
+            [{"$set": {"trackpoint_count": TRACKPOINT_COUNT_EXPRESSION, "max_gap_seconds": MAX_GAP_SECONDS_EXPRESSION}}]
+        )
+        if result.modified_count:
+            print(f"Backfilled trackpoint_count and max_gap_seconds on {result.modified_count} activities")
+
+    def refresh_rollups(self, user_ids):
+        """
+        Recomputes the ActivityRollup documents of some users from their activities,
+        for the incremental load, which also deletes activities.
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        self.db['ActivityRollup'].delete_many({"_id.user_id": {"$in": user_ids}})
+        self.db['Activity'].aggregate([
+            {"$match": {"user_id": {"$in": user_ids}}},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "year": {"$year": "$start_time"}, "transportation_mode": "$transportation_mode"},
+                "activity_count": {"$sum": 1},
+                "hours": {"$sum": {"$divide": [{"$subtract": ["$end_time", "$start_time"]}, 3600000]}},
+                "distance_km": {"$sum": "$distance_km"},
+                "trackpoint_count": {"$sum": "$trackpoint_count"}
+            }},
+            {"$merge": {"into": "ActivityRollup", "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ])
 
 #--------------------------LABELS DATASTRUCTURES-----------------------------
 
@@ -77,16 +353,7 @@ class InsertGeolifeDatasetMongo:
         return labeled_users
 
     def create_label_hashmap(self, labels_file_path):
-        labels = {}
-        with open(labels_file_path, 'r') as file:
-            next(file)  # Skip header line
-            for line in file:
-                start_time_str, end_time_str, transportation_mode = line.strip().split('\t')
-                start_time = datetime.strptime(start_time_str, "%Y/%m/%d %H:%M:%S")
-                end_time = datetime.strptime(end_time_str, "%Y/%m/%d %H:%M:%S")
-                labels[(start_time, end_time)] = {
-                    'transportation_mode': transportation_mode
-                }
+        labels = read_label_file(labels_file_path)
         print(f"Created label hashmap: {labels}")
         return labels
 
@@ -117,57 +384,160 @@ class InsertGeolifeDatasetMongo:
                 self.insert_user(user_id, has_labels)
                 self.insert_activities_and_trackpoints(labels_hashmap, trajectory_folder_path, user_id, has_labels)
 
+        self.flush()
+
+    def traverse_folder_parallel(self, folder_path, workers):
+        """
+        Like traverse_folder, but parses the users' .plt files in a pool of worker processes.
+
+        Users are still written in ID order, and rows/second per stage are printed at the end.
+        With a parse cache, the parse stage is the time spent reading it.
+
+        Args:
+            folder_path (str): The path to the Geolife dataset folder.
+            workers (int): Number of parse processes.
+        """
+        stats = IngestStats(workers)
+
+        for user_id, has_labels, activities in self.iter_users(folder_path, workers, stats):
+            start = time.perf_counter()
+            self.insert_user(user_id, has_labels)
+            self.insert_parsed_activities(user_id, activities)
+            stats.write_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.flush()
+        stats.write_seconds += time.perf_counter() - start
+        stats.print_summary()
+
+    def iter_users(self, folder_path, workers, stats):
+        """
+        Parses every user of the dataset in a pool of worker processes, or reads them
+        from the parse cache if parse_cache_dir is set.
+
+        Returns:
+            iterator: (user_id, has_labels, activities) tuples in user ID order.
+        """
+        if self.parse_cache_dir:
+            return iter_cached_users(folder_path, self.parse_cache_dir, self.label_match, self.max_points, workers, stats)
+        labeled_users = self.read_labels(os.path.join(folder_path, "labeled_ids.txt"))
+        return iter_parsed_users(list_user_folders(folder_path), labeled_users, workers, stats, self.label_match, self.max_points)
+
+    def traverse_folder_incremental(self, folder_path):
+        """
+        Loads only the .plt files that are new or changed since the last run, as recorded in IngestManifest.
+
+        A file is unchanged if its size and mtime match the manifest, or else if its
+        content hash does. Activities remember their .plt file in source_file, so a
+        changed file's old activities are deleted before it is loaded again, and those
+        of files that disappeared are removed. Manifest entries are written after the
+        user's activities are flushed, but the activity writer may flush some of them
+        earlier, so a file without an entry may still have activities from a run that
+        crashed in between. They are deleted before every load of a file, not only of
+        files in the manifest, so the next run reloads those files without duplicating them.
+
+        Args:
+            folder_path (str): The path to the Geolife dataset folder.
+        """
+        start = time.perf_counter()
+        labeled_users = self.read_labels(os.path.join(folder_path, "labeled_ids.txt"))
+        data_dir = os.path.join(folder_path, "Data")
+        activities = self.db['Activity']
+        activities.create_index("source_file")
+        if activities.estimated_document_count() and not self.db['IngestManifest'].estimated_document_count():
+            raise ValueError("Activity was loaded without a manifest, start incremental loads from empty collections")
+        # The rollups below sum trackpoint_count, which older activities may lack
+        self.backfill_summary_fields()
+        manifest = {entry["_id"]: entry for entry in self.db['IngestManifest'].find()}
+
+        seen = set()
+        unchanged = loaded = 0
+        for user_id, user_folder_path in list_user_folders(folder_path):
+            has_labels = user_id in labeled_users
+            label_index = None
+            user_written = False
+            updates = []
+
+            for plt_file_path in iter_plt_files(os.path.join(user_folder_path, 'Trajectory')):
+                path = os.path.relpath(plt_file_path, data_dir)
+                seen.add(path)
+                stat = os.stat(plt_file_path)
+                entry = manifest.get(path)
+                if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                    unchanged += 1
+                    continue
+
+                trajectory, content_hash = read_plt_with_hash(plt_file_path, self.max_points)
+                if entry and entry["content_hash"] == content_hash:
+                    # Touched but not changed, only remember the new mtime
+                    updates.append(UpdateOne({"_id": path}, {"$set": {"mtime": stat.st_mtime}}))
+                    unchanged += 1
+                    continue
+
+                if not user_written:
+                    self.db['User'].replace_one({"_id": user_id}, {"has_labels": has_labels}, upsert=True)
+                    user_written = True
+                # Also for new files, whose activities may have been flushed by a run that crashed before its manifest write
+                self.delete_activities({"source_file": path})
+
+                activity_count = trackpoint_count = 0
+                if trajectory is not None:
+                    if has_labels and label_index is None:
+                        label_index = LabelIndex(read_label_file(os.path.join(user_folder_path, 'labels.txt')))
+                    for transportation_mode, part in label_trajectory(label_index, trajectory, self.label_match):
+                        self.insert_activity(user_id, transportation_mode, part, source_file=path)
+                        activity_count += 1
+                        trackpoint_count += len(part)
+                updates.append(ReplaceOne({"_id": path}, {
+                    "user_id": user_id,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "content_hash": content_hash,
+                    "activity_count": activity_count,
+                    "trackpoint_count": trackpoint_count,
+                    "ingested_at": datetime.datetime.now(),
+                }, upsert=True))
+                loaded += 1
+
+            if updates:
+                self.activity_writer.flush()
+                self.bucket_writer.flush()
+                self.series_writer.flush()
+                if user_written:
+                    self.refresh_rollups([user_id])
+                self.db['IngestManifest'].bulk_write(updates, ordered=False)
+
+        removed = [path for path in manifest if path not in seen]
+        if removed:
+            self.delete_activities({"source_file": {"$in": removed}})
+            self.refresh_rollups({manifest[path]["user_id"] for path in removed})
+            self.db['IngestManifest'].delete_many({"_id": {"$in": removed}})
+
+        print(f"Incremental load: {loaded} files loaded, {unchanged} unchanged, {len(removed)} removed "
+              f"in {time.perf_counter() - start:.2f} s")
+
 #--------------------------INSERT ACTIVITIES AND TRACKPOINTS-----------------------------
   
     def insert_activities_and_trackpoints(self, labels_hashmap, trajectory_folder_path, user_id, label):
-        for root, dirs, files in os.walk(trajectory_folder_path):
-            for plt_file in files:
-                if plt_file.endswith('.plt'):
-                    plt_file_path = os.path.join(trajectory_folder_path, plt_file)
-
-                    with open(plt_file_path, 'r') as f:
-                        total_lines = sum(1 for _ in f)
-                    if total_lines - 6 > 2500:
-                        print(f"Skipping file {plt_file} for user {user_id} due to size limit.")
-                        continue
-
-                    with open(plt_file_path, 'r') as file:
-                        lines = file.readlines()
-
-                    seventh_line = lines[6].strip()
-                    last_line = lines[-1].strip()
-
-                    start_date = seventh_line.split(',')
-                    end_date = last_line.split(',')
-
-                    start_datetime_str = f"{start_date[5]} {start_date[6]}"
-                    end_datetime_str = f"{end_date[5]} {end_date[6]}"
-
-                    start_datetime = datetime.strptime(start_datetime_str, "%Y-%m-%d %H:%M:%S")
-                    end_datetime = datetime.strptime(end_datetime_str, "%Y-%m-%d %H:%M:%S")
-                    transportation_mode = None
-
-                    trackpoints = []
-                    for line in itertools.islice(lines, 6, None):
-                        parts = line.strip().split(',')
-                        lat, lon, altitude, date_days = float(parts[0]), float(parts[1]), float(parts[3]), float(parts[4])
-                        timestamp = datetime.strptime(f"{parts[5]} {parts[6]}", "%Y-%m-%d %H:%M:%S")
-                        trackpoints.append({
-                            "lat": lat,
-                            "lon": lon,
-                            "altitude": altitude,
-                            "date_days": date_days,
-                            "date_time": timestamp
-                        })
-
-                    if label and labels_hashmap:
-                        for (start_time, end_time), data in labels_hashmap.items():
-                            if start_time == start_datetime and end_time == end_datetime:
-                                transportation_mode = data['transportation_mode']
-                                print(f"Found transportation mode {transportation_mode} for user {user_id} from labels.")
-                                break
-
-                    self.insert_activity_data(user_id, transportation_mode, start_datetime, end_datetime, trackpoints)
+        if not label:
+            labels_hashmap = None
+        self.insert_parsed_activities(user_id, iter_user_activities(labels_hashmap, trajectory_folder_path, self.max_points, self.label_match))
+
+    def insert_parsed_activities(self, user_id, activities):
+        """
+        Inserts parsed activities with their trackpoints embedded.
+
+        Args:
+            user_id (int): The user ID.
+            activities (iterable): (transportation_mode, trajectory) tuples.
+        """
+        if self.grid_index_builder is not None:
+            activities = self.grid_index_builder.track(user_id, activities)
+        for transportation_mode, trajectory in activities:
+            summary = trajectory.summary()
+            # Counted first, the insert may flush the activity writer and with it the pending rollups
+            self.add_to_rollups(user_id, transportation_mode, trajectory, summary)
+            self.insert_activity(user_id, transportation_mode, trajectory, summary=summary)
 
 #--------------------------DROP COLLECTIONS-----------------------------
     def drop_coll(self, collection_name):
@@ -225,25 +595,71 @@ class InsertGeolifeDatasetMongo:
     
 
 
-def main():
+def main(workers=None, batch_documents=500, label_match="exact", incremental=False, grid_index_path=None,
+         layout="embedded", parse_cache_dir=None):
+    """
+    Drops, recreates and loads the collections.
+
+    Args:
+        workers (int): Number of parse processes for a parallel load. None loads sequentially.
+        batch_documents (int): Number of documents per insert_many.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        incremental (bool): Keep the collections and only load new or changed files, see traverse_folder_incremental.
+        grid_index_path (str): Also build a local grid index of the trackpoints and save it here, see grid_index.
+        layout (str): How trackpoints are stored, "embedded", "bucketed" or "timeseries", see LAYOUTS.
+        parse_cache_dir (str): Read the parsed users from this parse cache, which is created or
+            refreshed from the .plt files first, see parse_cache.
+    """
     program = None
     try:
-        program = InsertGeolifeDatasetMongo()
+        program = InsertGeolifeDatasetMongo(batch_documents=batch_documents, label_match=label_match, layout=layout)
         
 #--------------------------DROP COLLECTIONS-----------------------------
-        program.drop_coll(collection_name="User")
-        program.drop_coll(collection_name="Activity")
+        # Cached query results are invalid from the first write on, see query_cache
+        program.bump_generation()
+
+        if not incremental:
+            program.drop_coll(collection_name="User")
+            program.drop_coll(collection_name="Activity")
+            program.drop_coll(collection_name="IngestManifest")
+            program.drop_coll(collection_name="ActivityRollup")
+            program.drop_coll(collection_name="TrackPointBucket")
+            program.drop_coll(collection_name="TrackPointSeries")
 
 #--------------------------CREATE COLLECTIONS-----------------------------
 
-        program.create_coll(collection_name="User")
-        program.create_coll(collection_name="Activity")
+            program.create_coll(collection_name="User")
+            program.create_coll(collection_name="Activity")
+        if layout == "timeseries" and "TrackPointSeries" not in program.db.list_collection_names():
+            # A plain collection would be created implicitly by the first insert
+            program.create_coll(collection_name="TrackPointSeries", timeseries=TRACKPOINT_SERIES_OPTIONS)
 
         current_dir = os.path.dirname(os.path.realpath(__file__))
         dataset_dir = os.path.join(current_dir, '../../dataset')
         dataset_dir = os.path.normpath(dataset_dir)
 
-        program.traverse_folder(dataset_dir)
+        if grid_index_path:
+            if incremental:
+                raise ValueError("The grid index is built from a full load, not an incremental one")
+            program.grid_index_builder = GridIndexBuilder()
+        if parse_cache_dir:
+            if incremental:
+                raise ValueError("The incremental loader tracks the .plt files themselves, not the parse cache")
+            program.parse_cache_dir = parse_cache_dir
+        if incremental:
+            program.traverse_folder_incremental(dataset_dir)
+        elif workers or parse_cache_dir:
+            program.traverse_folder_parallel(dataset_dir, workers or 1)
+        else:
+            program.traverse_folder(dataset_dir)
+        program.create_indexes()
+        program.print_storage_stats()
+        if grid_index_path:
+            start = time.perf_counter()
+            program.grid_index_builder.build().save(grid_index_path)
+            print(f"Saved the grid index to {grid_index_path} in {time.perf_counter() - start:.2f} s")
+        # Also after the load, so results cached while it ran are not reused
+        program.bump_generation()
 
 
 
@@ -262,4 +678,25 @@ def main():
             program.connection.close_connection()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Load the Geolife dataset into MongoDB.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parse .plt files in this many processes (default: sequential load)")
+    parser.add_argument("--batch-documents", type=int, default=500,
+                        help="number of documents written per insert_many (default: 500)")
+    parser.add_argument("--label-match", choices=LABEL_MATCHES, default="exact",
+                        help="match activities to labels with the same, a containing or the most overlapping "
+                             "interval, or split them into one activity per label segment")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep the collections and only load .plt files that are new or changed since the last run")
+    parser.add_argument("--grid-index", metavar="PATH", default=None,
+                        help="also save a local geohash/time grid index of the trackpoints to this .npz file")
+    parser.add_argument("--layout", choices=LAYOUTS, default="embedded",
+                        help="embed trackpoints in the activities, or store them as packed buckets in TrackPointBucket "
+                             "or as a time-series collection TrackPointSeries, which also load files over the trackpoint cap")
+    parser.add_argument("--parse-cache", metavar="DIR", default=None,
+                        help="read the parsed .plt files from a binary cache in this directory, built or refreshed "
+                             "from the dataset first (see geolife/parse_cache.py)")
+    args = parser.parse_args()
+    main(workers=args.workers, batch_documents=args.batch_documents, label_match=args.label_match,
+         incremental=args.incremental, grid_index_path=args.grid_index, layout=args.layout,
+         parse_cache_dir=args.parse_cache)
@@ -1,29 +1,188 @@
 from pprint import pprint
+import argparse
+import os
 from DbConnector import DbConnector
 import datetime
 from tabulate import tabulate
+import sys
+# The modules both assignments share live in the geolife package at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from geolife.columnar import CHUNK_ROWS, ColumnBuffer
+from geolife.geo import activity_distances, region_ring
+from geolife.grid_index import GridIndex, points_in_polygon
+from insertion import LAYOUTS, MAX_GAP_SECONDS_EXPRESSION, TRACKPOINT_COUNT_EXPRESSION
+from geolife.plt_reader import INVALID_GAP_SECONDS, activity_altitude_gains, activity_max_gaps
 import numpy as np
+from geolife.query_cache import QueryCache
+from trackpoint_buckets import decode_bucket
+
+# The query methods whose results are cached by the command line run, see query_cache
+CACHED_METHODS = [
+    "find_number_of", "find_avg_activities_per_user", "find_most_active_20_users", "find_taxi_users",
+    "count_transportation_modes", "find_year_with_most_activities", "find_year_with_most_hours",
+    "find_distance_per_user_mode_year", "find_altitude_gain_top_20_users", "find_invalid_activities",
+    "find_users_in_region", "find_most_used_transportation_per_user",
+]
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".query_cache")
 
 class Part2:
 
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, connection=None, layout="embedded"):
+        """
+        Args:
+            connection (DbConnector): An existing connector to share, instead of opening a new one.
+            layout (str): How the loader stored the trackpoints, "embedded", "bucketed" or "timeseries"
+                (see insertion.LAYOUTS).
+        """
+        self.connection = connection or DbConnector()
+        self.layout = layout
+        self.grid_index = None
         self.client = self.connection.client
         self.db = self.connection.db
 
+    def dataset_generation(self):
+        """
+        Returns the generation the loaders bump on every load, as "<counter>-<load_id>", or None
+        if the data was loaded before the load_id existed, in which case nothing is cached.
+        The load_id keeps a new database, whose counter starts over, from hitting old results.
+        """
+        document = self.db['DatasetGeneration'].find_one({"_id": "dataset"})
+        return f"{document['generation']}-{document['load_id']}" if document and document.get("load_id") else None
+
+    def fetch_trackpoint_columns(self, match, activity_dtypes, trackpoint_dtypes, batch_size=1000):
+        """
+        Streams activities and their embedded trackpoints into typed NumPy columns.
+
+        Only the requested fields are projected, and the cursor fetches batch_size
+        activities per round trip, so no list of documents is built.
+
+        Args:
+            match (dict): Filter on the Activity collection.
+            activity_dtypes (dict): NumPy dtype per activity field, e.g. {"user_id": np.int64}.
+            trackpoint_dtypes (dict): NumPy dtype per trackpoint field, e.g. {"lat": np.float64}.
+            batch_size (int): Activities per batch from the server.
+
+        Returns:
+            (activities, trackpoints): Dicts of NumPy arrays. trackpoints["activity"] holds
+                each trackpoint's row in activities, and the trackpoints of an activity are contiguous.
+        """
+        if self.layout == "bucketed":
+            return self.fetch_bucket_columns(match, activity_dtypes, trackpoint_dtypes, batch_size)
+        if self.layout == "timeseries":
+            return self.fetch_series_columns(match, activity_dtypes, trackpoint_dtypes, batch_size)
+        projection = {field: 1 for field in activity_dtypes}
+        projection.update({f"trackpoints.{field}": 1 for field in trackpoint_dtypes})
+        projection.setdefault("_id", 0)
+
+        activities = ColumnBuffer(activity_dtypes, batch_size)
+        trackpoints = ColumnBuffer(dict(trackpoint_dtypes, activity=np.int64), CHUNK_ROWS)
+        for activity in self.db['Activity'].find(match, projection).batch_size(batch_size):
+            points = activity.get("trackpoints", [])
+            columns = {field: [point[field] for point in points] for field in trackpoint_dtypes}
+            columns["activity"] = np.full(len(points), len(activities))
+            trackpoints.append_columns(columns)
+            activities.append_rows([tuple(activity.get(field) for field in activity_dtypes)])
+        return activities.columns(), trackpoints.columns()
+
+    def iter_buckets(self, query, fields, batch_size=1000):
+        """
+        Streams the buckets matching a filter on TrackPointBucket, decoded into NumPy arrays.
+
+        Args:
+            query (dict): Filter on the TrackPointBucket collection.
+            fields (iterable): The trackpoint fields to decode, see trackpoint_buckets.BUCKET_FIELDS.
+            batch_size (int): Buckets per batch from the server.
+
+        Yields:
+            (activity_id, columns) tuples in (activity_id, seq) order, columns being a dict of arrays.
+        """
+        fields = list(fields)
+        projection = {"activity_id": 1, "_id": 0, **{field: 1 for field in fields}}
+        buckets = self.db['TrackPointBucket'].find(query, projection).sort([("activity_id", 1), ("seq", 1)])
+        for bucket in buckets.batch_size(batch_size):
+            yield bucket["activity_id"], decode_bucket(bucket, fields)
+
+    def fetch_bucket_columns(self, match, activity_dtypes, trackpoint_dtypes, batch_size=1000):
+        """
+        Like fetch_trackpoint_columns, for trackpoints stored in TrackPointBucket.
+
+        The activities are read in batches of batch_size, and the buckets of each batch are
+        fetched with one $in query on the (activity_id, seq) index and decoded into the columns.
+        """
+        activities = ColumnBuffer(activity_dtypes, batch_size)
+        trackpoints = ColumnBuffer(dict(trackpoint_dtypes, activity=np.int64), CHUNK_ROWS)
+        for rows in self.iter_activity_batches(match, activity_dtypes, activities, batch_size):
+            for activity_id, columns in self.iter_buckets({"activity_id": {"$in": list(rows)}}, trackpoint_dtypes, batch_size):
+                columns["activity"] = np.full(len(columns[next(iter(trackpoint_dtypes))]), rows[activity_id])
+                trackpoints.append_columns(columns)
+        return activities.columns(), trackpoints.columns()
+
+    def fetch_series_columns(self, match, activity_dtypes, trackpoint_dtypes, batch_size=1000):
+        """
+        Like fetch_trackpoint_columns, for trackpoints stored in the TrackPointSeries time-series collection.
+
+        The trackpoints of each batch of activities are fetched with one $in query on the
+        (meta.activity_id, date_time) index and appended to the columns CHUNK_ROWS at a time.
+        """
+        fields = list(trackpoint_dtypes)
+        projection = {"meta.activity_id": 1, "_id": 0, **{field: 1 for field in fields}}
+        activities = ColumnBuffer(activity_dtypes, batch_size)
+        trackpoints = ColumnBuffer(dict(trackpoint_dtypes, activity=np.int64), CHUNK_ROWS)
+        for rows in self.iter_activity_batches(match, activity_dtypes, activities, batch_size):
+            points = self.db['TrackPointSeries'].find({"meta.activity_id": {"$in": list(rows)}}, projection)
+            chunk = []
+            for point in points.sort([("meta.activity_id", 1), ("date_time", 1)]).batch_size(CHUNK_ROWS):
+                chunk.append(tuple(point[field] for field in fields) + (rows[point["meta"]["activity_id"]],))
+                if len(chunk) >= CHUNK_ROWS:
+                    trackpoints.append_rows(chunk)
+                    chunk = []
+            trackpoints.append_rows(chunk)
+        return activities.columns(), trackpoints.columns()
+
+    def iter_activity_batches(self, match, activity_dtypes, activities, batch_size=1000):
+        """
+        Reads the activities matching a filter into a ColumnBuffer, for the layouts that store
+        trackpoints outside the activities.
+
+        Yields:
+            rows (dict): The row in activities of each activity _id in the batch, at most batch_size of them.
+        """
+        projection = {field: 1 for field in activity_dtypes}
+        rows = {}
+        for activity in self.db['Activity'].find(match, projection).batch_size(batch_size):
+            rows[activity["_id"]] = len(activities)
+            activities.append_rows([tuple(activity.get(field) for field in activity_dtypes)])
+            if len(rows) >= batch_size:
+                yield rows
+                rows = {}
+        if rows:
+            yield rows
+
     # 1. Count users, activities, and trackpoints
-    def find_number_of(self):
+    def find_number_of(self, from_summaries=True):
         user_count = self.db['User'].count_documents({})
         activity_count = self.db['Activity'].count_documents({})
 
-        # Unwinding trackpoints to count them
-        trackpoint_count = self.db['Activity'].aggregate([
-            {"$unwind": "$trackpoints"},
-            {"$group": {"_id": None, "count": {"$sum": 1}}}
-        ])
+        if from_summaries:
+            # Summing the counts stored on the activities
+            trackpoint_count = self.db['Activity'].aggregate([
+                {"$group": {"_id": None, "count": {"$sum": "$trackpoint_count"}}}
+            ])
+        elif self.layout == "embedded":
+            # Counting the embedded arrays, without unwinding them into a document per trackpoint
+            trackpoint_count = self.db['Activity'].aggregate([
+                {"$group": {"_id": None, "count": {"$sum": TRACKPOINT_COUNT_EXPRESSION}}}
+            ])
+        else:
+            # The other layouts keep no trackpoint array on the activities, the trackpoints are streamed instead
+            _, trackpoints = self.fetch_trackpoint_columns({}, {"user_id": np.int64}, {"date_time": "datetime64[s]"})
+            trackpoint_count = [{"count": len(trackpoints["activity"])}]
 
-        trackpoint_count_value = list(trackpoint_count)[0]['count'] if trackpoint_count else 0
+        trackpoint_count = list(trackpoint_count)
+        trackpoint_count_value = trackpoint_count[0]['count'] if trackpoint_count else 0
         print(f"Users: {user_count}, Activities: {activity_count}, Trackpoints: {trackpoint_count_value}")
+        return user_count, activity_count, trackpoint_count_value
 
     # 2. Average number of activities per user
     def find_avg_activities_per_user(self):
@@ -37,12 +196,19 @@ class Part2:
         print(f"The average number of activities per user is: {round(total_activities / total_users, 2)}")
 
     # 3. Find the top 20 users with the highest number of activities
-    def find_most_active_20_users(self):
-        top_users = self.db['Activity'].aggregate([
-            {"$group": {"_id": "$user_id", "number_of_activities": {"$sum": 1}}}, 
-            {"$sort": {"number_of_activities": -1}}, 
-            {"$limit": 20}
-        ])
+    def find_most_active_20_users(self, from_rollups=True):
+        if from_rollups:
+            top_users = self.db['ActivityRollup'].aggregate([
+                {"$group": {"_id": "$_id.user_id", "number_of_activities": {"$sum": "$activity_count"}}},
+                {"$sort": {"number_of_activities": -1}},
+                {"$limit": 20}
+            ])
+        else:
+            top_users = self.db['Activity'].aggregate([
+                {"$group": {"_id": "$user_id", "number_of_activities": {"$sum": 1}}}, 
+                {"$sort": {"number_of_activities": -1}}, 
+                {"$limit": 20}
+            ])
 
         # print the results
         rows = [[user['_id'], user['number_of_activities']] for user in top_users]
@@ -55,23 +221,36 @@ class Part2:
 
     #5. Find all types of transportation modes and count how many activities that are
     # tagged with these transportation mode labels. Do not count the rows where the mode is null
-    def count_transportation_modes(self):
-        mode_counts = self.db['Activity'].aggregate([
-            {"$match": {"transportation_mode": {"$ne": None}}},
-            {"$group": {"_id": "$transportation_mode", "count": {"$sum": 1}}},
-        ])
+    def count_transportation_modes(self, from_rollups=True):
+        if from_rollups:
+            mode_counts = self.db['ActivityRollup'].aggregate([
+                {"$match": {"_id.transportation_mode": {"$ne": None}}},
+                {"$group": {"_id": "$_id.transportation_mode", "count": {"$sum": "$activity_count"}}},
+            ])
+        else:
+            mode_counts = self.db['Activity'].aggregate([
+                {"$match": {"transportation_mode": {"$ne": None}}},
+                {"$group": {"_id": "$transportation_mode", "count": {"$sum": 1}}},
+            ])
         
         # Print the results
         rows = [[mode['_id'], mode['count']] for mode in mode_counts]
         print(tabulate(rows, headers=['Mode', 'Activity Count'], tablefmt="fancy_grid"))
 
     #6. a) Find the year with the most activities.
-    def find_year_with_most_activities(self):
-        year_activities = self.db['Activity'].aggregate([
-            {"$group": {"_id": {"$year": "$start_time"}, "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 1}
-        ])
+    def find_year_with_most_activities(self, from_rollups=True):
+        if from_rollups:
+            year_activities = self.db['ActivityRollup'].aggregate([
+                {"$group": {"_id": "$_id.year", "count": {"$sum": "$activity_count"}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 1}
+            ])
+        else:
+            year_activities = self.db['Activity'].aggregate([
+                {"$group": {"_id": {"$year": "$start_time"}, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 1}
+            ])
 
         # Print the results
         year = list(year_activities)
@@ -82,24 +261,31 @@ class Part2:
         return year[0]['_id']
     
     # 6. b) Is this also the year with most recorded hours?
-    def find_year_with_most_hours(self):
-        year_hours = self.db['Activity'].aggregate([
-            {
-                "$group": {
-                    "_id": {"$year": "$start_time"},
-                    "recorded_hours": {
-                        "$sum": {
-                            "$divide": [
-                                {"$subtract": ["$end_time", "$start_time"]},  # Calculate duration in milliseconds
-                                3600000  # Convert milliseconds to hours
-                            ]
+    def find_year_with_most_hours(self, from_rollups=True):
+        if from_rollups:
+            year_hours = self.db['ActivityRollup'].aggregate([
+                {"$group": {"_id": "$_id.year", "recorded_hours": {"$sum": "$hours"}}},
+                {"$sort": {"recorded_hours": -1}},
+                {"$limit": 1}
+            ])
+        else:
+            year_hours = self.db['Activity'].aggregate([
+                {
+                    "$group": {
+                        "_id": {"$year": "$start_time"},
+                        "recorded_hours": {
+                            "$sum": {
+                                "$divide": [
+                                    {"$subtract": ["$end_time", "$start_time"]},  # Calculate duration in milliseconds
+                                    3600000  # Convert milliseconds to hours
+                                ]
+                            }
                         }
                     }
-                }
-            },
-            {"$sort": {"recorded_hours": -1}},  # Sort by recorded hours in descending order
-            {"$limit": 1}  # Limit to the highest
-        ])
+                },
+                {"$sort": {"recorded_hours": -1}},  # Sort by recorded hours in descending order
+                {"$limit": 1}  # Limit to the highest
+            ])
 
         year_with_most_hours = list(year_hours)
 
@@ -110,7 +296,7 @@ class Part2:
             return None, 0
         
         #Comparing to the year with the most activities
-        most_activities_year = self.find_year_with_most_activities()
+        most_activities_year = self.find_year_with_most_activities(from_rollups)
         if most_activities_year == year_with_most_hours[0]['_id']:
             print(f"Yes, the year {most_activities_year[0]} has the most activities and also the most recorded hours.")
         else:
@@ -121,126 +307,102 @@ class Part2:
     def find_total_distance_walked_2008_user112(self):
         """
         Finds the total distance (in km) walked in 2008 by user with id=112 using the haversine formula.
-        
-        Source for haversine: https://stackoverflow.com/questions/29545704/fast-haversine-approximation-python-pandas/29546836#29546836
         """
         user_id = 112
+        result = self.find_distance_per_user_mode_year(user_id=user_id, transportation_mode="walk", year=2008, show=False)
+        total_distance = sum(distance for _, _, _, distance in result)
 
-        # Finding trackpoints for user 112 in 2008 where the person walked
-        trackpoints = self.db['Activity'].aggregate([
-            {
-                "$match": {
-                    "user_id": user_id,
-                    "transportation_mode": "walk",
-                    "start_time": {
-                        "$gte": datetime.datetime(2008, 1, 1),
-                        "$lt": datetime.datetime(2009, 1, 1),
-                    }
-                }
-            },
-            {"$unwind": "$trackpoints"},
-            {
-                "$project": {
-                    "lat": "$trackpoints.lat",
-                    "lon": "$trackpoints.lon",
-                    "date_time": "$trackpoints.date_time"
-                }
-            }
-        ])
-
-        trackpoints_list = list(trackpoints)
-
-        if len(trackpoints_list) < 2:
-            return 0.0
-
-        total_distance = 0.0
-
-        # Loop through trackpoints and calculate the total distance in kilometers
-        for i in range(1, len(trackpoints_list)):
-            previous_point = trackpoints_list[i - 1]
-            current_point = trackpoints_list[i]
-
-            # Extract latitudes and longitudes for both points
-            lat1, lon1 = previous_point['lat'], previous_point['lon']
-            lat2, lon2 = current_point['lat'], current_point['lon']
-
-            # Converting degrees to radians
-            lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+        print(f"Total distance walked by user {user_id} in 2008: {round(total_distance, 2)} km")
+        return total_distance
 
-            # Haversine formula components
-            dlon = lon2 - lon1
-            dlat = lat2 - lat1
+    def find_distance_per_user_mode_year(self, user_id=None, transportation_mode=None, year=None, show=True,
+                                         from_summaries=True):
+        """
+        Finds the distance (in km) travelled per user, transportation mode and year.
+
+        By default the distance_km stored on each activity is summed. Otherwise the coordinates are streamed into NumPy columns without $unwind (see
+        fetch_trackpoint_columns) and summed per activity with a vectorized haversine
+        (see geo.activity_distances), so no distance is counted between the end of
+        one activity and the start of the next.
+
+        Args:
+            user_id (int): Only this user. None includes all users.
+            transportation_mode (str): Only this mode. None includes all activities, labeled or not.
+            year (int): Only activities starting in this year. None includes all years.
+            show (bool): Print the result as a table.
+            from_summaries (bool): Sum the activities' distance_km instead of the trackpoints.
+
+        Returns:
+            result (list): (user_id, transportation_mode, year, distance_km) tuples, sorted.
+        """
+        match = {}
+        if user_id is not None:
+            match["user_id"] = user_id
+        if transportation_mode is not None:
+            match["transportation_mode"] = transportation_mode
+        if year is not None:
+            match["start_time"] = {
+                "$gte": datetime.datetime(year, 1, 1),
+                "$lt": datetime.datetime(year + 1, 1, 1),
+            }
 
-            a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
-            c = 2 * np.arcsin(np.sqrt(a))
+        if from_summaries:
+            groups = self.db['Activity'].aggregate([
+                {"$match": match},
+                {"$group": {
+                    "_id": {"user_id": "$user_id", "transportation_mode": "$transportation_mode", "year": {"$year": "$start_time"}},
+                    "distance": {"$sum": "$distance_km"}
+                }}
+            ])
+            distances = {(group["_id"]["user_id"], group["_id"].get("transportation_mode"), group["_id"]["year"]): group["distance"]
+                         for group in groups}
+        else:
+            distances = self.sum_trackpoint_distances(match)
 
-            #Radius of Earth = 6378.137 km
-            distance_km = 6378.137 * c
+        result = sorted(((user, mode, activity_year, distance) for (user, mode, activity_year), distance in distances.items()),
+                        key=lambda row: (row[0], row[1] or "", row[2]))
+        if show:
+            print(tabulate(result, headers=["User ID", "Transportation mode", "Year", "Distance (km)"], floatfmt=".2f"))
+        return result
 
-            # Accumulate the total distance
-            total_distance += distance_km
+    def sum_trackpoint_distances(self, match):
+        """
+        Sums the haversine distances between the trackpoints of the activities matching a filter.
 
-        print(f"Total distance walked by user {user_id} in 2008: {round(total_distance, 2)} km")
-        return total_distance
+        Returns:
+            distances (dict): Distance in km keyed by (user_id, transportation_mode, year).
+        """
+        activities, trackpoints = self.fetch_trackpoint_columns(
+            match,
+            {"user_id": np.int64, "transportation_mode": object, "start_time": "datetime64[s]"},
+            {"lat": np.float64, "lon": np.float64})
+        years = activities["start_time"].astype("datetime64[Y]").astype(np.int64) + 1970
+
+        distances = {}
+        for activity, distance in zip(*activity_distances(trackpoints["lat"], trackpoints["lon"], trackpoints["activity"])):
+            key = (int(activities["user_id"][activity]), activities["transportation_mode"][activity], int(years[activity]))
+            distances[key] = distances.get(key, 0.0) + float(distance)
+        return distances
 
     # 8. Find the top 20 users who have gained the most altitude meters
-    def find_altitude_gain_top_20_users(self):
-
-        altitude_gain = self.db['Activity'].aggregate([
-            {"$unwind": "$trackpoints"},
-            {
-                "$match": {
-                    "trackpoints.altitude": {"$gt": -413}  # Filter out invalid altitudes (-413)
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "user_id": "$user_id",  # Group by user
-                        "activity_id": "$_id"  # Group by activity
-                    },
-                    "trackpoints": {    
-                        "$push": "$trackpoints.altitude"  # Fetch all altitudes for an activity
-                    }
-                }
-            },
-            {
-                "$project": {
-                    "_id": 1,
-                    "total_gain": {
-                        "$sum": {
-                            "$map": {
-                                "input": {"$range": [1, {"$size": "$trackpoints"}]},  # Iterate trackPts
-                                "as": "idx",
-                                "in": {
-                                    "$cond": [
-                                        {"$gt": [{"$arrayElemAt": ["$trackpoints", "$$idx"]}, {"$arrayElemAt": ["$trackpoints", {"$subtract": ["$$idx", 1]}]}]},
-                                        {
-                                            "$multiply": [
-                                                {"$subtract": [
-                                                    {"$arrayElemAt": ["$trackpoints", "$$idx"]},  # Current altitude
-                                                    {"$arrayElemAt": ["$trackpoints", {"$subtract": ["$$idx", 1]}]}  # Previous altitude
-                                                ]},
-                                                0.3048  # Convert feet to meters
-                                            ]
-                                        },
-                                        0
-                                    ]
-                                }
-                            }
-                        }
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$_id.user_id",  # Group by user to get total gain on all activities
-                    "total_gain": {"$sum": "$total_gain"}
-                }
-            },
-            {"$sort": {"total_gain": -1}},  # Sort by total altitude gain
-            {"$limit": 20}  # Get top 20 users
-        ])
+    def find_altitude_gain_top_20_users(self, from_summaries=True):
+
+        if from_summaries:
+            # Summing the gains stored on the activities
+            altitude_gain = self.db['Activity'].aggregate([
+                {"$group": {"_id": "$user_id", "total_gain": {"$sum": "$altitude_gain_m"}}},
+                {"$match": {"total_gain": {"$gt": 0}}},
+                {"$sort": {"total_gain": -1}},
+                {"$limit": 20}
+            ])
+        else:
+            # Computing the gains from the trackpoints with the rules of Trajectory.summary, in any layout
+            activities, trackpoints = self.fetch_trackpoint_columns({}, {"user_id": np.int64}, {"altitude": np.float64})
+            rows, gains = activity_altitude_gains(trackpoints["altitude"], trackpoints["activity"])
+            user_ids, user_index = np.unique(activities["user_id"][rows], return_inverse=True)
+            total_gains = np.bincount(user_index, weights=gains, minlength=len(user_ids))
+            order = [i for i in np.argsort(-total_gains, kind="stable")[:20] if total_gains[i] > 0]
+            altitude_gain = [{"_id": int(user_ids[i]), "total_gain": float(total_gains[i])} for i in order]
 
         # Print the results
         altitude_gain = list(altitude_gain)
@@ -251,39 +413,33 @@ class Part2:
             print(tabulate(rows, headers=['User ID', 'Total Altitude Gain (meters)'], tablefmt="fancy_grid"))
         else:
             print("No altitude gain data found.")
+        return [(doc["_id"], doc["total_gain"]) for doc in altitude_gain]
 
     # 9. Find all users who have invalid activities, and the number of invalid activities per user 
-    def find_invalid_activities(self):
-        activities = self.db['Activity'].aggregate([
-            {"$unwind": "$trackpoints"},  # Unwind trackpoints
-            {"$group": {
-                "_id": "$_id",
-                "user_id": {"$first": "$user_id"},
-                "trackpoints": {"$push": "$trackpoints"}
-            }},
-        ])
-
-        invalid_activities_per_user = {}
-
-        # Iterate through the activities trackpoints
-        for activity in activities:
-            user_id = activity['user_id']
-            trackpoints = activity['trackpoints']
-
-            # Check if consecutive trackpoints have timestamps that deviate by at least 5 minutes
-            invalid_activity_found = False
-            for i in range(1, len(trackpoints)):
-                time_difference = trackpoints[i]['date_time'] - trackpoints[i - 1]['date_time']
-                if time_difference.total_seconds() >= 300:  # 300 seconds = 5 minutes
-                    invalid_activity_found = True
-                    break
-            
-            # Add it to the user's invalid activities if it is found
-            if invalid_activity_found:
-                if user_id not in invalid_activities_per_user:
-                    invalid_activities_per_user[user_id] = 1
-                else:
-                    invalid_activities_per_user[user_id] += 1
+    def find_invalid_activities(self, from_summaries=True):
+        if from_summaries:
+            # The largest gap between consecutive trackpoints is stored on each activity
+            groups = self.db['Activity'].aggregate([
+                {"$match": {"max_gap_seconds": {"$gte": INVALID_GAP_SECONDS}}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+                {"$sort": {"_id": 1}}
+            ])
+            invalid_activities_per_user = {group["_id"]: group["count"] for group in groups}
+        elif self.layout == "embedded":
+            # Finding the largest gap of each activity on the server, see MAX_GAP_SECONDS_EXPRESSION
+            groups = self.db['Activity'].aggregate([
+                {"$project": {"user_id": 1, "max_gap_seconds": MAX_GAP_SECONDS_EXPRESSION}},
+                {"$match": {"max_gap_seconds": {"$gte": INVALID_GAP_SECONDS}}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+                {"$sort": {"_id": 1}}
+            ])
+            invalid_activities_per_user = {group["_id"]: group["count"] for group in groups}
+        else:
+            # The other layouts keep no trackpoint array on the activities, the gaps are found in the streamed trackpoints
+            activities, trackpoints = self.fetch_trackpoint_columns({}, {"user_id": np.int64}, {"date_time": "datetime64[s]"})
+            rows, max_gaps = activity_max_gaps(trackpoints["date_time"], trackpoints["activity"])
+            user_ids, counts = np.unique(activities["user_id"][rows[max_gaps >= INVALID_GAP_SECONDS]], return_counts=True)
+            invalid_activities_per_user = dict(zip(user_ids.tolist(), counts.tolist()))
 
         # Print results
         if invalid_activities_per_user:
@@ -308,18 +464,12 @@ class Part2:
             print(tabulate(compact_rows, headers=headers, tablefmt="grid"))
         else:
             print("No invalid activities found.")
+        return invalid_activities_per_user
 
     # 10. Find the users who have tracked an activity in the Forbidden City of Beijing
     def find_users_in_forbidden_city(self):
 
-        users_in_forbidden_city = self.db['Activity'].distinct("user_id", {
-                "trackpoints": {
-                    "$elemMatch": {
-                        "lat": {"$gte": 39.916000, "$lte": 39.916999},
-                        "lon": {"$gte": 116.397000, "$lte": 116.397999}
-                    }
-                }
-            })
+        users_in_forbidden_city = self.find_users_in_region(bbox=(39.916000, 116.397000, 39.916999, 116.397999))
         
         # Print the results
         if users_in_forbidden_city:
@@ -328,19 +478,126 @@ class Part2:
         else:
             print("No users found in the Forbidden City.")
 
+    def find_users_in_region(self, bbox=None, polygon=None, use_grid_index=False):
+        """
+        Finds the users with a trackpoint inside a region, using the 2dsphere index on trackpoints.location.
+
+        Args:
+            bbox (tuple): (min_lat, min_lon, max_lat, max_lon).
+            polygon (list): (lat, lon) vertices of the region.
+            use_grid_index (bool): Answer from the grid index loaded with load_grid_index instead.
+
+        Returns:
+            user_ids (list): The user IDs, sorted.
+        """
+        if use_grid_index:
+            return self.require_grid_index().users_in_region(bbox, polygon)
+        if self.layout == "bucketed":
+            return self.find_users_in_region_buckets(region_ring(bbox, polygon))
+        region = {"type": "Polygon", "coordinates": [[list(point) for point in region_ring(bbox, polygon)]]}
+        if self.layout == "timeseries":
+            # The user is part of each trackpoint's meta document, so no lookup of the activities is needed
+            return sorted(self.db['TrackPointSeries'].distinct("meta.user_id", {
+                "location": {"$geoWithin": {"$geometry": region}}
+            }))
+        return sorted(self.db['Activity'].distinct("user_id", {
+            "trackpoints.location": {"$geoWithin": {"$geometry": region}}
+        }))
+
+    def find_users_in_region_buckets(self, ring):
+        """
+        find_users_in_region for the bucketed layout. Only buckets whose bounding box overlaps
+        the region's are decoded, and their points are tested against the ring.
+
+        Args:
+            ring (list): Closed (lon, lat) ring, as from region_ring.
+        """
+        lons, lats = zip(*ring)
+        overlaps = {
+            "bbox.min_lat": {"$lte": max(lats)}, "bbox.max_lat": {"$gte": min(lats)},
+            "bbox.min_lon": {"$lte": max(lons)}, "bbox.max_lon": {"$gte": min(lons)},
+        }
+        activity_ids = {activity_id for activity_id, columns in self.iter_buckets(overlaps, ("lat", "lon"))
+                        if points_in_polygon(columns["lat"], columns["lon"], ring).any()}
+        if not activity_ids:
+            return []
+        return sorted(self.db['Activity'].distinct("user_id", {"_id": {"$in": list(activity_ids)}}))
+
+    def load_grid_index(self, path):
+        """
+        Loads a grid index saved by the loader (--grid-index), for the queries below that run without the database.
+        """
+        self.grid_index = GridIndex.load(path)
+        print(f"Loaded grid index with {len(self.grid_index)} trackpoints from {path}")
+
+    def require_grid_index(self):
+        """
+        Returns the grid index loaded with load_grid_index, for the queries that answer from it.
+        """
+        if self.grid_index is None:
+            raise ValueError("No grid index is loaded, call load_grid_index with a file saved by the loader's --grid-index")
+        return self.grid_index
+
+    def find_users_near(self, lat, lon, radius_m=50, start_time=None, end_time=None):
+        """
+        Finds the users that passed within radius_m of a point, from the grid index.
+
+        Args:
+            lat, lon (float): The point, in degrees.
+            radius_m (float): The distance in meters.
+            start_time, end_time (datetime): Only count trackpoints in this time window.
+
+        Returns:
+            user_ids (list): The user IDs, sorted.
+        """
+        return self.require_grid_index().users_near(lat, lon, radius_m, start_time, end_time)
+
+    def find_colocated_users(self, radius_m=50, max_seconds=None):
+        """
+        Finds the pairs of users that were within radius_m of each other at the same time, from the grid index.
+
+        Args:
+            radius_m (float): The distance in meters.
+            max_seconds (int): The largest time difference that counts as the same time,
+                at most the time bucket of the index.
+
+        Returns:
+            pairs (list): (user_a, user_b, first_time) tuples.
+        """
+        pairs = self.require_grid_index().colocated_users(radius_m, max_seconds)
+        print(tabulate([(a, b, str(time)) for a, b, time in pairs], headers=["User ID", "User ID", "First met"]))
+        return pairs
+
     # 11. Find the most used transportation mode per user
-    def find_most_used_transportation_per_user(self):
-        most_used_mode = self.db['Activity'].aggregate([
-            {"$match": {"transportation_mode": {"$ne": None}}},  # Filter out no mode
-            {
-                "$group": {
-                    "_id": {
-                        "user_id": "$user_id",
-                        "transportation_mode": "$transportation_mode"
-                    },
-                    "count": {"$sum": 1}  # Count number of each transportation mode per user
-                }
-            },
+    def find_most_used_transportation_per_user(self, from_rollups=True):
+        if from_rollups:
+            # The rollups are already counted per user and mode, only the years are summed
+            mode_counts = [
+                {"$match": {"_id.transportation_mode": {"$ne": None}}},
+                {
+                    "$group": {
+                        "_id": {
+                            "user_id": "$_id.user_id",
+                            "transportation_mode": "$_id.transportation_mode"
+                        },
+                        "count": {"$sum": "$activity_count"}
+                    }
+                },
+            ]
+        else:
+            mode_counts = [
+                {"$match": {"transportation_mode": {"$ne": None}}},  # Filter out no mode
+                {
+                    "$group": {
+                        "_id": {
+                            "user_id": "$user_id",
+                            "transportation_mode": "$transportation_mode"
+                        },
+                        "count": {"$sum": 1}  # Count number of each transportation mode per user
+                    }
+                },
+            ]
+        most_used_mode = self.db['ActivityRollup' if from_rollups else 'Activity'].aggregate(mode_counts + [
             {"$sort": {"_id.user_id": 1, "count": -1}},  # Sort by user_id
             {
                 "$group": {
@@ -357,9 +614,24 @@ class Part2:
 
     
 if __name__ == "__main__":
-
+    parser = argparse.ArgumentParser(description="Run the part2 queries.")
+    parser.add_argument("--no-cache", action="store_true", help="run every query, without the result cache")
+    parser.add_argument("--layout", choices=LAYOUTS, default="embedded",
+                        help="how the loader stored the trackpoints (default: embedded)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"directory of the on-disk result cache (default: {DEFAULT_CACHE_DIR})")
+    args = parser.parse_args()
+
+    part2 = None
+    cache = None
     try:
-        part2 = Part2()
+        part2 = Part2(layout=args.layout)
+        if not args.no_cache:
+            # Results are reused until the next load bumps the dataset generation
+            cache = QueryCache(path=args.cache_dir)
+            cache.prune(part2.dataset_generation())
+            # The layout changes which queries run, so results of one layout are not reused for another
+            cache.wrap(part2, CACHED_METHODS, part2.dataset_generation, scope=(part2.layout,))
 
         print("1. Count users, activities, and trackpoints:")
         part2.find_number_of()
@@ -397,6 +669,10 @@ if __name__ == "__main__":
         print("\n11. Users with registered transportation modes and their most used mode:")
         part2.find_most_used_transportation_per_user()
 
+        if cache:
+            print()
+            cache.print_stats()
+
     except Exception as e:
         print("ERROR: Failed to use database:", e)
     finally:
@@ -0,0 +1,80 @@
+import numpy as np
+
+# Trackpoints per bucket document. 1000 points pack into ~40 KB, far below the 16 MB document limit
+BUCKET_POINTS = 1000
+# The packed trackpoint columns of a bucket and their little-endian dtypes. date_time is stored as
+# seconds since the epoch, and decoded back to datetime64[s]
+BUCKET_FIELDS = {"lat": "<f8", "lon": "<f8", "altitude": "<f8", "date_days": "<f8", "date_time": "<i8"}
+# Rough BSON size of a bucket without its columns, used to size the insert batches
+BUCKET_OVERHEAD_BYTES = 400
+
+
+def encode_buckets(activity_id, user_id, trajectory, bucket_points=BUCKET_POINTS):
+    """
+    Splits a trajectory into bucket documents for the TrackPointBucket collection.
+
+    Each bucket holds up to bucket_points consecutive trackpoints as one packed binary
+    column per field (see BUCKET_FIELDS), instead of one subdocument per trackpoint
+    that repeats every key, together with its time range and bounding box so buckets
+    can be filtered without decoding them.
+
+    Args:
+        activity_id (ObjectId): The _id of the activity the trackpoints belong to.
+        user_id (int): The user of the activity.
+        trajectory (Trajectory): The activity's trackpoints, in time order.
+        bucket_points (int): Maximum number of trackpoints per bucket.
+
+    Returns:
+        buckets (list): Bucket documents, numbered from 0 in seq.
+    """
+    columns = {
+        "lat": np.asarray(trajectory.lat, dtype=BUCKET_FIELDS["lat"]),
+        "lon": np.asarray(trajectory.lon, dtype=BUCKET_FIELDS["lon"]),
+        "altitude": np.asarray(trajectory.altitude, dtype=BUCKET_FIELDS["altitude"]),
+        "date_days": np.asarray(trajectory.date_days, dtype=BUCKET_FIELDS["date_days"]),
+        "date_time": np.array(trajectory.date_time, dtype="datetime64[s]").astype(BUCKET_FIELDS["date_time"]),
+    }
+    buckets = []
+    for seq, start in enumerate(range(0, len(trajectory), bucket_points)):
+        stop = min(start + bucket_points, len(trajectory))
+        lat = columns["lat"][start:stop]
+        lon = columns["lon"][start:stop]
+        bucket = {
+            "activity_id": activity_id,
+            "user_id": user_id,
+            "seq": seq,
+            "count": stop - start,
+            "start_time": trajectory.date_time[start],
+            "end_time": trajectory.date_time[stop - 1],
+            "bbox": {"min_lat": float(lat.min()), "min_lon": float(lon.min()),
+                     "max_lat": float(lat.max()), "max_lon": float(lon.max())},
+        }
+        bucket.update({field: column[start:stop].tobytes() for field, column in columns.items()})
+        buckets.append(bucket)
+    return buckets
+
+
+def bucket_size(bucket):
+    """
+    Returns:
+        size (int): Estimated BSON size of a bucket document in bytes.
+    """
+    return BUCKET_OVERHEAD_BYTES + sum(len(bucket[field]) for field in BUCKET_FIELDS)
+
+
+def decode_bucket(bucket, fields=None):
+    """
+    Unpacks the columns of a bucket document.
+
+    Args:
+        bucket (dict): A bucket from encode_buckets, as read back from the database.
+        fields (iterable): The fields to decode, defaults to all of BUCKET_FIELDS.
+
+    Returns:
+        columns (dict): A NumPy array per field, date_time as datetime64[s].
+    """
+    columns = {}
+    for field in fields or BUCKET_FIELDS:
+        column = np.frombuffer(bucket[field], dtype=BUCKET_FIELDS[field])
+        columns[field] = column.astype("datetime64[s]") if field == "date_time" else column
+    return columns
@@ -0,0 +1,7 @@
+"""
+The parsing, geometry and indexing modules both assignments share.
+
+The assignment scripts put the repository root on sys.path, so they import these as
+geolife.<module> whichever folder they are run from. The modules with a command line
+are run from the repository root, e.g. python -m geolife.parse_cache CACHE_DIR.
+"""
@@ -0,0 +1,64 @@
+import os
+import sys
+import timeit
+from datetime import datetime
+from .plt_reader import HEADER_LINES, parse_timestamp
+
+
+def read_date_time_columns(plt_file_path):
+    """
+    Returns the raw date and time fields of every trackpoint in a .plt file.
+    """
+    with open(plt_file_path, 'r') as f:
+        lines = f.read().splitlines()[HEADER_LINES:]
+    fields = [line.split(',') for line in lines]
+    return [parts[5] for parts in fields], [parts[6] for parts in fields]
+
+
+def benchmark_timestamps(plt_file_path, repeat=5):
+    """
+    Times datetime.strptime against parse_timestamp on the timestamps of one .plt file.
+
+    Args:
+        plt_file_path (str): The .plt file to take the timestamps from.
+        repeat (int): Number of timing runs, the fastest one is reported.
+    """
+    dates, times = read_date_time_columns(plt_file_path)
+
+    def with_strptime():
+        return [datetime.strptime(f"{d} {t}", "%Y-%m-%d %H:%M:%S") for d, t in zip(dates, times)]
+
+    def with_parse_timestamp():
+        return [parse_timestamp(d, t) for d, t in zip(dates, times)]
+
+    # Both decoders must agree before the timings mean anything
+    assert with_strptime() == with_parse_timestamp()
+
+    strptime_time = min(timeit.repeat(with_strptime, number=1, repeat=repeat))
+    fast_time = min(timeit.repeat(with_parse_timestamp, number=1, repeat=repeat))
+
+    print(f"File: {plt_file_path} ({len(dates)} trackpoints)")
+    print(f"datetime.strptime: {strptime_time * 1000:.2f} ms")
+    print(f"parse_timestamp:   {fast_time * 1000:.2f} ms")
+    print(f"Speedup:           {strptime_time / fast_time:.1f}x")
+
+
+def find_first_plt_file(dataset_dir):
+    for root, dirs, files in os.walk(os.path.join(dataset_dir, "Data")):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.plt'):
+                return os.path.join(root, file)
+    return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        plt_file_path = sys.argv[1]
+    else:
+        current_dir = os.path.dirname(os.path.realpath(__file__))
+        plt_file_path = find_first_plt_file(os.path.normpath(os.path.join(current_dir, '../../dataset')))
+    if plt_file_path is None:
+        print("No .plt file found, pass one as an argument.")
+    else:
+        benchmark_timestamps(plt_file_path)
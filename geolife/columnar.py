@@ -0,0 +1,80 @@
+import numpy as np
+
+# Rows fetched from the database per round trip when streaming into columns
+CHUNK_ROWS = 50000
+
+
+class ColumnBuffer:
+    """
+    Typed NumPy columns that rows are streamed into.
+
+    The arrays are preallocated and doubled when full, so a query result never
+    exists as a list of Python tuples or dicts, only as one chunk of it at a time.
+    """
+
+    def __init__(self, dtypes, capacity=CHUNK_ROWS):
+        """
+        Args:
+            dtypes (dict): NumPy dtype per column name, in row order, e.g.
+                {"activity_id": np.int64, "date_time": "datetime64[s]"}.
+            capacity (int): Number of rows to allocate up front.
+        """
+        self.names = list(dtypes)
+        self.arrays = {name: np.empty(max(capacity, 1), dtype=dtype) for name, dtype in dtypes.items()}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, count):
+        """
+        Makes room for count more rows.
+        """
+        needed = self.size + count
+        capacity = len(self.arrays[self.names[0]])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, array in self.arrays.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[name] = grown
+
+    def append_rows(self, rows):
+        """
+        Appends a chunk of rows.
+
+        Args:
+            rows (list): Tuples with one value per column, in the order of dtypes.
+        """
+        if not rows:
+            return
+        self.reserve(len(rows))
+        stop = self.size + len(rows)
+        for name, values in zip(self.names, zip(*rows)):
+            self.arrays[name][self.size:stop] = values
+        self.size = stop
+
+    def append_columns(self, columns):
+        """
+        Appends a chunk given column by column.
+
+        Args:
+            columns (dict): A sequence of values per column name, all of the same length.
+        """
+        count = len(columns[self.names[0]])
+        if not count:
+            return
+        self.reserve(count)
+        stop = self.size + count
+        for name in self.names:
+            self.arrays[name][self.size:stop] = columns[name]
+        self.size = stop
+
+    def columns(self):
+        """
+        Returns:
+            columns (dict): The filled part of each column, as views into the buffers.
+        """
+        return {name: array[:self.size] for name, array in self.arrays.items()}
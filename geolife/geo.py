@@ -0,0 +1,101 @@
+import numpy as np
+
+# Equatorial radius of the Earth, as used by the queries in part2
+EARTH_RADIUS_KM = 6378.137
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two sets of points, computed element-wise.
+
+    Source for haversine: https://stackoverflow.com/questions/29545704/fast-haversine-approximation-python-pandas/29546836#29546836
+
+    Args:
+        lat1, lon1 (array_like): Latitudes and longitudes of the first points, in degrees.
+        lat2, lon2 (array_like): Latitudes and longitudes of the second points, in degrees.
+
+    Returns:
+        distances (ndarray): The distances in kilometers.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def segment_distances(lat, lon, activity_ids=None):
+    """
+    Distances between consecutive trackpoints, in one vectorized pass.
+
+    Args:
+        lat, lon (array_like): Trackpoint coordinates in degrees, ordered by activity and time.
+        activity_ids (array_like): The activity of each trackpoint. Segments between two
+            activities are not travelled and get distance 0. None treats all points as one activity.
+
+    Returns:
+        distances (ndarray): len(lat) - 1 distances in kilometers.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    distances = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    if activity_ids is not None:
+        activity_ids = np.asarray(activity_ids)
+        distances[activity_ids[1:] != activity_ids[:-1]] = 0.0
+    return distances
+
+
+def trajectory_distance(lat, lon, activity_ids=None):
+    """
+    Total distance travelled along one or more trajectories, see segment_distances.
+
+    Returns:
+        distance (float): The distance in kilometers.
+    """
+    if len(lat) < 2:
+        return 0.0
+    return float(segment_distances(lat, lon, activity_ids).sum())
+
+
+def activity_distances(lat, lon, activity_ids):
+    """
+    Distance travelled in each activity.
+
+    Args:
+        lat, lon (array_like): Trackpoint coordinates in degrees.
+        activity_ids (array_like): The activity of each trackpoint, with each activity's
+            trackpoints contiguous and in time order.
+
+    Returns:
+        (ids, distances): The activity IDs in the order they appear, and their distances in kilometers.
+    """
+    activity_ids = np.asarray(activity_ids)
+    if len(activity_ids) == 0:
+        return activity_ids, np.zeros(0)
+    starts = np.flatnonzero(np.r_[True, activity_ids[1:] != activity_ids[:-1]])
+    # per_point[i] is the distance from point i - 1 to point i, 0 at the first point of an activity
+    per_point = np.r_[0.0, segment_distances(lat, lon, activity_ids)]
+    return activity_ids[starts], np.add.reduceat(per_point, starts)
+
+
+def region_ring(bbox=None, polygon=None):
+    """
+    Returns the outline of a region as a closed ring of (lon, lat) pairs,
+    the axis order of both WKT and GeoJSON.
+
+    Args:
+        bbox (tuple): (min_lat, min_lon, max_lat, max_lon), bounds included.
+        polygon (list): (lat, lon) vertices, in either direction. The ring is closed if it is not already.
+
+    Returns:
+        ring (list): (lon, lat) pairs whose first and last pair are equal.
+    """
+    if (bbox is None) == (polygon is None):
+        raise ValueError("Pass exactly one of bbox and polygon")
+    if bbox is not None:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        polygon = [(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon)]
+    if len(polygon) < 3:
+        raise ValueError("A polygon needs at least 3 vertices")
+    ring = [(lon, lat) for lat, lon in polygon]
+    if ring[0] != ring[-1]:
+        ring.append(ring[0])
+    return ring
@@ -0,0 +1,387 @@
+import numpy as np
+from .columnar import ColumnBuffer
+from .geo import EARTH_RADIUS_KM, haversine_km, region_ring
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Geohash precision 7 gives cells of about 153 x 153 m at the equator and 117 x 153 m in
+# Beijing, large enough that points within 50 m are always in the same or a neighbouring cell.
+DEFAULT_PRECISION = 7
+DEFAULT_TIME_BUCKET_SECONDS = 60
+
+
+def geohash_bits(precision):
+    """
+    Returns the number of (lat, lon) bits of a geohash with the given number of characters.
+    """
+    total = 5 * precision
+    return total // 2, (total + 1) // 2
+
+
+def quantize(lat, lon, precision):
+    """
+    Returns the row and column of the geohash cells containing the points.
+    """
+    lat_bits, lon_bits = geohash_bits(precision)
+    lat_q = np.floor((np.asarray(lat, dtype=np.float64) + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64)
+    lon_q = np.floor((np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * (1 << lon_bits)).astype(np.int64)
+    return np.clip(lat_q, 0, (1 << lat_bits) - 1), np.clip(lon_q, 0, (1 << lon_bits) - 1)
+
+
+def interleave(lat_q, lon_q, precision):
+    """
+    Interleaves cell rows and columns into geohash integers, starting with a longitude bit.
+    """
+    lat_bits, lon_bits = geohash_bits(precision)
+    total = lat_bits + lon_bits
+    lat_q = np.asarray(lat_q, dtype=np.uint64)
+    lon_q = np.asarray(lon_q, dtype=np.uint64)
+    cells = np.zeros(lat_q.shape, dtype=np.uint64)
+    for j in range(lon_bits):
+        cells |= ((lon_q >> np.uint64(lon_bits - 1 - j)) & np.uint64(1)) << np.uint64(total - 1 - 2 * j)
+    for j in range(lat_bits):
+        cells |= ((lat_q >> np.uint64(lat_bits - 1 - j)) & np.uint64(1)) << np.uint64(total - 2 - 2 * j)
+    return cells
+
+
+def deinterleave(cells, precision):
+    """
+    Splits geohash integers back into cell rows and columns, see interleave.
+    """
+    lat_bits, lon_bits = geohash_bits(precision)
+    total = lat_bits + lon_bits
+    cells = np.asarray(cells, dtype=np.uint64)
+    lat_q = np.zeros(cells.shape, dtype=np.uint64)
+    lon_q = np.zeros(cells.shape, dtype=np.uint64)
+    for j in range(lon_bits):
+        lon_q |= ((cells >> np.uint64(total - 1 - 2 * j)) & np.uint64(1)) << np.uint64(lon_bits - 1 - j)
+    for j in range(lat_bits):
+        lat_q |= ((cells >> np.uint64(total - 2 - 2 * j)) & np.uint64(1)) << np.uint64(lat_bits - 1 - j)
+    return lat_q.astype(np.int64), lon_q.astype(np.int64)
+
+
+def geohash_encode(lat, lon, precision=DEFAULT_PRECISION):
+    """
+    Encodes points as geohash integers, vectorized.
+
+    Args:
+        lat, lon (array_like): Coordinates in degrees.
+        precision (int): Number of geohash characters.
+
+    Returns:
+        cells (ndarray): uint64 geohashes, 5 bits per character.
+    """
+    return interleave(*quantize(lat, lon, precision), precision)
+
+
+def geohash_string(cell, precision=DEFAULT_PRECISION):
+    """
+    Returns the usual base32 spelling of a geohash integer.
+    """
+    cell = int(cell)
+    return "".join(GEOHASH_BASE32[(cell >> (5 * (precision - 1 - i))) & 31] for i in range(precision))
+
+
+def points_in_polygon(lat, lon, ring):
+    """
+    Tests which points lie inside a polygon, with vectorized ray casting.
+
+    Args:
+        lat, lon (ndarray): Coordinates in degrees.
+        ring (list): Closed (lon, lat) ring, as from region_ring.
+
+    Returns:
+        inside (ndarray): A boolean per point.
+    """
+    inside = np.zeros(len(lat), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+        crosses = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at_lat = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (lon < x_at_lat)
+    return inside
+
+
+class GridIndexBuilder:
+    """
+    Collects trackpoints during a load, to be turned into a GridIndex.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, time_bucket_seconds=DEFAULT_TIME_BUCKET_SECONDS):
+        self.precision = precision
+        self.time_bucket_seconds = time_bucket_seconds
+        self.points = ColumnBuffer({"user_id": np.int32, "time": np.int64, "lat": np.float32, "lon": np.float32})
+
+    def add(self, user_id, trajectory):
+        """
+        Adds the trackpoints of one trajectory.
+
+        Args:
+            user_id (int): The user the trajectory belongs to.
+            trajectory (Trajectory): The parsed trackpoints.
+        """
+        self.points.append_columns({
+            "user_id": np.full(len(trajectory), user_id),
+            "time": np.array(trajectory.date_time, dtype="datetime64[s]").astype(np.int64),
+            "lat": trajectory.lat,
+            "lon": trajectory.lon,
+        })
+
+    def track(self, user_id, activities):
+        """
+        Adds each trajectory of a stream of parsed activities and passes the activities on.
+
+        Args:
+            user_id (int): The user the activities belong to.
+            activities (iterable): (transportation_mode, trajectory) tuples.
+
+        Yields:
+            The same (transportation_mode, trajectory) tuples.
+        """
+        for transportation_mode, trajectory in activities:
+            self.add(user_id, trajectory)
+            yield transportation_mode, trajectory
+
+    def build(self):
+        """
+        Returns:
+            grid_index (GridIndex): The collected trackpoints, indexed.
+        """
+        columns = self.points.columns()
+        return GridIndex(geohash_encode(columns["lat"], columns["lon"], self.precision),
+                         columns["time"] // self.time_bucket_seconds, columns["user_id"], columns["time"],
+                         columns["lat"], columns["lon"], self.precision, self.time_bucket_seconds)
+
+
+class GridIndex:
+    """
+    Trackpoints bucketed by geohash cell and time bucket, for region and proximity queries
+    without the database.
+
+    The points are stored as parallel arrays sorted by (cell, time bucket), 36 bytes
+    per trackpoint, so a cell's points are one contiguous slice found with a binary search.
+    The index is saved to and loaded from a single .npz file.
+    """
+
+    def __init__(self, cells, buckets, user_ids, times, lat, lon, precision, time_bucket_seconds):
+        order = np.lexsort((buckets, cells))
+        self.cells = np.ascontiguousarray(cells[order], dtype=np.uint64)
+        self.buckets = np.ascontiguousarray(buckets[order], dtype=np.int64)
+        self.user_ids = np.ascontiguousarray(user_ids[order], dtype=np.int32)
+        self.times = np.ascontiguousarray(times[order], dtype=np.int64)
+        self.lat = np.ascontiguousarray(lat[order], dtype=np.float32)
+        self.lon = np.ascontiguousarray(lon[order], dtype=np.float32)
+        self.precision = precision
+        self.time_bucket_seconds = time_bucket_seconds
+
+    def __len__(self):
+        return len(self.cells)
+
+    def save(self, path):
+        """
+        Saves the index to an .npz file.
+        """
+        np.savez(path, cells=self.cells, buckets=self.buckets, user_ids=self.user_ids, times=self.times,
+                 lat=self.lat, lon=self.lon, precision=self.precision, time_bucket_seconds=self.time_bucket_seconds)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with save.
+        """
+        with np.load(path) as data:
+            index = cls.__new__(cls)
+            for name in ("cells", "buckets", "user_ids", "times", "lat", "lon"):
+                setattr(index, name, data[name])
+            index.precision = int(data["precision"])
+            index.time_bucket_seconds = int(data["time_bucket_seconds"])
+        return index
+
+    def points_in_cells(self, cells):
+        """
+        Returns the positions of the points in a set of cells.
+
+        Args:
+            cells (ndarray): uint64 geohashes.
+
+        Returns:
+            positions (ndarray): Indexes into the point arrays.
+        """
+        cells = np.unique(np.asarray(cells, dtype=np.uint64))
+        starts = np.searchsorted(self.cells, cells, side="left")
+        stops = np.searchsorted(self.cells, cells, side="right")
+        if not len(cells):
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+
+    def points_in_bbox(self, min_lat, min_lon, max_lat, max_lon, max_cells=100000):
+        """
+        Returns the positions of the points inside a bounding box, bounds included.
+
+        The box is covered with cells, whose points are then filtered exactly.
+        Boxes covering more than max_cells cells are answered with a scan instead.
+        """
+        lat_range, lon_range = quantize([min_lat, max_lat], [min_lon, max_lon], self.precision)
+        rows = np.arange(lat_range[0], lat_range[1] + 1)
+        columns = np.arange(lon_range[0], lon_range[1] + 1)
+        if len(rows) * len(columns) > max_cells:
+            positions = np.arange(len(self))
+        else:
+            lat_q, lon_q = np.meshgrid(rows, columns, indexing="ij")
+            positions = self.points_in_cells(interleave(lat_q.ravel(), lon_q.ravel(), self.precision))
+        lat = self.lat[positions]
+        lon = self.lon[positions]
+        inside = (lat >= np.float32(min_lat)) & (lat <= np.float32(max_lat)) & (lon >= np.float32(min_lon)) & (lon <= np.float32(max_lon))
+        return positions[inside]
+
+    def users_in_region(self, bbox=None, polygon=None):
+        """
+        Returns the users with a trackpoint inside a region, see geo.region_ring.
+
+        Returns:
+            user_ids (list): The user IDs, sorted.
+        """
+        ring = region_ring(bbox, polygon)
+        ring_lon = [lon for lon, _ in ring]
+        ring_lat = [lat for _, lat in ring]
+        positions = self.points_in_bbox(min(ring_lat), min(ring_lon), max(ring_lat), max(ring_lon))
+        if polygon is not None:
+            positions = positions[points_in_polygon(self.lat[positions].astype(np.float64),
+                                                    self.lon[positions].astype(np.float64), ring)]
+        return np.unique(self.user_ids[positions]).tolist()
+
+    def users_near(self, lat, lon, radius_m, start_time=None, end_time=None):
+        """
+        Returns the users that passed within radius_m of a point, optionally in a time window.
+
+        Args:
+            lat, lon (float): The point, in degrees.
+            radius_m (float): The distance in meters.
+            start_time, end_time (datetime): Only trackpoints with start_time <= time <= end_time.
+
+        Returns:
+            user_ids (list): The user IDs, sorted.
+        """
+        # Degrees spanned by the radius, widened for the longitude at this latitude
+        dlat = np.degrees(radius_m / 1000.0 / 6378.137)
+        dlon = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        positions = self.points_in_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        if start_time is not None:
+            positions = positions[self.times[positions] >= np.datetime64(start_time, "s").astype(np.int64)]
+        if end_time is not None:
+            positions = positions[self.times[positions] <= np.datetime64(end_time, "s").astype(np.int64)]
+        distances = haversine_km(lat, lon, self.lat[positions], self.lon[positions]) * 1000.0
+        return np.unique(self.user_ids[positions[distances <= radius_m]]).tolist()
+
+    def cell_height_m(self):
+        """
+        Returns:
+            height (float): The north-south size of a cell in meters, the same at every latitude.
+        """
+        lat_bits, _ = geohash_bits(self.precision)
+        return np.radians(180.0 / (1 << lat_bits)) * EARTH_RADIUS_KM * 1000.0
+
+    def cell_width_m(self):
+        """
+        Returns:
+            width (float): The east-west size of the narrowest cell holding points, in meters. Cells
+                narrow with the cosine of the latitude, so this is the width at the poleward edge of
+                the cell of the point farthest from the equator.
+        """
+        lat_bits, lon_bits = geohash_bits(self.precision)
+        max_lat = float(np.abs(self.lat).max()) + 180.0 / (1 << lat_bits) if len(self) else 0.0
+        return np.radians(360.0 / (1 << lon_bits)) * np.cos(np.radians(min(max_lat, 90.0))) * EARTH_RADIUS_KM * 1000.0
+
+    def colocated_users(self, radius_m=50, max_seconds=None):
+        """
+        Finds pairs of users that were within radius_m of each other at the same time.
+
+        Points of different users are compared only if they are in the same or
+        neighbouring cells and time buckets, so radius_m must not exceed the cell size
+        and max_seconds must not exceed the time bucket. The cells are narrower than they
+        are high away from the equator, about 117 x 153 m in Beijing at the default
+        precision, so radius_m is checked against both, see cell_width_m.
+
+        Args:
+            radius_m (float): The distance in meters.
+            max_seconds (int): The largest time difference that counts as the same time,
+                defaults to the time bucket length.
+
+        Returns:
+            pairs (list): (user_a, user_b, first_time) tuples with user_a < user_b, where
+                first_time is when they first met, as numpy.datetime64.
+        """
+        if max_seconds is None:
+            max_seconds = self.time_bucket_seconds
+        if max_seconds > self.time_bucket_seconds:
+            raise ValueError("max_seconds can not be longer than the time bucket")
+        if radius_m > self.cell_height_m():
+            raise ValueError(f"radius_m can not be larger than the cell height of {self.cell_height_m():.0f} m, "
+                             f"build the index with a lower precision")
+        if radius_m > self.cell_width_m():
+            raise ValueError(f"radius_m can not be larger than the narrowest cell width of {self.cell_width_m():.0f} m, "
+                             f"build the index with a lower precision")
+
+        if not len(self):
+            return []
+
+        # Groups of points sharing a cell and time bucket
+        keys = np.stack([self.cells.astype(np.int64), self.buckets])
+        group_starts = np.flatnonzero(np.r_[True, (keys[:, 1:] != keys[:, :-1]).any(axis=0)])
+        group_stops = np.r_[group_starts[1:], len(self)]
+        group_cells = self.cells[group_starts]
+        group_buckets = self.buckets[group_starts]
+        group_user_min = np.minimum.reduceat(self.user_ids, group_starts)
+        group_user_max = np.maximum.reduceat(self.user_ids, group_starts)
+        lat_q, lon_q = deinterleave(group_cells, self.precision)
+        group_keys = np.rec.fromarrays([group_cells, group_buckets])
+
+        first_met = {}
+        for d_lat in (-1, 0, 1):
+            for d_lon in (-1, 0, 1):
+                for d_bucket in (-1, 0, 1):
+                    # Visit each pair of neighbouring groups once
+                    if (d_lat, d_lon, d_bucket) < (0, 0, 0):
+                        continue
+                    neighbour_cells = interleave(lat_q + d_lat, lon_q + d_lon, self.precision)
+                    neighbour_keys = np.rec.fromarrays([neighbour_cells, group_buckets + d_bucket])
+                    found = np.minimum(np.searchsorted(group_keys, neighbour_keys), len(group_keys) - 1)
+                    groups = np.flatnonzero(group_keys[found] == neighbour_keys)
+                    neighbours = found[groups]
+                    # Only pairs of groups holding more than one user between them can produce pairs
+                    single_user = ((group_user_min[groups] == group_user_max[groups])
+                                   & (group_user_min[neighbours] == group_user_max[neighbours])
+                                   & (group_user_min[groups] == group_user_min[neighbours]))
+                    for group, neighbour in zip(groups[~single_user], neighbours[~single_user]):
+                        self._compare_groups(group_starts[group], group_stops[group], group_starts[neighbour],
+                                             group_stops[neighbour], radius_m, max_seconds, first_met)
+
+        return sorted((user_a, user_b, np.datetime64(int(time), "s")) for (user_a, user_b), time in first_met.items())
+
+    def _compare_groups(self, start_a, stop_a, start_b, stop_b, radius_m, max_seconds, first_met):
+        """
+        Compares the points of two groups pairwise and records the users that met.
+        """
+        users_a = self.user_ids[start_a:stop_a]
+        users_b = self.user_ids[start_b:stop_b]
+        different = users_a[:, None] != users_b[None, :]
+        close_in_time = np.abs(self.times[start_a:stop_a, None] - self.times[None, start_b:stop_b]) <= max_seconds
+        candidates = different & close_in_time
+        if not candidates.any():
+            return
+        a, b = np.nonzero(candidates)
+        distances = haversine_km(self.lat[start_a + a], self.lon[start_a + a], self.lat[start_b + b], self.lon[start_b + b]) * 1000.0
+        a = a[distances <= radius_m]
+        b = b[distances <= radius_m]
+        if not len(a):
+            return
+        user_low = np.minimum(users_a[a], users_b[b])
+        user_high = np.maximum(users_a[a], users_b[b])
+        times = np.minimum(self.times[start_a + a], self.times[start_b + b])
+        # Earliest meeting per pair of users
+        order = np.lexsort((times, user_high, user_low))
+        user_low, user_high, times = user_low[order], user_high[order], times[order]
+        first = np.r_[True, (user_low[1:] != user_low[:-1]) | (user_high[1:] != user_high[:-1])]
+        for pair, time in zip(zip(user_low[first].tolist(), user_high[first].tolist()), times[first].tolist()):
+            if pair not in first_met or time < first_met[pair]:
+                first_met[pair] = time
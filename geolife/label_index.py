@@ -0,0 +1,129 @@
+import bisect
+
+# Ways an activity can be matched to a label, see LabelIndex.match.
+# "segment" splits activities at label boundaries instead, see LabelIndex.segments.
+LABEL_MATCHES = ("exact", "contains", "overlap", "segment")
+
+
+class LabelIndex:
+    """
+    A user's labels, indexed for exact and interval lookups.
+
+    Exact matches are a dict lookup. For interval lookups the labels are sorted by
+    start time, with a running maximum of the end times, so the labels overlapping
+    an interval are found with one bisect and a scan over the candidates only.
+    """
+
+    def __init__(self, labels):
+        """
+        Args:
+            labels (dict): Transportation modes keyed by (start_time, end_time), as from read_label_file.
+        """
+        self.exact = labels
+        intervals = sorted((start, end, mode) for (start, end), mode in labels.items())
+        self.starts = [start for start, _, _ in intervals]
+        self.ends = [end for _, end, _ in intervals]
+        self.modes = [mode for _, _, mode in intervals]
+        # max_ends[i] is the latest end time among the first i + 1 labels
+        self.max_ends = []
+        latest = None
+        for end in self.ends:
+            latest = end if latest is None or end > latest else latest
+            self.max_ends.append(latest)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start_time, end_time):
+        """
+        Returns the labels that overlap an interval.
+
+        Args:
+            start_time (datetime): Start of the interval.
+            end_time (datetime): End of the interval.
+
+        Returns:
+            labels (list): (label_start, label_end, transportation_mode) tuples, sorted by start time.
+        """
+        result = []
+        # Only labels starting at or before end_time can overlap
+        i = bisect.bisect_right(self.starts, end_time) - 1
+        while i >= 0 and self.max_ends[i] >= start_time:
+            if self.ends[i] >= start_time:
+                result.append((self.starts[i], self.ends[i], self.modes[i]))
+            i -= 1
+        result.reverse()
+        return result
+
+    def match(self, start_time, end_time, how="exact"):
+        """
+        Finds the transportation mode for an activity.
+
+        Args:
+            start_time (datetime): Start of the activity.
+            end_time (datetime): End of the activity.
+            how (str): "exact" needs a label with the same start and end time,
+                "contains" a label that covers the whole activity, and "overlap"
+                takes the label that overlaps the activity the longest.
+                An exact match always wins.
+
+        Returns:
+            transportation_mode (str): The matched mode, or None.
+        """
+        transportation_mode = self.exact.get((start_time, end_time))
+        if transportation_mode is not None or how == "exact":
+            return transportation_mode
+
+        best_mode = None
+        best_overlap = None
+        for label_start, label_end, mode in self.overlapping(start_time, end_time):
+            if how == "contains":
+                if label_start <= start_time and label_end >= end_time:
+                    return mode
+                continue
+            overlap = min(label_end, end_time) - max(label_start, start_time)
+            if best_overlap is None or overlap > best_overlap:
+                best_mode, best_overlap = mode, overlap
+        return best_mode
+
+    def segments(self, times):
+        """
+        Splits a trajectory into runs of trackpoints that fall inside the same label.
+
+        Points and labels are merged with two pointers, so this is linear in the
+        number of points plus the number of labels the trajectory spans.
+        Points outside every label form runs without a transportation mode.
+
+        Args:
+            times (list): The trackpoint timestamps, in ascending order.
+
+        Yields:
+            (transportation_mode, start, stop) tuples, where times[start:stop] is the run.
+        """
+        n = len(times)
+        i = 0
+        # Labels before j all end before the first point
+        j = bisect.bisect_left(self.max_ends, times[0]) if n else 0
+        while i < n:
+            t = times[i]
+            while j < len(self.starts) and self.ends[j] < t:
+                j += 1
+
+            stop = i + 1
+            if j < len(self.starts) and self.starts[j] <= t:
+                # Inside label j until its end time
+                end = self.ends[j]
+                while stop < n and times[stop] <= end:
+                    stop += 1
+                yield self.modes[j], i, stop
+                j += 1
+            else:
+                # Unlabeled until a point falls inside a label, skipping labels that hold no points
+                while stop < n:
+                    while j < len(self.starts) and self.ends[j] < times[stop]:
+                        j += 1
+                    if j < len(self.starts) and self.starts[j] <= times[stop]:
+                        break
+                    stop += 1
+                yield None, i, stop
+            i = stop
@@ -0,0 +1,93 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tabulate import tabulate
+from .plt_reader import MAX_TRACKPOINTS, parse_user_folder
+
+
+def _timed_parse_user_folder(user_folder_path, has_labels, label_match, max_points):
+    """
+    Runs parse_user_folder in a worker process and reports how long it took.
+    """
+    start = time.perf_counter()
+    activities = parse_user_folder(user_folder_path, has_labels, label_match, max_points)
+    return activities, time.perf_counter() - start
+
+
+class IngestStats:
+    """
+    Row counts and time spent per stage of a parallel load.
+    """
+
+    def __init__(self, workers, writers=1):
+        self.workers = workers
+        self.writers = writers
+        self.started = time.perf_counter()
+        self.users = 0
+        self.activities = 0
+        self.trackpoints = 0
+        self.parse_seconds = 0.0  # Summed over all workers
+        self.write_seconds = 0.0  # Summed over all writers
+
+    def add_parsed_user(self, activities, parse_seconds):
+        self.users += 1
+        self.activities += len(activities)
+        self.trackpoints += sum(len(trajectory) for _, trajectory in activities)
+        self.parse_seconds += parse_seconds
+
+    def print_summary(self):
+        wall_seconds = time.perf_counter() - self.started
+
+        def rate(seconds):
+            return round(self.trackpoints / seconds) if seconds else 0
+
+        rows = [
+            ["parse (per worker)", self.trackpoints, round(self.parse_seconds, 2), rate(self.parse_seconds)],
+            [f"parse ({self.workers} workers)", self.trackpoints, round(self.parse_seconds / self.workers, 2), rate(self.parse_seconds / self.workers)],
+            ["write (per writer)", self.trackpoints, round(self.write_seconds, 2), rate(self.write_seconds)],
+            [f"write ({self.writers} writers)", self.trackpoints, round(self.write_seconds / self.writers, 2), rate(self.write_seconds / self.writers)],
+            ["total (wall clock)", self.trackpoints, round(wall_seconds, 2), rate(wall_seconds)],
+        ]
+        print(f"\nLoaded {self.users} users, {self.activities} activities, {self.trackpoints} trackpoints")
+        print(tabulate(rows, headers=["Stage", "Trackpoints", "Seconds", "Trackpoints/s"]))
+
+
+def iter_parsed_users(user_folders, labeled_users, workers, stats, label_match="exact", max_points=MAX_TRACKPOINTS):
+    """
+    Parses user folders in a process pool and yields them in user ID order.
+
+    Results come back in the order the folders were given, so a single writer
+    assigns the same auto-increment IDs as a sequential load. At most
+    2 * workers users are parsed ahead of the writer to bound memory.
+
+    Args:
+        user_folders (list): (user_id, user_folder_path) tuples from list_user_folders.
+        labeled_users (set): IDs of the users that have labels.
+        workers (int): Number of parse processes.
+        stats (IngestStats): Collects parse counts and timings.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        max_points (int): Files with more trackpoints than this are skipped. None disables the cap.
+
+    Yields:
+        (user_id, has_labels, activities) tuples.
+    """
+    folders = iter(user_folders)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit_next():
+            for user_id, user_folder_path in folders:
+                has_labels = user_id in labeled_users
+                pending.append((user_id, has_labels, executor.submit(_timed_parse_user_folder, user_folder_path, has_labels, label_match, max_points)))
+                return
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while pending:
+            user_id, has_labels, future = pending.popleft()
+            activities, parse_seconds = future.result()
+            submit_next()
+            stats.add_parsed_user(activities, parse_seconds)
+            yield user_id, has_labels, activities
@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tabulate import tabulate
+from .label_index import LABEL_MATCHES, LabelIndex
+from .plt_reader import (MAX_TRACKPOINTS, Trajectory, iter_plt_files, label_trajectory, list_user_folders,
+                         read_label_file, read_plt)
+
+# Bumped whenever the layout of the cache files changes, which makes every cached user stale
+CACHE_VERSION = 1
+# The float trackpoint columns of a cache file, concatenated over all activities of the user
+FLOAT_COLUMNS = ("lat", "lon", "altitude", "date_days")
+
+
+def read_labeled_users(dataset_dir):
+    """
+    Returns:
+        labeled_users (set): IDs of the users listed in labeled_ids.txt.
+    """
+    with open(os.path.join(dataset_dir, "labeled_ids.txt")) as file:
+        return {int(line) for line in file if line.strip()}
+
+
+def user_cache_path(cache_dir, user_id):
+    return os.path.join(cache_dir, f"{user_id:03d}.npz")
+
+
+def source_signature(user_folder_path, has_labels, label_match):
+    """
+    Digests everything a user's cache file is derived from: the size and mtime of the user's
+    .plt files and labels.txt, the label matching, and the cache version.
+
+    Returns:
+        signature (str): SHA-1 hex digest, stored in the cache file to tell whether it is current.
+    """
+    digest = hashlib.sha1(f"{CACHE_VERSION}|{int(has_labels)}|{label_match}".encode())
+    paths = list(iter_plt_files(os.path.join(user_folder_path, 'Trajectory')))
+    if has_labels:
+        paths.append(os.path.join(user_folder_path, 'labels.txt'))
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"|{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def read_signature(path):
+    """
+    Returns:
+        signature (str): The signature stored in a cache file, or None if it is missing or unreadable.
+    """
+    try:
+        with np.load(path) as data:
+            return str(data["signature"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def parse_user_folder_uncapped(user_folder_path, has_labels, label_match="exact"):
+    """
+    Parses all activities of one user like parse_user_folder, but without the point cap.
+
+    Returns:
+        activities (list): (transportation_mode, trajectory, file_points) tuples, where file_points
+            is the number of trackpoints in the .plt file the activity came from, which the cap applies to.
+    """
+    label_index = None
+    if has_labels:
+        label_index = LabelIndex(read_label_file(os.path.join(user_folder_path, 'labels.txt')))
+    activities = []
+    for plt_file_path in iter_plt_files(os.path.join(user_folder_path, 'Trajectory')):
+        trajectory = read_plt(plt_file_path, max_points=None)
+        if trajectory is not None:
+            activities.extend((transportation_mode, part, len(trajectory))
+                              for transportation_mode, part in label_trajectory(label_index, trajectory, label_match))
+    return activities
+
+
+def write_user_cache(path, activities, signature):
+    """
+    Writes a user's parsed activities to an uncompressed .npz file, one array per column.
+
+    The trackpoints of all activities are concatenated, and offsets holds where each
+    activity starts, with a final entry for the end of the last one. Activities without a
+    transportation mode are stored with an empty mode.
+
+    Args:
+        path (str): The cache file. It is written under a temporary name and renamed.
+        activities (list): (transportation_mode, trajectory, file_points) tuples from parse_user_folder_uncapped.
+        signature (str): The source_signature of the user folder.
+    """
+    lengths = [len(trajectory) for _, trajectory, _ in activities]
+    columns = {
+        field: np.array([value for _, trajectory, _ in activities for value in getattr(trajectory, field)], dtype=np.float64)
+        for field in FLOAT_COLUMNS
+    }
+    columns["date_time"] = np.array([value for _, trajectory, _ in activities for value in trajectory.date_time],
+                                    dtype="datetime64[s]")
+    with open(path + ".tmp", "wb") as file:
+        np.savez(file, **columns,
+                 offsets=np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+                 modes=np.array([transportation_mode or "" for transportation_mode, _, _ in activities], dtype=str),
+                 file_points=np.array([file_points for _, _, file_points in activities], dtype=np.int64),
+                 signature=np.array(signature))
+    os.replace(path + ".tmp", path)
+
+
+def read_user_cache(path, max_points=MAX_TRACKPOINTS):
+    """
+    Reads a user's activities back from a cache file.
+
+    Args:
+        path (str): The cache file.
+        max_points (int): Leave out the activities of .plt files with more trackpoints than this,
+            as the loaders do when parsing. None disables the cap.
+
+    Returns:
+        activities (list): (transportation_mode, trajectory) tuples, as from parse_user_folder.
+    """
+    with np.load(path) as data:
+        offsets = data["offsets"]
+        modes = data["modes"].tolist()
+        file_points = data["file_points"]
+        # Converted to lists once per user, so the trajectories hold Python floats and datetimes as parsed ones do
+        columns = {field: data[field].tolist() for field in FLOAT_COLUMNS}
+        date_time = data["date_time"].tolist()
+
+    activities = []
+    for index, transportation_mode in enumerate(modes):
+        if max_points is not None and file_points[index] > max_points:
+            continue
+        start, stop = int(offsets[index]), int(offsets[index + 1])
+        trajectory = Trajectory(*(columns[field][start:stop] for field in FLOAT_COLUMNS), date_time[start:stop])
+        activities.append((transportation_mode or None, trajectory))
+    return activities
+
+
+def cache_user_folder(user_id, user_folder_path, has_labels, cache_dir, label_match="exact"):
+    """
+    Parses one user folder into its cache file, unless the cache file is current.
+
+    Returns:
+        (rebuilt, seconds): Whether the file was written, and how long that took.
+    """
+    start = time.perf_counter()
+    path = user_cache_path(cache_dir, user_id)
+    signature = source_signature(user_folder_path, has_labels, label_match)
+    if read_signature(path) == signature:
+        return False, time.perf_counter() - start
+    write_user_cache(path, parse_user_folder_uncapped(user_folder_path, has_labels, label_match), signature)
+    return True, time.perf_counter() - start
+
+
+def build_parse_cache(dataset_dir, cache_dir, label_match="exact", workers=None):
+    """
+    Converts the Geolife Data/ tree into one .npz file per user, so later loads read
+    binary columns instead of parsing text. Only users whose .plt files, labels or
+    label matching changed since their cache file was written are parsed again.
+
+    The files are written without the point cap, and record the size of each activity's
+    .plt file, so the same cache serves loaders with and without the cap.
+
+    Args:
+        dataset_dir (str): The path to the Geolife dataset folder.
+        cache_dir (str): Directory of the cache files, created if missing.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        workers (int): Number of parse processes, or None to parse in this process.
+
+    Returns:
+        users (list): (user_id, has_labels) tuples, in user ID order.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    start = time.perf_counter()
+    labeled_users = read_labeled_users(dataset_dir)
+    user_folders = list_user_folders(dataset_dir)
+    tasks = [(user_id, user_folder_path, user_id in labeled_users, cache_dir, label_match)
+             for user_id, user_folder_path in user_folders]
+
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(cache_user_folder, *zip(*tasks))) if tasks else []
+    else:
+        results = [cache_user_folder(*task) for task in tasks]
+
+    rebuilt = sum(1 for was_rebuilt, _ in results if was_rebuilt)
+    size_mb = sum(os.path.getsize(user_cache_path(cache_dir, user_id)) for user_id, _ in user_folders) / 2**20
+    print(tabulate([[len(tasks), rebuilt, len(tasks) - rebuilt, round(size_mb, 1), f"{time.perf_counter() - start:.2f}"]],
+                   headers=["Users", "Parsed", "Current", "Cache (MB)", "Seconds"]))
+    return [(user_id, user_id in labeled_users) for user_id, _ in user_folders]
+
+
+def iter_cached_users(dataset_dir, cache_dir, label_match="exact", max_points=MAX_TRACKPOINTS, workers=None, stats=None):
+    """
+    Yields every user's activities from the parse cache, a drop-in replacement for iter_parsed_users.
+
+    The cache is brought up to date first, see build_parse_cache, so it is always safe to
+    read from, and costs a stat per file when nothing changed.
+
+    Args:
+        dataset_dir (str): The path to the Geolife dataset folder.
+        cache_dir (str): Directory of the cache files.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        max_points (int): Leave out the activities of .plt files with more trackpoints than this. None disables the cap.
+        workers (int): Number of parse processes for users whose cache file is stale.
+        stats (IngestStats): Collects counts and read timings, reported as the parse stage.
+
+    Yields:
+        (user_id, has_labels, activities) tuples.
+    """
+    for user_id, has_labels in build_parse_cache(dataset_dir, cache_dir, label_match, workers):
+        start = time.perf_counter()
+        activities = read_user_cache(user_cache_path(cache_dir, user_id), max_points)
+        if stats is not None:
+            stats.add_parsed_user(activities, time.perf_counter() - start)
+        yield user_id, has_labels, activities
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Convert the Geolife .plt files into a binary cache the loaders can read from.")
+    parser.add_argument("cache_dir", help="directory of the cache files, one .npz per user")
+    parser.add_argument("--dataset", default=os.path.normpath(os.path.join(current_dir, '../../dataset')),
+                        help="path to the Geolife dataset folder")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parse .plt files in this many processes (default: in this process)")
+    parser.add_argument("--label-match", choices=LABEL_MATCHES, default="exact",
+                        help="the label matching the loaders will use, see --label-match of the loaders")
+    args = parser.parse_args()
+    build_parse_cache(args.dataset, args.cache_dir, args.label_match, args.workers)
@@ -0,0 +1,385 @@
+import functools
+import hashlib
+import itertools
+import os
+from datetime import datetime
+import numpy as np
+from .geo import trajectory_distance
+from .label_index import LabelIndex
+
+# Every .plt file starts with 6 header lines before the first trackpoint
+HEADER_LINES = 6
+# Files with more trackpoints than this are skipped by the loaders
+MAX_TRACKPOINTS = 2500
+# Altitudes (in feet) below this are invalid, which includes the -777 placeholder
+MIN_VALID_ALTITUDE = -413
+FEET_TO_METERS = 0.3048
+# Activities with a gap of at least this many seconds between consecutive trackpoints are invalid
+INVALID_GAP_SECONDS = 300
+# The per-activity aggregates computed by Trajectory.summary, in ActivitySummary column order
+SUMMARY_FIELDS = ("trackpoint_count", "distance_km", "altitude_gain_m", "max_gap_seconds",
+                  "min_lat", "min_lon", "max_lat", "max_lon")
+# Coordinates are stored as integer multiples of 1/COORDINATE_SCALE degrees in the compact TrackPoint
+# schema, about 1 cm. Geolife gives at most 6 decimals, so the original values are recovered exactly
+COORDINATE_SCALE = 10**7
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date(date_str):
+    """
+    Splits a fixed-layout YYYY-MM-DD date into integers.
+
+    Cached because consecutive trackpoints almost always share a date.
+    """
+    return int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])
+
+
+def parse_timestamp(date_str, time_str):
+    """
+    Decodes the date and time fields of a trackpoint without datetime.strptime.
+
+    Args:
+        date_str (str): The date field, e.g. "2008-10-23".
+        time_str (str): The time field, e.g. "02:53:04".
+
+    Returns:
+        timestamp (datetime): The decoded date and time.
+    """
+    if len(date_str) != 10 or len(time_str) != 8:
+        # Not the fixed layout, fall back to the slow but forgiving parser
+        return datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S")
+    year, month, day = _parse_date(date_str)
+    return datetime(year, month, day, int(time_str[0:2]), int(time_str[3:5]), int(time_str[6:8]))
+
+
+class Trajectory:
+    """
+    Columnar trackpoint data parsed from a single .plt file.
+
+    Each attribute is a list with one entry per trackpoint, in file order.
+    """
+
+    def __init__(self, lat, lon, altitude, date_days, date_time):
+        self.lat = lat
+        self.lon = lon
+        self.altitude = altitude
+        self.date_days = date_days
+        self.date_time = date_time
+
+    def __len__(self):
+        return len(self.date_time)
+
+    @property
+    def start_time(self):
+        return self.date_time[0]
+
+    @property
+    def end_time(self):
+        return self.date_time[-1]
+
+    def slice(self, start, stop):
+        """
+        Returns the trackpoints start to stop (exclusive) as a new Trajectory.
+        """
+        return Trajectory(self.lat[start:stop], self.lon[start:stop], self.altitude[start:stop],
+                          self.date_days[start:stop], self.date_time[start:stop])
+
+    def rows(self, activity_id):
+        """
+        Returns the trackpoints as tuples matching the TrackPoint table columns.
+
+        Args:
+            activity_id (int): The activity the trackpoints belong to.
+
+        Returns:
+            iterator: (activity_id, lat, lon, altitude, date_days, date_time) tuples.
+        """
+        return zip(itertools.repeat(activity_id), self.lat, self.lon, self.altitude, self.date_days, self.date_time)
+
+    def compact_rows(self, activity_id):
+        """
+        Returns the trackpoints as tuples matching the columns the loaders write in the compact TrackPoint schema.
+
+        seq numbers the trackpoints in file order, and the coordinates are scaled to integers by COORDINATE_SCALE.
+
+        Args:
+            activity_id (int): The activity the trackpoints belong to.
+
+        Returns:
+            iterator: (activity_id, seq, lat_e7, lon_e7, altitude, date_time) tuples.
+        """
+        return zip(itertools.repeat(activity_id), itertools.count(),
+                   (round(lat * COORDINATE_SCALE) for lat in self.lat),
+                   (round(lon * COORDINATE_SCALE) for lon in self.lon),
+                   self.altitude, self.date_time)
+
+    def summary(self):
+        """
+        Computes the per-activity aggregates the queries would otherwise recompute from the trackpoints.
+
+        Returns:
+            summary (dict): The SUMMARY_FIELDS. altitude_gain_m sums the climbs between consecutive
+                trackpoints that both have a valid altitude, and max_gap_seconds is the longest
+                time between consecutive trackpoints.
+        """
+        lat = np.asarray(self.lat, dtype=np.float64)
+        lon = np.asarray(self.lon, dtype=np.float64)
+        altitude = np.asarray(self.altitude, dtype=np.float64)
+        seconds = np.array(self.date_time, dtype="datetime64[s]").astype(np.int64)
+
+        climbs = np.diff(altitude)
+        valid = (altitude[1:] >= MIN_VALID_ALTITUDE) & (altitude[:-1] >= MIN_VALID_ALTITUDE) & (climbs > 0)
+        return {
+            "trackpoint_count": len(self),
+            "distance_km": trajectory_distance(lat, lon),
+            "altitude_gain_m": float(climbs[valid].sum()) * FEET_TO_METERS,
+            "max_gap_seconds": int(np.diff(seconds).max()) if len(self) > 1 else 0,
+            "min_lat": float(lat.min()),
+            "min_lon": float(lon.min()),
+            "max_lat": float(lat.max()),
+            "max_lon": float(lon.max()),
+        }
+
+    def summary_row(self, activity_id):
+        """
+        Returns the summary as a tuple matching the ActivitySummary table columns.
+        """
+        summary = self.summary()
+        return (activity_id,) + tuple(summary[field] for field in SUMMARY_FIELDS)
+
+    def documents(self):
+        """
+        Returns the trackpoints as a list of dicts, as embedded in Activity documents.
+
+        location repeats the coordinates as a GeoJSON point, for the 2dsphere index.
+        """
+        return [
+            {"lat": lat, "lon": lon, "altitude": altitude, "date_days": date_days, "date_time": date_time,
+             "location": {"type": "Point", "coordinates": [lon, lat]}}
+            for lat, lon, altitude, date_days, date_time
+            in zip(self.lat, self.lon, self.altitude, self.date_days, self.date_time)
+        ]
+
+
+def activity_altitude_gains(altitude, activity_ids):
+    """
+    The altitude_gain_m of Trajectory.summary for many activities at once.
+
+    Args:
+        altitude (array_like): Trackpoint altitudes in feet.
+        activity_ids (array_like): The activity of each trackpoint, with each activity's
+            trackpoints contiguous and in time order.
+
+    Returns:
+        (ids, gains): The activity IDs in the order they appear, and their altitude gain in meters.
+    """
+    activity_ids = np.asarray(activity_ids)
+    if len(activity_ids) == 0:
+        return activity_ids, np.zeros(0)
+    altitude = np.asarray(altitude, dtype=np.float64)
+    starts = np.flatnonzero(np.r_[True, activity_ids[1:] != activity_ids[:-1]])
+    # climbs[i] is the climb from point i - 1 to point i, 0 at the first point of an activity
+    climbs = np.r_[0.0, np.diff(altitude)]
+    valid = np.r_[False, (altitude[1:] >= MIN_VALID_ALTITUDE) & (altitude[:-1] >= MIN_VALID_ALTITUDE)] & (climbs > 0)
+    valid[starts] = False
+    return activity_ids[starts], np.add.reduceat(np.where(valid, climbs, 0.0), starts) * FEET_TO_METERS
+
+
+def activity_max_gaps(date_time, activity_ids):
+    """
+    The max_gap_seconds of Trajectory.summary for many activities at once.
+
+    Args:
+        date_time (array_like): Trackpoint times, as datetime64 or seconds.
+        activity_ids (array_like): The activity of each trackpoint, with each activity's
+            trackpoints contiguous and in time order.
+
+    Returns:
+        (ids, gaps): The activity IDs in the order they appear, and the longest time between
+            consecutive trackpoints of each in seconds, 0 for an activity of one trackpoint.
+    """
+    activity_ids = np.asarray(activity_ids)
+    if len(activity_ids) == 0:
+        return activity_ids, np.zeros(0, dtype=np.int64)
+    seconds = np.asarray(date_time)
+    if seconds.dtype.kind == "M":
+        seconds = seconds.astype("datetime64[s]")
+    seconds = seconds.astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, activity_ids[1:] != activity_ids[:-1]])
+    # gaps[i] is the time from point i - 1 to point i. The first point of an activity has no gap,
+    # and gets the smallest value so it never wins the maximum
+    no_gap = np.iinfo(np.int64).min
+    gaps = np.r_[no_gap, np.diff(seconds)]
+    gaps[starts] = no_gap
+    max_gaps = np.maximum.reduceat(gaps, starts)
+    max_gaps[max_gaps == no_gap] = 0
+    return activity_ids[starts], max_gaps
+
+
+def read_plt(plt_file_path, max_points=MAX_TRACKPOINTS):
+    """
+    Reads a .plt file with a single read and parses it into columns.
+
+    Args:
+        plt_file_path (str): The path to the .plt file.
+        max_points (int): Files with more trackpoints than this are skipped. None disables the cap.
+
+    Returns:
+        trajectory (Trajectory): The parsed trackpoints, or None if the file is empty or too large.
+    """
+    with open(plt_file_path, 'r') as f:
+        return parse_plt(f.read(), max_points)
+
+
+def read_plt_with_hash(plt_file_path, max_points=MAX_TRACKPOINTS):
+    """
+    Like read_plt, but also hashes the file contents from the same read.
+
+    Returns:
+        (trajectory, content_hash): The parsed trackpoints or None, and the SHA-1 hex digest of the file.
+    """
+    with open(plt_file_path, 'rb') as f:
+        data = f.read()
+    return parse_plt(data.decode(), max_points), hashlib.sha1(data).hexdigest()
+
+
+def parse_plt(text, max_points=MAX_TRACKPOINTS):
+    """
+    Parses the contents of a .plt file into columns.
+
+    The point cap is checked on the split lines before any field is parsed,
+    so oversized files cost one read and nothing more.
+
+    Args:
+        text (str): The contents of the .plt file.
+        max_points (int): Files with more trackpoints than this are skipped. None disables the cap.
+
+    Returns:
+        trajectory (Trajectory): The parsed trackpoints, or None if the file is empty or too large.
+    """
+    lines = text.splitlines()[HEADER_LINES:]
+
+    if not lines or (max_points is not None and len(lines) > max_points):
+        return None
+
+    lat, lon, altitude, date_days, date_time = [], [], [], [], []
+    for line in lines:
+        parts = line.split(',')
+        lat.append(float(parts[0]))
+        lon.append(float(parts[1]))
+        altitude.append(float(parts[3]))
+        date_days.append(float(parts[4]))
+        date_time.append(parse_timestamp(parts[5], parts[6]))
+
+    return Trajectory(lat, lon, altitude, date_days, date_time)
+
+
+def iter_plt_files(trajectory_folder_path):
+    """
+    Yields the paths of the .plt files in a Trajectory folder, sorted by file name.
+    """
+    for plt_file in sorted(os.listdir(trajectory_folder_path)):
+        if plt_file.endswith('.plt'):
+            yield os.path.join(trajectory_folder_path, plt_file)
+
+
+def list_user_folders(dataset_dir):
+    """
+    Lists the user folders of the Geolife Data/ tree in user ID order.
+
+    Args:
+        dataset_dir (str): The path to the Geolife dataset folder.
+
+    Returns:
+        user_folders (list): (user_id, user_folder_path) tuples.
+    """
+    data_dir = os.path.join(dataset_dir, "Data")
+    return [
+        (int(user_folder), os.path.join(data_dir, user_folder))
+        for user_folder in sorted(os.listdir(data_dir))
+        if os.path.isdir(os.path.join(data_dir, user_folder))
+    ]
+
+
+#--------------------------LABELS-----------------------------
+def read_label_file(labels_file_path):
+    """
+    Reads a user's labels.txt file.
+
+    Args:
+        labels_file_path (str): The path to the labels.txt file.
+
+    Returns:
+        labels (dict): Transportation modes keyed by (start_time, end_time).
+    """
+    labels = {}
+    with open(labels_file_path, 'r') as file:
+        next(file)  # Skip header line
+        for line in file:
+            start_time_str, end_time_str, transportation_mode = line.strip().split('\t')
+            start_time = datetime.strptime(start_time_str, "%Y/%m/%d %H:%M:%S")
+            end_time = datetime.strptime(end_time_str, "%Y/%m/%d %H:%M:%S")
+            labels[(start_time, end_time)] = transportation_mode
+    return labels
+
+
+#--------------------------USER ACTIVITIES-----------------------------
+def iter_user_activities(labels, trajectory_folder_path, max_points=MAX_TRACKPOINTS, label_match="exact"):
+    """
+    Parses every .plt file of a user and matches it against the user's labels.
+
+    With label_match="segment" a file is split at label boundaries and every
+    segment becomes its own activity, with the mode of its label or None.
+
+    Args:
+        labels (dict): The user's labels from read_label_file, or None if the user has no labels.
+        trajectory_folder_path (str): The path to the user's Trajectory folder.
+        max_points (int): Files with more trackpoints than this are skipped.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+
+    Yields:
+        (transportation_mode, trajectory) tuples, one per activity.
+    """
+    label_index = LabelIndex(labels) if labels else None
+    for plt_file_path in iter_plt_files(trajectory_folder_path):
+        trajectory = read_plt(plt_file_path, max_points)
+        if trajectory is not None:
+            yield from label_trajectory(label_index, trajectory, label_match)
+
+
+def label_trajectory(label_index, trajectory, label_match="exact"):
+    """
+    Matches one parsed .plt file against a user's labels.
+
+    Args:
+        label_index (LabelIndex): The user's labels, or None if the user has no labels.
+        trajectory (Trajectory): The parsed .plt file.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+
+    Yields:
+        (transportation_mode, trajectory) tuples, one per activity.
+    """
+    if label_index is None:
+        yield None, trajectory
+    elif label_match == "segment":
+        for transportation_mode, start, stop in label_index.segments(trajectory.date_time):
+            yield transportation_mode, trajectory.slice(start, stop)
+    else:
+        yield label_index.match(trajectory.start_time, trajectory.end_time, label_match), trajectory
+
+
+def parse_user_folder(user_folder_path, has_labels, label_match="exact", max_points=MAX_TRACKPOINTS):
+    """
+    Parses all activities of one user. This is the unit of work of the parallel loaders.
+
+    Args:
+        user_folder_path (str): The path to the user's folder in Data/.
+        has_labels (bool): Whether the user has a labels.txt file.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        max_points (int): Files with more trackpoints than this are skipped. None disables the cap.
+
+    Returns:
+        activities (list): (transportation_mode, trajectory) tuples.
+    """
+    labels = read_label_file(os.path.join(user_folder_path, 'labels.txt')) if has_labels else None
+    return list(iter_user_activities(labels, os.path.join(user_folder_path, 'Trajectory'), max_points, label_match))
@@ -0,0 +1,146 @@
+import contextlib
+import functools
+import hashlib
+import io
+import os
+import pickle
+import sys
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Caches the results of query methods, keyed by method name, arguments, scope and dataset generation.
+
+    The loaders bump the dataset generation whenever they write, so a result is reused
+    only while the data it was computed from is unchanged. The generation should identify
+    the load, not only count loads, since a counter starts over in a new database. The
+    scope holds whatever else changes how the methods read the data, such as the schema. Along with the return value
+    the cache keeps what the method printed, and prints it again on a hit.
+
+    Results are held in an in-memory LRU and, if a directory is given, also pickled
+    to disk, one file per result, so later runs start warm.
+    """
+
+    def __init__(self, capacity=128, path=None):
+        """
+        Args:
+            capacity (int): Number of results kept in memory.
+            path (str): Directory for the on-disk store. None keeps results in memory only.
+        """
+        self.capacity = capacity
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(name, args, kwargs, generation, scope=()):
+        """
+        Returns:
+            key (str): A digest of the call and its scope, prefixed with the generation, used both
+                in memory and as the file name.
+        """
+        call = repr((scope, name, args, sorted(kwargs.items())))
+        return f"{generation}-{hashlib.sha1(call.encode()).hexdigest()}"
+
+    def get(self, key):
+        """
+        Returns:
+            entry (tuple): (result, output) of a cached call, or None on a miss.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.path:
+            try:
+                with open(os.path.join(self.path, f"{key}.pkl"), "rb") as file:
+                    entry = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return None
+            self.remember(key, entry)
+            return entry
+        return None
+
+    def put(self, key, entry):
+        """
+        Stores the (result, output) of a call in memory and, if enabled, on disk.
+        """
+        self.remember(key, entry)
+        if self.path:
+            # Written under a temporary name and renamed, so a reader never sees half a file
+            file_path = os.path.join(self.path, f"{key}.pkl")
+            with open(file_path + ".tmp", "wb") as file:
+                pickle.dump(entry, file)
+            os.replace(file_path + ".tmp", file_path)
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def prune(self, generation):
+        """
+        Deletes the on-disk results of other generations, which can no longer be hit.
+        """
+        if not self.path:
+            return
+        prefix = f"{generation}-"
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".pkl") and not file_name.startswith(prefix):
+                os.remove(os.path.join(self.path, file_name))
+
+    def call(self, name, method, generation, args, kwargs, scope=()):
+        """
+        Returns the result of method(*args, **kwargs), from the cache if the same call was made
+        in this generation and scope.
+
+        A generation of None means the data cannot be versioned, and the call is not cached.
+        """
+        if generation is None:
+            return method(*args, **kwargs)
+        key = self.make_key(name, args, kwargs, generation, scope)
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            result, output = entry
+            sys.stdout.write(output)
+            return result
+
+        self.misses += 1
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = method(*args, **kwargs)
+        sys.stdout.write(output.getvalue())
+        self.put(key, (result, output.getvalue()))
+        return result
+
+    def wrap(self, obj, method_names, generation, scope=()):
+        """
+        Replaces methods of an object with cached versions, on the instance only.
+
+        Args:
+            obj: The object whose methods to cache, e.g. a Part2.
+            method_names (list): Names of the methods to cache.
+            generation (callable): Returns the current dataset generation, called once per method call.
+            scope (tuple): Settings of obj that change its results for the same data, e.g. the schema it reads.
+        """
+        for name in method_names:
+            method = getattr(obj, name)
+
+            def cached(*args, _name=name, _method=method, **kwargs):
+                return self.call(_name, _method, generation(), args, kwargs, scope)
+
+            setattr(obj, name, functools.wraps(method)(cached))
+        return obj
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Query cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), {len(self)} results in memory")
@@ -0,0 +1,465 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from tabulate import tabulate
+from .geo import haversine_km, region_ring
+from .grid_index import points_in_polygon
+from .label_index import LABEL_MATCHES
+from .parallel_ingest import IngestStats, iter_parsed_users
+from .parse_cache import iter_cached_users, read_labeled_users
+from .plt_reader import (FEET_TO_METERS, INVALID_GAP_SECONDS, MAX_TRACKPOINTS, MIN_VALID_ALTITUDE, list_user_folders,
+                         parse_user_folder)
+
+# Bumped whenever the record layouts change, stores of another version are not opened
+STORE_VERSION = 1
+# One fixed-width record per trackpoint, in user, activity and file order. date_time is in seconds
+# since the epoch, date_days is left out since it follows from date_time
+TRACKPOINT_DTYPE = np.dtype([("lat", "<f8"), ("lon", "<f8"), ("altitude", "<f8"), ("date_time", "<i8")])
+# One record per activity, in user order. Its trackpoints are the records start to stop (exclusive),
+# and mode indexes the store's list of transportation modes, -1 for activities without one
+ACTIVITY_DTYPE = np.dtype([("start", "<i8"), ("stop", "<i8"), ("start_time", "<i8"), ("end_time", "<i8"),
+                           ("user_id", "<i4"), ("mode", "<i4")])
+# One record per user, in ID order. Its activities are the records first_activity to stop_activity (exclusive)
+USER_DTYPE = np.dtype([("user_id", "<i4"), ("has_labels", "<i4"), ("first_activity", "<i8"), ("stop_activity", "<i8")])
+STORE_FILES = {"trackpoints": ("trackpoints.bin", TRACKPOINT_DTYPE), "activities": ("activities.bin", ACTIVITY_DTYPE),
+               "users": ("users.bin", USER_DTYPE)}
+# Trackpoints per chunk of a scan, 128 MB of records, so scans need the same memory however large the store is
+CHUNK_POINTS = 1 << 22
+# The bounding box of the Forbidden City, as queried by part2
+FORBIDDEN_CITY = (39.916000, 116.397000, 39.916999, 116.397999)
+
+
+def build_store(dataset_dir, path, label_match="exact", max_points=MAX_TRACKPOINTS, workers=None, parse_cache_dir=None):
+    """
+    Builds a trackpoint store from the Geolife Data/ tree, see TrackPointStore.
+
+    Users are parsed and appended to the record files one at a time, so building needs
+    memory for one user, not the dataset. meta.json is written last, so an interrupted
+    build leaves a store that does not open instead of a truncated one.
+
+    Args:
+        dataset_dir (str): The path to the Geolife dataset folder.
+        path (str): Directory of the store, created if missing. An existing store is replaced.
+        label_match (str): How activities are matched to labels, see LabelIndex.match.
+        max_points (int): Files with more trackpoints than this are skipped. None disables the cap.
+        workers (int): Number of parse processes, or None to parse in this process.
+        parse_cache_dir (str): Read the parsed users from this parse cache instead, see parse_cache.
+    """
+    start = time.perf_counter()
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    if parse_cache_dir:
+        parsed_users = iter_cached_users(dataset_dir, parse_cache_dir, label_match, max_points, workers)
+    else:
+        labeled_users = read_labeled_users(dataset_dir)
+        user_folders = list_user_folders(dataset_dir)
+        if workers:
+            parsed_users = iter_parsed_users(user_folders, labeled_users, workers, IngestStats(workers), label_match, max_points)
+        else:
+            parsed_users = (
+                (user_id, user_id in labeled_users, parse_user_folder(user_folder_path, user_id in labeled_users, label_match, max_points))
+                for user_id, user_folder_path in user_folders
+            )
+
+    modes = {}
+    counts = {"trackpoints": 0, "activities": 0, "users": 0}
+    files = {name: open(os.path.join(path, file_name), "wb") for name, (file_name, _) in STORE_FILES.items()}
+    try:
+        for user_id, has_labels, activities in parsed_users:
+            lengths = np.array([len(trajectory) for _, trajectory in activities], dtype=np.int64)
+            offsets = np.concatenate(([0], np.cumsum(lengths)))
+            trackpoints = np.empty(offsets[-1], dtype=TRACKPOINT_DTYPE)
+            if activities:
+                for field in ("lat", "lon", "altitude"):
+                    trackpoints[field] = np.concatenate([np.asarray(getattr(trajectory, field), dtype=np.float64)
+                                                         for _, trajectory in activities])
+                trackpoints["date_time"] = np.concatenate([np.array(trajectory.date_time, dtype="datetime64[s]").astype(np.int64)
+                                                           for _, trajectory in activities])
+
+            activity_records = np.empty(len(activities), dtype=ACTIVITY_DTYPE)
+            activity_records["start"] = counts["trackpoints"] + offsets[:-1]
+            activity_records["stop"] = counts["trackpoints"] + offsets[1:]
+            activity_records["start_time"] = trackpoints["date_time"][offsets[:-1]]
+            activity_records["end_time"] = trackpoints["date_time"][offsets[1:] - 1]
+            activity_records["user_id"] = user_id
+            activity_records["mode"] = [modes.setdefault(transportation_mode, len(modes)) if transportation_mode else -1
+                                        for transportation_mode, _ in activities]
+
+            user_record = np.array([(user_id, has_labels, counts["activities"], counts["activities"] + len(activities))],
+                                   dtype=USER_DTYPE)
+
+            trackpoints.tofile(files["trackpoints"])
+            activity_records.tofile(files["activities"])
+            user_record.tofile(files["users"])
+            counts["trackpoints"] += len(trackpoints)
+            counts["activities"] += len(activities)
+            counts["users"] += 1
+    finally:
+        for file in files.values():
+            file.close()
+
+    meta = {"version": STORE_VERSION, **counts, "modes": list(modes), "label_match": label_match, "max_points": max_points}
+    with open(meta_path, "w") as file:
+        json.dump(meta, file, indent=2)
+    size_mb = sum(os.path.getsize(os.path.join(path, file_name)) for file_name, _ in STORE_FILES.values()) / 2**20
+    print(f"Built the trackpoint store in {path}: {counts['users']} users, {counts['activities']} activities, "
+          f"{counts['trackpoints']} trackpoints, {size_mb:.1f} MB in {time.perf_counter() - start:.2f} s")
+
+
+class TrackPointStore:
+    """
+    The Geolife trackpoints as flat files of fixed-width records, for analytics without the database.
+
+    The trackpoint, activity and user files are opened with np.memmap, so opening a store
+    reads nothing but meta.json, and the operating system pages records in as queries
+    touch them. Every column is a view into the mapped file, an activity's trackpoints are
+    a slice of the trackpoint records, and a user's activities a slice of the activity
+    records. Queries over all trackpoints scan them in chunks of CHUNK_POINTS, so a store
+    may be larger than memory.
+
+    The query methods answer the part2 questions, with the same names and results.
+    """
+
+    def __init__(self, trackpoints, activities, users, modes):
+        self.trackpoints = trackpoints
+        self.activities = activities
+        self.users = users
+        self.modes = modes
+        # Per-activity distance, altitude gain and longest gap, computed by the first query that needs them
+        self.metrics = None
+
+    @classmethod
+    def open(cls, path):
+        """
+        Maps a store built with build_store.
+        """
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta["version"] != STORE_VERSION:
+            raise ValueError(f"{path} is a version {meta['version']} store, rebuild it for version {STORE_VERSION}")
+        arrays = {}
+        for name, (file_name, dtype) in STORE_FILES.items():
+            if meta[name]:
+                arrays[name] = np.memmap(os.path.join(path, file_name), dtype=dtype, mode="r", shape=(meta[name],))
+            else:
+                # Zero-length files can not be mapped
+                arrays[name] = np.zeros(0, dtype=dtype)
+        return cls(arrays["trackpoints"], arrays["activities"], arrays["users"], meta["modes"])
+
+    def __len__(self):
+        return len(self.trackpoints)
+
+    def mode_code(self, transportation_mode):
+        """
+        Returns:
+            code (int): The code of a transportation mode in the activity records, or -2 if no activity has it.
+        """
+        return self.modes.index(transportation_mode) if transportation_mode in self.modes else -2
+
+    def mode_name(self, code):
+        return self.modes[code] if code >= 0 else None
+
+    def activity_years(self, activities=None):
+        """
+        Returns:
+            years (ndarray): The year each activity starts in.
+        """
+        start_time = (self.activities if activities is None else activities)["start_time"]
+        return start_time.astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+    def user_activities(self, user_id):
+        """
+        Returns:
+            (first, stop): The range of the user's activities in the activity records, empty for an unknown user.
+        """
+        position = np.searchsorted(self.users["user_id"], user_id)
+        if position == len(self.users) or self.users["user_id"][position] != user_id:
+            return 0, 0
+        return int(self.users["first_activity"][position]), int(self.users["stop_activity"][position])
+
+    def iter_activity_chunks(self, first=0, stop=None):
+        """
+        Splits a range of activities into consecutive ranges of at most CHUNK_POINTS trackpoints,
+        or one activity if it is longer.
+
+        Yields:
+            (first, stop): Ranges in the activity records.
+        """
+        stop = len(self.activities) if stop is None else stop
+        activity_stops = self.activities["stop"]
+        while first < stop:
+            limit = self.activities["start"][first] + CHUNK_POINTS
+            chunk_stop = min(max(int(np.searchsorted(activity_stops, limit, side="right")), first + 1), stop)
+            yield first, chunk_stop
+            first = chunk_stop
+
+    def compute_metrics(self, first=0, stop=None):
+        """
+        Computes the distance, altitude gain and longest gap of a range of activities, with the
+        rules of Trajectory.summary, one chunk of trackpoints at a time.
+
+        Returns:
+            metrics (dict): "distance_km", "altitude_gain_m" and "max_gap_seconds" arrays, one entry per activity.
+        """
+        stop = len(self.activities) if stop is None else stop
+        metrics = {"distance_km": np.zeros(stop - first), "altitude_gain_m": np.zeros(stop - first),
+                   "max_gap_seconds": np.zeros(stop - first, dtype=np.int64)}
+        for chunk_first, chunk_stop in self.iter_activity_chunks(first, stop):
+            activities = self.activities[chunk_first:chunk_stop]
+            point_offset = activities["start"][0]
+            trackpoints = self.trackpoints[point_offset:activities["stop"][-1]]
+            starts = activities["start"] - point_offset
+            counts = activities["stop"] - activities["start"]
+
+            lat, lon = trackpoints["lat"], trackpoints["lon"]
+            altitude, seconds = trackpoints["altitude"], trackpoints["date_time"]
+            distances = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+            climbs = np.diff(altitude)
+            climbs[~((altitude[1:] >= MIN_VALID_ALTITUDE) & (altitude[:-1] >= MIN_VALID_ALTITUDE) & (climbs > 0))] = 0.0
+            gaps = np.diff(seconds)
+            # The step from the last trackpoint of one activity to the first of the next is no step at all
+            boundaries = starts[1:] - 1
+            for steps in (distances, climbs, gaps):
+                steps[boundaries] = 0
+
+            # Activities of a single trackpoint have no steps and keep their zeros
+            moving = counts > 1
+            positions = np.arange(chunk_first - first, chunk_stop - first)[moving]
+            step_starts = starts[moving]
+            if len(step_starts):
+                metrics["distance_km"][positions] = np.add.reduceat(distances, step_starts)
+                metrics["altitude_gain_m"][positions] = np.add.reduceat(climbs, step_starts) * FEET_TO_METERS
+                metrics["max_gap_seconds"][positions] = np.maximum.reduceat(gaps, step_starts)
+        return metrics
+
+    def all_metrics(self):
+        """
+        Returns compute_metrics for all activities, computed by the first call only.
+        """
+        if self.metrics is None:
+            self.metrics = self.compute_metrics()
+        return self.metrics
+
+    #1. How many users, activities and trackpoints are there in the dataset
+    def find_number_of(self):
+        print(f"Total number of users: {len(self.users)}")
+        print(f"Total number of activities: {len(self.activities)}")
+        print(f"Total number of trackpoints: {len(self.trackpoints)}")
+        return len(self.users), len(self.activities), len(self.trackpoints)
+
+    #2. Find the average number of activities per user, including users with zero activities
+    def find_avg_activities_per_user(self):
+        avg_activities = len(self.activities) / len(self.users) if len(self.users) else 0.0
+        print(f"The average number of activities per user is: {round(avg_activities, 2)}")
+        return avg_activities
+
+    #3. Find the top 20 users with the highest number of activities
+    def find_most_active_20_users(self):
+        activity_counts = self.users["stop_activity"] - self.users["first_activity"]
+        order = np.argsort(-activity_counts, kind="stable")[:20]
+        top_users = [(int(self.users["user_id"][i]), int(activity_counts[i])) for i in order]
+        print(tabulate(top_users, headers=["User ID", "Activity count"]))
+        return top_users
+
+    #4. Find all users who have taken a taxi
+    def find_taxi_users(self):
+        taxi = self.activities["mode"] == self.mode_code("taxi")
+        taxi_users = [(user_id,) for user_id in np.unique(self.activities["user_id"][taxi]).tolist()]
+        print(tabulate(taxi_users, headers=["User ID"]))
+        return taxi_users
+
+    #5. Count the activities per transportation mode, leaving out activities without one
+    def count_transportation_modes(self):
+        codes, counts = np.unique(self.activities["mode"], return_counts=True)
+        transportation_modes = [(self.mode_name(code), int(count)) for code, count in zip(codes.tolist(), counts) if code >= 0]
+        print(tabulate(transportation_modes, headers=["Transportation mode", "Count"]))
+        return transportation_modes
+
+    #6. a) Find the year with the most activities.
+    def find_year_with_most_activities(self):
+        years, counts = np.unique(self.activity_years(), return_counts=True)
+        result = (int(years[np.argmax(counts)]), int(counts.max()))
+        print(f"Year with most activities: {result[0]} with {result[1]} activities.")
+        return result
+
+    #6. b) Is this also the year with most recorded hours?
+    def find_year_with_most_hours(self):
+        # Whole hours per activity, as TIMESTAMPDIFF(HOUR, start, end)
+        hours = (self.activities["end_time"] - self.activities["start_time"]) // 3600
+        years, year_index = np.unique(self.activity_years(), return_inverse=True)
+        total_hours = np.bincount(year_index, weights=hours, minlength=len(years))
+        result = (int(years[np.argmax(total_hours)]), int(total_hours.max()))
+        print(f"Year with most recorded hours: {result[0]} with {result[1]} hours.")
+
+        most_activities_year = self.find_year_with_most_activities()
+        if most_activities_year[0] == result[0]:
+            print(f"Yes, the year {most_activities_year[0]} has the most activities and also the most recorded hours.")
+        else:
+            print(f"No, the year with the most activities ({most_activities_year[0]}) is different from the year with the most recorded hours ({result[0]}).")
+        return result
+
+    #7. Find the total distance (in km) walked in 2008, by user with id=112
+    def find_total_distance_walked_2008_user112(self):
+        result = self.find_distance_per_user_mode_year(user_id=112, transportation_mode='walk', year=2008, show=False)
+        total_distance = sum(distance for _, _, _, distance in result)
+        print(f"Total distance walked by user 112 in 2008: {round(total_distance, 2)} km")
+        return total_distance
+
+    def find_distance_per_user_mode_year(self, user_id=None, transportation_mode=None, year=None, show=True):
+        """
+        Finds the distance (in km) travelled per user, transportation mode and year.
+
+        With a user_id, only that user's slice of the activities and trackpoints is read.
+
+        Args:
+            user_id (int): Only this user. None includes all users.
+            transportation_mode (str): Only this mode. None includes all activities, labeled or not.
+            year (int): Only activities starting in this year. None includes all years.
+            show (bool): Print the result as a table.
+
+        Returns:
+            result (list): (user_id, transportation_mode, year, distance_km) tuples, sorted.
+        """
+        if user_id is None:
+            first, stop = 0, len(self.activities)
+            distances = self.all_metrics()["distance_km"]
+        else:
+            first, stop = self.user_activities(user_id)
+            distances = None
+        activities = self.activities[first:stop]
+        years = self.activity_years(activities)
+        selected = np.ones(len(activities), dtype=bool)
+        if transportation_mode is not None:
+            selected &= activities["mode"] == self.mode_code(transportation_mode)
+        if year is not None:
+            selected &= years == year
+        if distances is None:
+            distances = self.compute_metrics(first, stop)["distance_km"]
+
+        totals = {}
+        for user, mode, activity_year, distance in zip(activities["user_id"][selected].tolist(), activities["mode"][selected].tolist(),
+                                                       years[selected].tolist(), distances[selected].tolist()):
+            key = (user, self.mode_name(mode), activity_year)
+            totals[key] = totals.get(key, 0.0) + distance
+        result = sorted(((user, mode, activity_year, distance) for (user, mode, activity_year), distance in totals.items()),
+                        key=lambda row: (row[0], row[1] or "", row[2]))
+        if show:
+            print(tabulate(result, headers=["User ID", "Transportation mode", "Year", "Distance (km)"], floatfmt=".2f"))
+        return result
+
+    #8. Find the top 20 users who have gained the most altitude meters
+    def find_altitude_gain_top_20_users(self):
+        user_ids, user_index = np.unique(self.activities["user_id"], return_inverse=True)
+        gains = np.bincount(user_index, weights=self.all_metrics()["altitude_gain_m"], minlength=len(user_ids))
+        order = [i for i in np.argsort(-gains, kind="stable")[:20] if gains[i] > 0]
+        top_users_meters = [(int(user_ids[i]), float(gains[i])) for i in order]
+        print(tabulate(top_users_meters, headers=["User ID", "Total Altitude Gained (meters)"]))
+        return top_users_meters
+
+    #9. Find all users who have invalid activities, and the number of invalid activities per user
+    def find_invalid_activities(self):
+        invalid = self.all_metrics()["max_gap_seconds"] >= INVALID_GAP_SECONDS
+        user_ids, counts = np.unique(self.activities["user_id"][invalid], return_counts=True)
+        rows = list(zip(user_ids.tolist(), counts.tolist()))
+        print(tabulate(rows, headers=["User ID", "Invalid activities"]))
+        return rows
+
+    #10. Find the users who have tracked an activity in the Forbidden City of Beijing
+    def find_users_in_forbidden_city(self):
+        rows = self.find_users_in_region(bbox=FORBIDDEN_CITY)
+        print(tabulate(rows, headers=["User ID"]))
+        return rows
+
+    def find_users_in_region(self, bbox=None, polygon=None):
+        """
+        Finds the users with a trackpoint inside a region, by scanning the coordinates chunk by chunk.
+
+        Args:
+            bbox (tuple): (min_lat, min_lon, max_lat, max_lon), bounds included.
+            polygon (list): (lat, lon) vertices of the region, boundary included.
+
+        Returns:
+            rows (list): (user_id,) tuples, sorted.
+        """
+        ring = region_ring(bbox, polygon)
+        lons, lats = zip(*ring)
+        activity_starts = self.activities["start"]
+        user_ids = set()
+        for start in range(0, len(self.trackpoints), CHUNK_POINTS):
+            trackpoints = self.trackpoints[start:start + CHUNK_POINTS]
+            lat, lon = trackpoints["lat"], trackpoints["lon"]
+            positions = np.flatnonzero((lat >= min(lats)) & (lat <= max(lats)) & (lon >= min(lons)) & (lon <= max(lons)))
+            if polygon is not None:
+                positions = positions[points_in_polygon(lat[positions], lon[positions], ring)]
+            activities = np.searchsorted(activity_starts, start + positions, side="right") - 1
+            user_ids.update(self.activities["user_id"][activities].tolist())
+        return [(user_id,) for user_id in sorted(user_ids)]
+
+    #11. Find all users who have registered transportation_mode and their most used transportation_mode
+    def find_most_used_transportation_per_user(self):
+        labeled = self.activities["mode"] >= 0
+        pairs, counts = np.unique(np.stack([self.activities["user_id"][labeled], self.activities["mode"][labeled]], axis=1),
+                                  axis=0, return_counts=True)
+        most_used_modes = {}
+        for (user_id, mode), count in zip(pairs.tolist(), counts.tolist()):
+            best = most_used_modes.get(user_id)
+            if best is None or count > best[1]:
+                most_used_modes[user_id] = (self.mode_name(mode), count)
+        result = [(user_id, mode) for user_id, (mode, _) in most_used_modes.items()]
+        print(tabulate(result, headers=["User ID", "Most used transportation mode"]))
+        return result
+
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Answer the part2 questions from a memory-mapped trackpoint store.")
+    parser.add_argument("store", help="directory of the trackpoint store")
+    parser.add_argument("--build", action="store_true", help="build the store from the dataset first, replacing it")
+    parser.add_argument("--dataset", default=os.path.normpath(os.path.join(current_dir, '../../dataset')),
+                        help="path to the Geolife dataset folder")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parse .plt files in this many processes when building (default: in this process)")
+    parser.add_argument("--label-match", choices=LABEL_MATCHES, default="exact",
+                        help="how activities are matched to labels when building, see the loaders")
+    parser.add_argument("--uncapped", action="store_true",
+                        help="also store the .plt files over the trackpoint cap the database loaders skip")
+    parser.add_argument("--parse-cache", metavar="DIR", default=None,
+                        help="build from the binary parse cache in this directory (see geolife/parse_cache.py)")
+    args = parser.parse_args()
+
+    if args.build:
+        build_store(args.dataset, args.store, args.label_match, None if args.uncapped else MAX_TRACKPOINTS,
+                    args.workers, args.parse_cache)
+    start = time.perf_counter()
+    store = TrackPointStore.open(args.store)
+    print(f"Opened {len(store)} trackpoints in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    print("1. Count users, activities, and trackpoints:")
+    store.find_number_of()
+    print("\n2. Average number of activities per user:")
+    store.find_avg_activities_per_user()
+    print("\n3. Top 20 users with the highest number of activities:")
+    store.find_most_active_20_users()
+    print("\n4. Find all users who have taken a taxi:")
+    store.find_taxi_users()
+    print("\n5. Count of transportation modes:")
+    store.count_transportation_modes()
+    print("\n6. a) Year with the most activities:")
+    store.find_year_with_most_activities()
+    print("\n6. b) Year with the most recorded hours:")
+    store.find_year_with_most_hours()
+    print("\n7. Total distance walked in 2008 by user with id=112:")
+    store.find_total_distance_walked_2008_user112()
+    print("\n8. Top 20 users who have gained the most altitude:")
+    store.find_altitude_gain_top_20_users()
+    print("\n9. Users with invalid activities and number of invalid activities:")
+    store.find_invalid_activities()
+    print("\n10. Users who have tracked activity in the Forbidden City of Beijing:")
+    store.find_users_in_forbidden_city()
+    print("\n11. Users with registered transportation modes and their most used mode:")
+    store.find_most_used_transportation_per_user()
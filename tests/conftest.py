@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# The tests import the shared modules as geolife.<module>, as the assignment scripts do
+sys.path.insert(0, ROOT)
+
+from geolife_data import write_dataset
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """
+    A small random Geolife tree, see geolife_data.write_dataset.
+    """
+    return write_dataset(str(tmp_path / "dataset"))
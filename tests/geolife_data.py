@@ -0,0 +1,99 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+# Day 0 of the date_days field of the .plt files
+PLT_EPOCH = datetime(1899, 12, 30)
+# A point inside the Forbidden City bounding box queried by part2
+FORBIDDEN_CITY_POINT = (39.9165, 116.3975)
+TRANSPORTATION_MODES = ("walk", "bus", "taxi", "car", "bike")
+
+
+def write_plt(path, points):
+    """
+    Writes (lat, lon, altitude, date_time) points as a .plt file, with the 6 header lines of Geolife.
+    """
+    lines = ["Geolife trajectory", "WGS 84", "Altitude is in Feet", "Reserved 3",
+             "0,2,255,My Track,0,0,2,8421376", "0"]
+    for lat, lon, altitude, date_time in points:
+        date_days = (date_time - PLT_EPOCH).total_seconds() / 86400
+        lines.append(f"{lat:.6f},{lon:.6f},0,{altitude:g},{date_days:.10f},"
+                     f"{date_time:%Y-%m-%d},{date_time:%H:%M:%S}")
+    with open(path, "w") as file:
+        file.write("\r\n".join(lines) + "\r\n")
+
+
+def random_points(rng, count, start_time):
+    """
+    A random walk around Beijing: mostly small steps a few seconds apart, with
+    some invalid (-777) altitudes, gaps of over 5 minutes and visits to the Forbidden City.
+    """
+    lat, lon, altitude, date_time = 39.9 + rng.uniform(-0.1, 0.1), 116.4 + rng.uniform(-0.1, 0.1), rng.uniform(0, 300), start_time
+    points = []
+    for _ in range(count):
+        roll = rng.random()
+        point_altitude = -777 if roll < 0.05 else round(altitude)
+        point = FORBIDDEN_CITY_POINT if roll > 0.99 else (round(lat, 6), round(lon, 6))
+        points.append((*point, point_altitude, date_time))
+        lat += rng.uniform(-0.001, 0.001)
+        lon += rng.uniform(-0.001, 0.001)
+        altitude += rng.uniform(-20, 25)
+        date_time += timedelta(seconds=rng.choice([400, 1200]) if rng.random() < 0.03 else rng.randint(1, 10))
+    return points
+
+
+def write_dataset(root, users=4, files_per_user=4, labeled_users=(1, 2), long_file_points=None, seed=0):
+    """
+    Writes a small random dataset in the layout of the Geolife Data/ tree.
+
+    Labeled users get labels that match some of their files exactly, that cover only
+    part of a file, and that match no file at all, so every label matching mode has
+    something to do.
+
+    Args:
+        root (str): The dataset folder, created if missing.
+        users (int): Number of users, with IDs 0 to users - 1.
+        files_per_user (int): .plt files per user, of 1 to 80 trackpoints.
+        labeled_users (iterable): IDs of the users with a labels.txt.
+        long_file_points (int): Also give user 0 a file of this many trackpoints, to test the cap.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        root (str): The dataset folder.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, "Data"), exist_ok=True)
+    with open(os.path.join(root, "labeled_ids.txt"), "w") as file:
+        file.write("".join(f"{user_id:03d}\n" for user_id in labeled_users))
+
+    for user_id in range(users):
+        trajectory_dir = os.path.join(root, "Data", f"{user_id:03d}", "Trajectory")
+        os.makedirs(trajectory_dir)
+        start_time = datetime(2008, 1, 1) + timedelta(days=rng.randint(0, 700), seconds=rng.randint(0, 86399))
+        files = []
+        counts = [rng.randint(1, 80) for _ in range(files_per_user)]
+        if user_id == 0 and long_file_points:
+            counts.append(long_file_points)
+        for count in counts:
+            points = random_points(rng, count, start_time)
+            file_path = os.path.join(trajectory_dir, f"{start_time:%Y%m%d%H%M%S}.plt")
+            write_plt(file_path, points)
+            files.append(points)
+            start_time = points[-1][3] + timedelta(hours=rng.randint(1, 30))
+
+        if user_id in labeled_users:
+            labels = []
+            for index, points in enumerate(files):
+                start, end = points[0][3], points[-1][3]
+                if index % 3 == 0:
+                    labels.append((start, end))
+                elif index % 3 == 1 and len(points) > 4:
+                    labels.append((points[1][3], points[len(points) // 2][3]))
+                    labels.append((points[len(points) // 2 + 1][3], end + timedelta(seconds=5)))
+            labels.append((start_time, start_time + timedelta(minutes=10)))
+            with open(os.path.join(trajectory_dir, "..", "labels.txt"), "w") as file:
+                file.write("Start Time\tEnd Time\tTransportation Mode\n")
+                for label_start, label_end in labels:
+                    file.write(f"{label_start:%Y/%m/%d %H:%M:%S}\t{label_end:%Y/%m/%d %H:%M:%S}\t"
+                               f"{rng.choice(TRANSPORTATION_MODES)}\n")
+    return root
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+
+def resolve_path(value, names):
+    """
+    Follows a dotted path into a document, mapping over arrays as MongoDB field paths do.
+    """
+    for name in names:
+        if isinstance(value, list):
+            value = [item.get(name) for item in value if isinstance(item, dict)]
+        elif isinstance(value, dict):
+            value = value.get(name)
+        else:
+            return None
+    return value
+
+
+def evaluate(expression, document, variables=None):
+    """
+    Evaluates a MongoDB aggregation expression against a document in Python.
+
+    Only the operators of the server-side expressions in insertion.py are implemented,
+    with the semantics the MongoDB manual gives them, so those expressions can be
+    checked without a server. Unknown operators raise NotImplementedError.
+
+    Args:
+        expression: The expression, as it would be sent to the server.
+        document (dict): The document $field paths refer to.
+        variables (dict): The values of $$variables.
+
+    Returns:
+        The value of the expression.
+    """
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, *path = expression[2:].split(".")
+        return resolve_path(variables[name], path)
+    if isinstance(expression, str) and expression.startswith("$"):
+        return resolve_path(document, expression[1:].split("."))
+    if isinstance(expression, list):
+        return [evaluate(item, document, variables) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if not any(key.startswith("$") for key in expression):
+        return {key: evaluate(value, document, variables) for key, value in expression.items()}
+
+    (operator, argument), = expression.items()
+    if operator == "$let":
+        scope = dict(variables)
+        scope.update({name: evaluate(value, document, variables) for name, value in argument["vars"].items()})
+        return evaluate(argument["in"], document, scope)
+    if operator == "$reduce":
+        items = evaluate(argument["input"], document, variables)
+        if items is None:
+            return None
+        value = evaluate(argument["initialValue"], document, variables)
+        for item in items:
+            value = evaluate(argument["in"], document, {**variables, "value": value, "this": item})
+        return value
+
+    values = evaluate(argument, document, variables) if isinstance(argument, list) else [evaluate(argument, document, variables)]
+    if operator == "$size":
+        return len(values[0])
+    if operator == "$ifNull":
+        return next((value for value in values if value is not None), values[-1])
+    if operator == "$eq":
+        return values[0] == values[1]
+    if operator == "$cond":
+        return values[1] if values[0] else values[2]
+    if operator == "$max":
+        # Null and missing values are ignored
+        present = [value for value in (values[0] if len(values) == 1 else values) if value is not None]
+        return max(present) if present else None
+    if operator == "$subtract":
+        if values[0] is None or values[1] is None:
+            return None
+        if isinstance(values[0], datetime) and isinstance(values[1], datetime):
+            # Subtracting dates gives milliseconds
+            return int((values[0] - values[1]).total_seconds() * 1000)
+        return values[0] - values[1]
+    if operator == "$divide":
+        return None if None in values else values[0] / values[1]
+    if operator == "$toInt":
+        # Doubles are truncated
+        return None if values[0] is None else int(values[0])
+    raise NotImplementedError(f"{operator} is not implemented by this evaluator")
@@ -0,0 +1,56 @@
+import os
+import sys
+import types
+import pytest
+
+pytest.importorskip("pymongo")
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "assignment3_2024"))
+from buffered_writer import BufferedWriter
+
+
+class FailingCollection:
+    """
+    A collection whose insert_many raises a BulkWriteError with the given details.
+    """
+
+    name = "Activity"
+
+    def __init__(self, details):
+        self.details = details
+
+    def insert_many(self, documents, ordered=True):
+        raise BulkWriteError(self.details)
+
+
+def test_write_errors_are_counted_and_reported(capsys):
+    writer = BufferedWriter(FailingCollection({"nInserted": 2, "writeErrors": [{"errmsg": "duplicate key"}]}))
+    for index in range(3):
+        writer.insert({"_id": index})
+    writer.flush()
+    assert (writer.inserted, writer.failed) == (2, 1)
+    assert "Failed to insert 1 documents into Activity: duplicate key" in capsys.readouterr().out
+
+
+def test_write_concern_errors_alone_are_reported(capsys):
+    details = {"nInserted": 3, "writeErrors": [], "writeConcernErrors": [{"errmsg": "waiting for replication timed out"}]}
+    writer = BufferedWriter(FailingCollection(details))
+    for index in range(3):
+        writer.insert({"_id": index})
+    writer.flush()
+    assert (writer.inserted, writer.failed) == (3, 0)
+    assert "Write concern error inserting into Activity: waiting for replication timed out" in capsys.readouterr().out
+
+
+def test_flush_writes_in_batches():
+    batches = []
+    collection = types.SimpleNamespace(
+        name="User", insert_many=lambda documents, ordered: batches.append(len(documents)) or
+        types.SimpleNamespace(inserted_ids=list(documents)))
+    writer = BufferedWriter(collection, max_documents=2)
+    for index in range(5):
+        writer.insert({"_id": index})
+    writer.flush()
+    assert batches == [2, 2, 1]
+    assert writer.inserted == 5
@@ -0,0 +1,59 @@
+import math
+import numpy as np
+import pytest
+from geolife.geo import activity_distances, haversine_km, segment_distances, trajectory_distance
+
+
+def naive_distance_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6378.137 * math.asin(math.sqrt(a))
+
+
+def random_track(seed, count=500):
+    """
+    Points around Beijing ordered by activity, with activities of one and of many points.
+    """
+    rng = np.random.default_rng(seed)
+    lat = 39.9 + np.cumsum(rng.uniform(-0.001, 0.001, count))
+    lon = 116.4 + np.cumsum(rng.uniform(-0.001, 0.001, count))
+    activity_ids = np.sort(rng.integers(0, count // 10, count)) * 7 + 3
+    return lat, lon, activity_ids
+
+
+def test_haversine_agrees_with_the_formula():
+    lat1, lon1, lat2, lon2 = np.random.default_rng(0).uniform([-90, -180, -90, -180], [90, 180, 90, 180], (200, 4)).T
+    expected = [naive_distance_km(*point) for point in zip(lat1, lon1, lat2, lon2)]
+    assert haversine_km(lat1, lon1, lat2, lon2) == pytest.approx(expected)
+    # A degree of latitude on the sphere the queries use
+    assert haversine_km(0.0, 0.0, 1.0, 0.0) == pytest.approx(2 * math.pi * 6378.137 / 360)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_activity_distances_agree_with_a_loop(seed):
+    lat, lon, activity_ids = random_track(seed)
+    expected = {}
+    for i in range(len(lat)):
+        expected.setdefault(activity_ids[i], 0.0)
+        if i and activity_ids[i] == activity_ids[i - 1]:
+            expected[activity_ids[i]] += naive_distance_km(lat[i - 1], lon[i - 1], lat[i], lon[i])
+
+    ids, distances = activity_distances(lat, lon, activity_ids)
+    assert ids.tolist() == list(expected)
+    assert distances == pytest.approx(list(expected.values()))
+    assert trajectory_distance(lat, lon, activity_ids) == pytest.approx(sum(expected.values()))
+
+
+def test_segments_between_activities_are_not_travelled():
+    lat, lon, activity_ids = random_track(0)
+    expected = [0.0 if activity_ids[i] != activity_ids[i + 1] else naive_distance_km(lat[i], lon[i], lat[i + 1], lon[i + 1])
+                for i in range(len(lat) - 1)]
+    assert segment_distances(lat, lon, activity_ids) == pytest.approx(expected)
+    assert trajectory_distance(lat, lon) == pytest.approx(sum(naive_distance_km(lat[i], lon[i], lat[i + 1], lon[i + 1])
+                                                             for i in range(len(lat) - 1)))
+
+
+def test_short_inputs():
+    assert trajectory_distance([39.9], [116.4]) == 0.0
+    ids, distances = activity_distances([], [], [])
+    assert len(ids) == 0 and len(distances) == 0
@@ -0,0 +1,140 @@
+import math
+import random
+import numpy as np
+import pytest
+from geolife.grid_index import DEFAULT_PRECISION, GEOHASH_BASE32, GridIndex, GridIndexBuilder, deinterleave, geohash_encode, geohash_string, quantize
+from geolife.plt_reader import list_user_folders, parse_user_folder
+from geolife_data import FORBIDDEN_CITY_POINT
+
+
+def naive_geohash(lat, lon, precision):
+    """
+    The textbook geohash: halve the longitude and latitude ranges in turn, 5 bits per character.
+    """
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    bits = []
+    for i in range(5 * precision):
+        value = (lon, lat)[i % 2]
+        low, high = ranges[i % 2]
+        middle = (low + high) / 2
+        bits.append(value >= middle)
+        ranges[i % 2] = [middle, high] if value >= middle else [low, middle]
+    return "".join(GEOHASH_BASE32[int("".join("1" if bit else "0" for bit in bits[i:i + 5]), 2)]
+                   for i in range(0, len(bits), 5))
+
+
+def naive_distance_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6378.137 * math.asin(math.sqrt(a)) * 1000.0
+
+
+def crowd(users=6, points=200, seed=0, precision=DEFAULT_PRECISION):
+    """
+    A grid index of users walking around the same few hundred meters in the same half hour.
+    """
+    rng = np.random.default_rng(seed)
+    count = users * points
+    user_ids = np.repeat(np.arange(users), points)
+    times = 1200000000 + rng.integers(0, 1800, count)
+    lat = 39.9 + rng.uniform(-0.002, 0.002, count)
+    lon = 116.4 + rng.uniform(-0.002, 0.002, count)
+    builder = GridIndexBuilder(precision)
+    return GridIndex(geohash_encode(lat, lon, builder.precision), times // builder.time_bucket_seconds,
+                     user_ids, times, lat, lon, builder.precision, builder.time_bucket_seconds)
+
+
+def loaded(dataset):
+    builder = GridIndexBuilder()
+    for user_id, user_folder_path in list_user_folders(dataset):
+        for _ in builder.track(user_id, parse_user_folder(user_folder_path, False)):
+            pass
+    return builder.build()
+
+
+@pytest.mark.parametrize("precision", [1, 5, 7, 12])
+def test_geohash_matches_the_textbook_encoding(precision):
+    rng = random.Random(precision)
+    for _ in range(200):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        assert geohash_string(geohash_encode([lat], [lon], precision)[0], precision) == naive_geohash(lat, lon, precision)
+
+
+def test_deinterleave_undoes_interleave():
+    lat = np.random.default_rng(0).uniform(-90, 90, 1000)
+    lon = np.random.default_rng(1).uniform(-180, 180, 1000)
+    lat_q, lon_q = quantize(lat, lon, 7)
+    restored_lat_q, restored_lon_q = deinterleave(geohash_encode(lat, lon, 7), 7)
+    assert (restored_lat_q == lat_q).all() and (restored_lon_q == lon_q).all()
+
+
+# 130 m fits in the height of the default cells in Beijing but not in their width, see cell_width_m
+@pytest.mark.parametrize("radius_m, max_seconds, precision", [(50, 60, 7), (100, 20, 7), (10, 5, 7), (130, 60, 7), (130, 60, 6)])
+def test_colocated_users_matches_comparing_every_pair(radius_m, max_seconds, precision):
+    index = crowd(precision=precision)
+    first_met = {}
+    points = list(zip(index.user_ids.tolist(), index.times.tolist(), index.lat.tolist(), index.lon.tolist()))
+    for i, (user_a, time_a, lat_a, lon_a) in enumerate(points):
+        for user_b, time_b, lat_b, lon_b in points[i + 1:]:
+            if (user_a != user_b and abs(time_a - time_b) <= max_seconds
+                    and naive_distance_m(lat_a, lon_a, lat_b, lon_b) <= radius_m):
+                pair = (min(user_a, user_b), max(user_a, user_b))
+                first_met[pair] = min(first_met.get(pair, time_a), time_a, time_b)
+    expected = sorted((user_a, user_b, np.datetime64(time, "s")) for (user_a, user_b), time in first_met.items())
+
+    assert expected
+    if index.cell_width_m() < radius_m <= index.cell_height_m():
+        # Pairs in cells two columns apart would be missed, so the radius is refused
+        with pytest.raises(ValueError, match="cell width"):
+            index.colocated_users(radius_m, max_seconds)
+    else:
+        assert index.colocated_users(radius_m, max_seconds) == expected
+
+
+def test_colocated_users_rejects_a_radius_larger_than_the_cells():
+    index = crowd()
+    with pytest.raises(ValueError, match="cell height"):
+        index.colocated_users(radius_m=index.cell_height_m() + 1)
+    with pytest.raises(ValueError, match="time bucket"):
+        index.colocated_users(max_seconds=index.time_bucket_seconds + 1)
+
+
+def test_users_in_region_matches_a_scan(dataset):
+    index = loaded(dataset)
+    # Regions that some of the random walks of write_dataset cross and others do not
+    bbox = (39.85, 116.42, 39.95, 116.5)
+    triangle = [(39.95, 116.3), (40.0, 116.375), (39.95, 116.45)]
+
+    def inside_triangle(point_lat, point_lon):
+        # The point is on the same side of all three edges
+        sides = [(lon2 - lon1) * (point_lat - lat1) - (lat2 - lat1) * (point_lon - lon1)
+                 for (lat1, lon1), (lat2, lon2) in zip(triangle, triangle[1:] + triangle[:1])]
+        return all(side > 0 for side in sides) or all(side < 0 for side in sides)
+
+    in_bbox, in_triangle = set(), set()
+    for user_id, point_lat, point_lon in zip(index.user_ids.tolist(), index.lat.tolist(), index.lon.tolist()):
+        if bbox[0] <= point_lat <= bbox[2] and bbox[1] <= point_lon <= bbox[3]:
+            in_bbox.add(user_id)
+        if inside_triangle(point_lat, point_lon):
+            in_triangle.add(user_id)
+
+    assert index.users_in_region(bbox=bbox) == sorted(in_bbox)
+    assert index.users_in_region(polygon=triangle) == sorted(in_triangle)
+
+
+@pytest.mark.parametrize("radius_m", [10, 500, 5000])
+def test_users_near_matches_a_scan(dataset, radius_m):
+    index = loaded(dataset)
+    lat, lon = FORBIDDEN_CITY_POINT
+    middle = int(np.median(index.times))
+    expected, expected_in_window = set(), set()
+    for user_id, time, point_lat, point_lon in zip(index.user_ids.tolist(), index.times.tolist(),
+                                                    index.lat.tolist(), index.lon.tolist()):
+        if naive_distance_m(lat, lon, point_lat, point_lon) <= radius_m:
+            expected.add(user_id)
+            if time >= middle:
+                expected_in_window.add(user_id)
+
+    assert index.users_near(lat, lon, radius_m) == sorted(expected)
+    start_time = np.datetime64(middle, "s").astype(object)
+    assert index.users_near(lat, lon, radius_m, start_time=start_time) == sorted(expected_in_window)
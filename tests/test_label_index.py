@@ -0,0 +1,94 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from geolife.label_index import LabelIndex
+
+START = datetime(2008, 6, 1)
+
+
+def minutes(value):
+    return START + timedelta(minutes=value)
+
+
+def random_labels(rng, count, overlapping=True):
+    """
+    Labels on whole minutes, either freely overlapping or one after the other.
+    """
+    labels = {}
+    cursor = 0
+    for _ in range(count):
+        if overlapping:
+            start = rng.randint(0, 500)
+        else:
+            start = cursor + rng.randint(0, 20)
+        end = start + rng.randint(0, 60)
+        cursor = end + 1
+        labels[(minutes(start), minutes(end))] = rng.choice(["walk", "bus", "taxi"])
+    return labels
+
+
+def naive_match(labels, start_time, end_time, how):
+    if (start_time, end_time) in labels or how == "exact":
+        return labels.get((start_time, end_time))
+    best_mode, best_overlap = None, None
+    for (label_start, label_end), mode in sorted(labels.items()):
+        if label_end < start_time or label_start > end_time:
+            continue
+        if how == "contains":
+            if label_start <= start_time and label_end >= end_time:
+                return mode
+            continue
+        overlap = min(label_end, end_time) - max(label_start, start_time)
+        if best_overlap is None or overlap > best_overlap:
+            best_mode, best_overlap = mode, overlap
+    return best_mode
+
+
+@pytest.mark.parametrize("how", ["exact", "contains", "overlap"])
+def test_match_agrees_with_checking_every_label(how):
+    rng = random.Random(how)
+    for _ in range(50):
+        labels = random_labels(rng, rng.randint(0, 30))
+        index = LabelIndex(labels)
+        queries = list(labels) + [(minutes(start), minutes(start + rng.randint(0, 90)))
+                                  for start in (rng.randint(-30, 550) for _ in range(40))]
+        for start_time, end_time in queries:
+            assert index.match(start_time, end_time, how) == naive_match(labels, start_time, end_time, how)
+
+
+def test_overlapping_agrees_with_checking_every_label():
+    rng = random.Random(1)
+    for _ in range(50):
+        labels = random_labels(rng, rng.randint(0, 30))
+        index = LabelIndex(labels)
+        for start in (rng.randint(-30, 550) for _ in range(40)):
+            start_time, end_time = minutes(start), minutes(start + rng.randint(0, 90))
+            expected = [(label_start, label_end, mode) for (label_start, label_end), mode in sorted(labels.items())
+                        if label_end >= start_time and label_start <= end_time]
+            assert index.overlapping(start_time, end_time) == expected
+
+
+def naive_segments(labels, times):
+    """
+    Runs of consecutive points inside the same label, or outside every label, found point by point.
+    """
+    intervals = sorted(labels.items())
+    runs = []
+    for position, time in enumerate(times):
+        label = next((i for i, ((label_start, label_end), _) in enumerate(intervals) if label_start <= time <= label_end), None)
+        if runs and runs[-1][0] == label:
+            runs[-1][2] = position + 1
+        else:
+            runs.append([label, position, position + 1])
+    return [(None if label is None else intervals[label][1], start, stop) for label, start, stop in runs]
+
+
+def test_segments_agree_with_labeling_every_point():
+    rng = random.Random(2)
+    for _ in range(100):
+        labels = random_labels(rng, rng.randint(0, 15), overlapping=False)
+        times = sorted(minutes(rng.randint(-20, 700)) for _ in range(rng.randint(0, 200)))
+        segments = list(LabelIndex(labels).segments(times))
+        assert segments == naive_segments(labels, times)
+        # The runs cover every point once
+        assert [position for _, start, stop in segments for position in range(start, stop)] == list(range(len(times)))
@@ -0,0 +1,73 @@
+import os
+import sys
+import types
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from geolife.parse_cache import read_labeled_users
+from geolife.plt_reader import Trajectory, list_user_folders, parse_user_folder
+from mongo_expressions import evaluate
+
+pymongo = pytest.importorskip("pymongo")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "assignment3_2024"))
+from insertion import MAX_GAP_SECONDS_EXPRESSION, TRACKPOINT_COUNT_EXPRESSION, InsertGeolifeDatasetMongo
+
+# The server test_backfill_matches_the_parsed_summaries runs against, it is skipped if none answers
+MONGO_TEST_URI = os.environ.get("MONGO_TEST_URI", "mongodb://localhost:27017")
+
+
+def trajectory(seconds):
+    """
+    A trajectory with trackpoints at the given offsets in seconds.
+    """
+    times = [datetime(2008, 5, 1) + timedelta(seconds=offset) for offset in seconds]
+    return Trajectory([39.9] * len(times), [116.4] * len(times), [100.0] * len(times), [39569.0] * len(times), times)
+
+
+@pytest.mark.parametrize("seconds", [[0], [0, 5], [0, 5, 400, 401], [0, 1200, 1201, 2401], [0, 0, 299.5, 300]])
+def test_expressions_agree_with_the_summary(seconds):
+    activity = trajectory(seconds)
+    document = {"trackpoints": activity.documents()}
+    summary = activity.summary()
+    assert evaluate(TRACKPOINT_COUNT_EXPRESSION, document) == summary["trackpoint_count"]
+    assert evaluate(MAX_GAP_SECONDS_EXPRESSION, document) == summary["max_gap_seconds"]
+
+
+def test_expressions_agree_with_the_summary_of_every_parsed_activity(dataset):
+    labeled_users = read_labeled_users(dataset)
+    for user_id, user_folder_path in list_user_folders(dataset):
+        for _, activity in parse_user_folder(user_folder_path, user_id in labeled_users):
+            document = {"trackpoints": activity.documents()}
+            summary = activity.summary()
+            assert evaluate(TRACKPOINT_COUNT_EXPRESSION, document) == summary["trackpoint_count"]
+            assert evaluate(MAX_GAP_SECONDS_EXPRESSION, document) == summary["max_gap_seconds"]
+
+
+@pytest.fixture
+def server_db():
+    """
+    A fresh database on the MongoDB server at MONGO_TEST_URI, dropped afterwards.
+    """
+    client = pymongo.MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        client.close()
+        pytest.skip(f"No MongoDB server at {MONGO_TEST_URI}: {e}")
+    name = f"geolife_test_{uuid.uuid4().hex[:8]}"
+    yield client, client[name]
+    client.drop_database(name)
+    client.close()
+
+
+def test_backfill_matches_the_parsed_summaries(dataset, server_db):
+    client, db = server_db
+    program = InsertGeolifeDatasetMongo(connection=types.SimpleNamespace(client=client, db=db, close_connection=lambda: None))
+    program.traverse_folder(dataset)
+    # The loader stored Trajectory.summary(), the backfill has to compute the same on the server
+    expected = {activity["_id"]: (activity["trackpoint_count"], activity["max_gap_seconds"]) for activity in db["Activity"].find()}
+    db["Activity"].update_many({}, {"$unset": {"trackpoint_count": "", "max_gap_seconds": ""}})
+
+    program.backfill_summary_fields()
+    assert {activity["_id"]: (activity["trackpoint_count"], activity["max_gap_seconds"])
+            for activity in db["Activity"].find()} == expected
@@ -0,0 +1,74 @@
+import os
+import sys
+import types
+import pytest
+from geolife.parse_cache import read_labeled_users
+from geolife.plt_reader import list_user_folders, parse_user_folder
+
+mongomock = pytest.importorskip("mongomock")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "assignment3_2024"))
+from insertion import InsertGeolifeDatasetMongo
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def merge_stage(monkeypatch):
+    """
+    Runs the $merge stage of refresh_rollups, which mongomock does not implement, by
+    running the rest of the pipeline and replacing or inserting its results by _id.
+    """
+    aggregate = mongomock.Collection.aggregate
+
+    def aggregate_with_merge(collection, pipeline, *args, **kwargs):
+        if not pipeline or "$merge" not in pipeline[-1]:
+            return aggregate(collection, pipeline, *args, **kwargs)
+        target = collection.database[pipeline[-1]["$merge"]["into"]]
+        for document in aggregate(collection, pipeline[:-1], *args, **kwargs):
+            target.replace_one({"_id": document["_id"]}, document, upsert=True)
+        return iter(())
+
+    monkeypatch.setattr(mongomock.Collection, "aggregate", aggregate_with_merge)
+
+
+def loader(client, layout):
+    connection = types.SimpleNamespace(client=client, db=client["geolife_test"], close_connection=lambda: None)
+    return InsertGeolifeDatasetMongo(connection=connection, layout=layout)
+
+
+@pytest.mark.parametrize("layout", ["embedded", "bucketed"])
+def test_rerun_after_a_crash_before_the_manifest_write_does_not_duplicate(dataset, monkeypatch, layout):
+    labeled_users = read_labeled_users(dataset)
+    activity_count = sum(len(parse_user_folder(path, user_id in labeled_users)) for user_id, path in list_user_folders(dataset))
+    client = mongomock.MongoClient()
+    db = client["geolife_test"]
+
+    # The second user's activities are written, then the process dies before its manifest entries are
+    bulk_write = mongomock.Collection.bulk_write
+    manifest_writes = []
+
+    def crash_on_second_manifest_write(collection, requests, *args, **kwargs):
+        if collection.name == "IngestManifest":
+            manifest_writes.append(len(requests))
+            if len(manifest_writes) == 2:
+                raise Crash()
+        return bulk_write(collection, requests, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", crash_on_second_manifest_write)
+    with pytest.raises(Crash):
+        loader(client, layout).traverse_folder_incremental(dataset)
+    assert db["IngestManifest"].count_documents({}) < len(db["Activity"].distinct("source_file"))
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write)
+
+    loader(client, layout).traverse_folder_incremental(dataset)
+    assert db["Activity"].count_documents({}) == activity_count
+    assert sum(rollup["activity_count"] for rollup in db["ActivityRollup"].find()) == activity_count
+    if layout == "bucketed":
+        activity_ids = set(db["Activity"].distinct("_id"))
+        assert set(db["TrackPointBucket"].distinct("activity_id")) == activity_ids
+
+    # A third run finds nothing to do
+    loader(client, layout).traverse_folder_incremental(dataset)
+    assert db["Activity"].count_documents({}) == activity_count
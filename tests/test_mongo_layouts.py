@@ -0,0 +1,95 @@
+import os
+import sys
+import types
+import pytest
+from geolife.parse_cache import read_labeled_users
+from geolife.plt_reader import INVALID_GAP_SECONDS, list_user_folders, parse_user_folder
+
+mongomock = pytest.importorskip("mongomock")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "assignment3_2024"))
+from insertion import LAYOUTS, TRACKPOINT_SERIES_OPTIONS, InsertGeolifeDatasetMongo
+from part2 import Part2
+
+
+def load(dataset, layout):
+    """
+    Loads a dataset into an in-memory database with one trackpoint layout.
+
+    Returns:
+        part2 (Part2): Queries on the loaded database.
+    """
+    client = mongomock.MongoClient()
+    connection = types.SimpleNamespace(client=client, db=client["geolife_test"], close_connection=lambda: None)
+    program = InsertGeolifeDatasetMongo(connection=connection, layout=layout)
+    if layout == "timeseries":
+        program.create_coll("TrackPointSeries", timeseries=TRACKPOINT_SERIES_OPTIONS)
+    program.traverse_folder(dataset)
+    program.flush()
+    program.create_indexes()
+    program.bump_generation()
+    return Part2(connection=connection, layout=layout)
+
+
+def reference(dataset):
+    """
+    The trackpoint count, altitude gain per user and invalid activities per user of a dataset,
+    computed point by point from the parsed files.
+    """
+    labeled_users = read_labeled_users(dataset)
+    trackpoints = 0
+    gains = {}
+    invalid = {}
+    for user_id, user_folder_path in list_user_folders(dataset):
+        for _, trajectory in parse_user_folder(user_folder_path, user_id in labeled_users):
+            trackpoints += len(trajectory)
+            points = list(zip(trajectory.altitude, trajectory.date_time))
+            gain = sum((b - a) * 0.3048 for (a, _), (b, _) in zip(points, points[1:]) if a >= -413 and b >= -413 and b > a)
+            gains[user_id] = gains.get(user_id, 0.0) + gain
+            max_gap = max(((t2 - t1).total_seconds() for (_, t1), (_, t2) in zip(points, points[1:])), default=0)
+            if max_gap >= INVALID_GAP_SECONDS:
+                invalid[user_id] = invalid.get(user_id, 0) + 1
+    return trackpoints, {user_id: gain for user_id, gain in gains.items() if gain > 0}, invalid
+
+
+@pytest.mark.parametrize("from_summaries", [True, False])
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_trackpoint_queries_in_every_layout(dataset, layout, from_summaries):
+    part2 = load(dataset, layout)
+    trackpoints, gains, invalid = reference(dataset)
+
+    assert part2.find_number_of(from_summaries=from_summaries)[2] == trackpoints
+
+    top_users = part2.find_altitude_gain_top_20_users(from_summaries=from_summaries)
+    assert dict(top_users) == pytest.approx(gains)
+    assert [gain for _, gain in top_users] == sorted((gain for _, gain in top_users), reverse=True)
+
+    # Without summaries the embedded layout runs MAX_GAP_SECONDS_EXPRESSION, whose $reduce mongomock
+    # does not implement. The expression is checked in test_mongo_expressions instead
+    if layout != "embedded" or from_summaries:
+        assert part2.find_invalid_activities(from_summaries=from_summaries) == invalid
+
+
+def test_generation_tells_fresh_databases_apart(dataset):
+    first = load(dataset, "embedded").dataset_generation()
+    second = load(dataset, "embedded").dataset_generation()
+    assert first.startswith("1-") and second.startswith("1-")
+    assert first != second
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_rollups_keep_up_with_the_written_activities(dataset, layout):
+    # An interrupted load: every activity is inserted, but the final flush never runs
+    client = mongomock.MongoClient()
+    connection = types.SimpleNamespace(client=client, db=client["geolife_test"], close_connection=lambda: None)
+    program = InsertGeolifeDatasetMongo(batch_documents=3, connection=connection, layout=layout)
+    labeled_users = read_labeled_users(dataset)
+    for user_id, user_folder_path in list_user_folders(dataset):
+        program.insert_parsed_activities(user_id, parse_user_folder(user_folder_path, user_id in labeled_users))
+
+    db = connection.db
+    written = list(db["Activity"].find({}, {"distance_km": 1, "trackpoint_count": 1}))
+    rollups = list(db["ActivityRollup"].find())
+    assert written and len(program.activity_writer.documents) < 3
+    assert sum(rollup["activity_count"] for rollup in rollups) == len(written)
+    assert sum(rollup["trackpoint_count"] for rollup in rollups) == sum(activity["trackpoint_count"] for activity in written)
+    assert sum(rollup["distance_km"] for rollup in rollups) == pytest.approx(sum(activity["distance_km"] for activity in written))
@@ -0,0 +1,52 @@
+import os
+import pytest
+from geolife.label_index import LABEL_MATCHES
+from geolife.parse_cache import build_parse_cache, cache_user_folder, iter_cached_users, read_labeled_users
+from geolife.plt_reader import MAX_TRACKPOINTS, list_user_folders, parse_user_folder
+from geolife_data import write_dataset
+
+
+def columns(activities):
+    return [(transportation_mode, trajectory.lat, trajectory.lon, trajectory.altitude, trajectory.date_days,
+             trajectory.date_time) for transportation_mode, trajectory in activities]
+
+
+@pytest.fixture
+def long_dataset(tmp_path):
+    """
+    A dataset where user 0 also has a file over the point cap.
+    """
+    return write_dataset(str(tmp_path / "dataset"), long_file_points=MAX_TRACKPOINTS + 100)
+
+
+@pytest.mark.parametrize("max_points", [MAX_TRACKPOINTS, 40, None])
+@pytest.mark.parametrize("label_match", LABEL_MATCHES)
+def test_cache_reads_back_what_parsing_returns(long_dataset, tmp_path, label_match, max_points):
+    labeled_users = read_labeled_users(long_dataset)
+    expected = [(user_id, user_id in labeled_users,
+                 columns(parse_user_folder(user_folder_path, user_id in labeled_users, label_match, max_points)))
+                for user_id, user_folder_path in list_user_folders(long_dataset)]
+
+    cached = [(user_id, has_labels, columns(activities)) for user_id, has_labels, activities
+              in iter_cached_users(long_dataset, str(tmp_path / "cache"), label_match, max_points)]
+
+    assert cached == expected
+    if max_points is None:
+        assert any(len(activity[5]) > MAX_TRACKPOINTS for activity in cached[0][2])
+
+
+def test_only_changed_users_are_parsed_again(dataset, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    build_parse_cache(dataset, cache_dir)
+    labeled_users = read_labeled_users(dataset)
+    user_folders = list_user_folders(dataset)
+    assert not any(cache_user_folder(user_id, path, user_id in labeled_users, cache_dir)[0] for user_id, path in user_folders)
+
+    user_id, user_folder_path = user_folders[1]
+    plt_path = os.path.join(user_folder_path, "Trajectory", sorted(os.listdir(os.path.join(user_folder_path, "Trajectory")))[0])
+    with open(plt_path, "a") as file:
+        file.write("39.9,116.4,0,100,39814.5,2009-01-01,12:00:00\r\n")
+    assert [cache_user_folder(user_id, path, user_id in labeled_users, cache_dir)[0]
+            for user_id, path in user_folders] == [user_id == 1 for user_id, _ in user_folders]
+    # Other label matching is a different cache
+    assert cache_user_folder(0, user_folders[0][1], 0 in labeled_users, cache_dir, "segment")[0]
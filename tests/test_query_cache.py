@@ -0,0 +1,104 @@
+import os
+from geolife.query_cache import QueryCache
+
+
+class Queries:
+    """
+    Stands in for Part2: counts how often each query really runs.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.generation = "1-aaaa"
+
+    def count(self, table, limit=None):
+        self.runs += 1
+        print(f"counting {table}")
+        return [table, limit, self.runs]
+
+    def dataset_generation(self):
+        return self.generation
+
+
+def wrapped(path=None, scope=()):
+    queries = Queries()
+    cache = QueryCache(path=path)
+    cache.wrap(queries, ["count"], queries.dataset_generation, scope=scope)
+    return queries, cache
+
+
+def test_hit_returns_the_result_and_output_without_running(capsys):
+    queries, cache = wrapped()
+    first = queries.count("User")
+    assert capsys.readouterr().out == "counting User\n"
+    assert queries.count("User") == first
+    assert capsys.readouterr().out == "counting User\n"
+    assert queries.runs == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_other_arguments_miss():
+    queries, cache = wrapped()
+    queries.count("User")
+    queries.count("Activity")
+    queries.count("User", limit=10)
+    assert queries.runs == 3
+    assert cache.hits == 0
+
+
+def test_new_generation_misses_and_prune_drops_old_results(tmp_path):
+    queries, cache = wrapped(str(tmp_path))
+    queries.count("User")
+    queries.generation = "2-bbbb"
+    assert queries.count("User")[2] == 2
+    assert queries.count("User")[2] == 2
+    cache.prune(queries.generation)
+    assert [name.startswith("2-bbbb-") for name in os.listdir(tmp_path)] == [True]
+
+
+def test_new_database_with_the_same_counter_misses(tmp_path):
+    # A wiped database starts the counter over, only the load ID tells the loads apart
+    queries, _ = wrapped(str(tmp_path))
+    queries.count("User")
+    queries, _ = wrapped(str(tmp_path))
+    queries.generation = "1-cccc"
+    assert queries.count("User")[2] == 1
+    assert queries.runs == 1
+
+
+def test_other_scope_misses(tmp_path):
+    standard, _ = wrapped(str(tmp_path), scope=("standard",))
+    standard.count("User")
+    compact, _ = wrapped(str(tmp_path), scope=("compact",))
+    compact.count("User")
+    assert compact.runs == 1
+    again, cache = wrapped(str(tmp_path), scope=("standard",))
+    again.count("User")
+    assert again.runs == 0
+    assert cache.hits == 1
+
+
+def test_disk_results_survive_the_process(tmp_path):
+    queries, _ = wrapped(str(tmp_path))
+    first = queries.count("User")
+    queries, cache = wrapped(str(tmp_path))
+    assert queries.count("User") == first
+    assert queries.runs == 0
+    assert cache.hits == 1
+
+
+def test_unversioned_data_is_not_cached(tmp_path):
+    queries, cache = wrapped(str(tmp_path))
+    queries.generation = None
+    queries.count("User")
+    queries.count("User")
+    assert queries.runs == 2
+    assert len(cache) == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_lru_keeps_the_most_recent_results():
+    cache = QueryCache(capacity=2)
+    for key in ("a", "b", "a", "c"):
+        cache.put(key, (key, ""))
+    assert list(cache.entries) == ["a", "c"]
@@ -0,0 +1,85 @@
+import math
+import pytest
+import geolife.trackpoint_store
+from geolife.parse_cache import read_labeled_users
+from geolife.plt_reader import INVALID_GAP_SECONDS, list_user_folders, parse_user_folder
+from geolife.trackpoint_store import TrackPointStore, build_store
+from geolife_data import FORBIDDEN_CITY_POINT
+
+
+def naive_metrics(trajectory):
+    """
+    The distance, altitude gain and longest gap of a parsed activity, step by step.
+    """
+    distance, gain, max_gap = 0.0, 0.0, 0
+    points = list(zip(trajectory.lat, trajectory.lon, trajectory.altitude, trajectory.date_time))
+    for (lat1, lon1, altitude1, time1), (lat2, lon2, altitude2, time2) in zip(points, points[1:]):
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        distance += 2 * 6378.137 * math.asin(math.sqrt(a))
+        if altitude1 >= -413 and altitude2 >= -413 and altitude2 > altitude1:
+            gain += (altitude2 - altitude1) * 0.3048
+        max_gap = max(max_gap, int((time2 - time1).total_seconds()))
+    return distance, gain, max_gap
+
+
+def parsed_activities(dataset):
+    labeled_users = read_labeled_users(dataset)
+    return [(user_id, transportation_mode, trajectory)
+            for user_id, user_folder_path in list_user_folders(dataset)
+            for transportation_mode, trajectory in parse_user_folder(user_folder_path, user_id in labeled_users)]
+
+
+@pytest.fixture
+def store(dataset, tmp_path):
+    build_store(dataset, str(tmp_path / "store"))
+    return TrackPointStore.open(str(tmp_path / "store"))
+
+
+# Chunks of a few points split and isolate activities, large ones hold several whole activities
+@pytest.mark.parametrize("chunk_points", [1, 7, 50, 1 << 22])
+def test_metrics_match_stepping_through_each_activity(dataset, store, monkeypatch, chunk_points):
+    monkeypatch.setattr(geolife.trackpoint_store, "CHUNK_POINTS", chunk_points)
+    activities = parsed_activities(dataset)
+    metrics = store.compute_metrics()
+
+    assert len(store.activities) == len(activities)
+    for index, (_, _, trajectory) in enumerate(activities):
+        distance, gain, max_gap = naive_metrics(trajectory)
+        assert metrics["distance_km"][index] == pytest.approx(distance, abs=1e-9)
+        assert metrics["altitude_gain_m"][index] == pytest.approx(gain, abs=1e-9)
+        assert metrics["max_gap_seconds"][index] == max_gap
+
+    # A range of activities that starts and stops mid-store
+    first, stop = 3, len(activities) - 2
+    partial = store.compute_metrics(first, stop)
+    for field in metrics:
+        assert partial[field] == pytest.approx(metrics[field][first:stop])
+
+
+@pytest.mark.parametrize("chunk_points", [7, 1 << 22])
+def test_queries_match_the_parsed_activities(dataset, store, monkeypatch, chunk_points):
+    monkeypatch.setattr(geolife.trackpoint_store, "CHUNK_POINTS", chunk_points)
+    activities = parsed_activities(dataset)
+    gains, invalid, distances, forbidden_city = {}, {}, {}, set()
+    for user_id, transportation_mode, trajectory in activities:
+        distance, gain, max_gap = naive_metrics(trajectory)
+        gains[user_id] = gains.get(user_id, 0.0) + gain
+        if max_gap >= INVALID_GAP_SECONDS:
+            invalid[user_id] = invalid.get(user_id, 0) + 1
+        key = (user_id, transportation_mode, trajectory.start_time.year)
+        distances[key] = distances.get(key, 0.0) + distance
+        if FORBIDDEN_CITY_POINT in zip(trajectory.lat, trajectory.lon):
+            forbidden_city.add(user_id)
+
+    assert store.find_number_of() == (len(list_user_folders(dataset)), len(activities),
+                                      sum(len(trajectory) for _, _, trajectory in activities))
+    assert dict(store.find_altitude_gain_top_20_users()) == pytest.approx({user: gain for user, gain in gains.items() if gain > 0})
+    assert store.find_invalid_activities() == sorted(invalid.items())
+    assert store.find_users_in_forbidden_city() == [(user_id,) for user_id in sorted(forbidden_city)]
+
+    result = store.find_distance_per_user_mode_year(show=False)
+    assert {(user, mode, year): distance for user, mode, year, distance in result} == pytest.approx(distances)
+    # With a user, only the user's slice of the store is read
+    assert store.find_distance_per_user_mode_year(user_id=1, show=False) == pytest.approx([row for row in result if row[0] == 1])